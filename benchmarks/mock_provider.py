@@ -0,0 +1,608 @@
+#!/usr/bin/env python
+"""A local OpenAI-compatible and Bedrock stub server for benchmarks.
+
+Serves `POST /v1/chat/completions` (with streaming and tool calls) and
+Bedrock's `POST /model/{model}/invoke` and `invoke-with-response-stream`,
+with configurable latency, jitter and error rate. Bedrock requests are
+checked against their model family's documented body and prompt format
+(Anthropic Messages, Titan Text, Llama 2 and 3, Mistral and Cohere Command R),
+rejected with a 400 ValidationException when they don't match, and answered
+in the family's response and stream format. It also stores S3 objects (path-style `PUT`, ranged
+`GET`, `HEAD` and multipart uploads) in memory. `GET /stats` returns request
+counts. It can be started from a benchmark with `start_mock_provider` or on
+its own:
+
+    python benchmarks/mock_provider.py --port 8080 --latency 0.2 --stream-interval 0.01
+
+Point odin at it with `OPENAI_BASE_URL=http://127.0.0.1:8080/v1`,
+`AWS_ENDPOINT_URL_BEDROCK_RUNTIME=http://127.0.0.1:8080` and
+`AWS_ENDPOINT_URL_S3=http://127.0.0.1:8080`.
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+BEDROCK_INVOKE_PATTERN = re.compile(
+    r"^/model/([^/]+)/(invoke|invoke-with-response-stream)$"
+)
+
+default_mock_settings = {
+    # Seconds before each response, plus or minus up to `jitter` seconds
+    "latency": 0.0,
+    "jitter": 0.0,
+    # Share of requests answered with a 429 (with Retry-After) or a 500
+    "error_rate": 0.0,
+    # Words in each completion, and seconds between streamed chunks
+    "completion_words": 50,
+    "stream_interval": 0.0,
+    # Tool calls returned when a request offers tools
+    "tool_calls": 3,
+}
+
+
+# Function to check the roles of an Anthropic Messages conversation
+def check_anthropic(body):
+    if body.get("anthropic_version") != "bedrock-2023-05-31":
+        return "anthropic_version must be bedrock-2023-05-31"
+    if not isinstance(body.get("max_tokens"), int):
+        return "max_tokens is required"
+    messages = body.get("messages") or []
+    roles = [message.get("role") for message in messages]
+    expected = ["user", "assistant"] * len(roles)
+    if not roles or roles != expected[: len(roles)] or roles[-1] != "user":
+        return "messages must alternate user/assistant, from and to a user turn"
+    if not all(isinstance(message.get("content"), str) for message in messages):
+        return "message content must be text"
+    if "system" in body and not isinstance(body["system"], str):
+        return "system must be text"
+    return None
+
+
+def anthropic_events(words):
+    events = [{"type": "message_start", "message": {"id": "msg_mock"}}]
+    events += [
+        {
+            "type": "content_block_delta",
+            "index": 0,
+            "delta": {"type": "text_delta", "text": f"{word} "},
+        }
+        for word in words
+    ]
+    events += [
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn"},
+            "usage": {"output_tokens": len(words)},
+        },
+        {"type": "message_stop"},
+    ]
+    return events
+
+
+def check_titan(body):
+    text = body.get("inputText")
+    if not isinstance(text, str) or not text.endswith("Bot:"):
+        return "inputText must end with the Bot: turn"
+    if not isinstance(
+        (body.get("textGenerationConfig") or {}).get("maxTokenCount"), int
+    ):
+        return "textGenerationConfig.maxTokenCount is required"
+    return None
+
+
+# The prompt formats of Llama 3, Llama 2 and Mistral, ending on the model's turn
+LLAMA3_PROMPT_PATTERN = re.compile(
+    r"<\|begin_of_text\|>"
+    r"(<\|start_header_id\|>(system|user|assistant)<\|end_header_id\|>\n\n"
+    r"(?:(?!<\|).)*<\|eot_id\|>)+"
+    r"<\|start_header_id\|>assistant<\|end_header_id\|>\n\n",
+    re.DOTALL,
+)
+LLAMA2_PROMPT_PATTERN = re.compile(
+    r"<s>\[INST\] (<<SYS>>\n(?:(?!<<).)*\n<</SYS>>\n\n)?(?:(?!\[INST\]|<<).)* \[/INST\]"
+    r"( (?:(?!\[INST\]).)* </s><s>\[INST\] (?:(?!\[INST\]|<<).)* \[/INST\])*",
+    re.DOTALL,
+)
+MISTRAL_PROMPT_PATTERN = re.compile(
+    r"<s>\[INST\] (?:(?!\[INST\]|<s>).)* \[/INST\]"
+    r"( (?:(?!\[INST\]|<s>).)*</s>\[INST\] (?:(?!\[INST\]|<s>).)* \[/INST\])*",
+    re.DOTALL,
+)
+
+
+# Function to make a check of a prompt-string body against a prompt format
+def prompt_check(pattern, length_key):
+    def check(body):
+        if not pattern.fullmatch(body.get("prompt") or ""):
+            return "prompt doesn't follow the model's chat format"
+        if not isinstance(body.get(length_key), int):
+            return f"{length_key} is required"
+        return None
+
+    return check
+
+
+def check_cohere(body):
+    if not isinstance(body.get("message"), str) or not body["message"]:
+        return "message is required"
+    for turn in body.get("chat_history") or []:
+        if turn.get("role") not in ("USER", "CHATBOT") or not isinstance(
+            turn.get("message"), str
+        ):
+            return "chat_history turns need a USER or CHATBOT role and a message"
+    return None
+
+
+def cohere_events(words):
+    events = [{"is_finished": False, "event_type": "stream-start"}]
+    events += [
+        {"is_finished": False, "event_type": "text-generation", "text": f"{word} "}
+        for word in words
+    ]
+    events += [
+        {"is_finished": True, "event_type": "stream-end", "finish_reason": "COMPLETE"}
+    ]
+    return events
+
+
+# Bedrock model families by model id prefix: the check of a request body, the
+# response to it and the events of a streamed response, as documented for
+# each family's InvokeModel API
+BEDROCK_FAMILIES = {
+    "anthropic.": {
+        "check": check_anthropic,
+        "response": lambda text, model, input_tokens: {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {
+                "input_tokens": input_tokens,
+                "output_tokens": len(text.split()),
+            },
+        },
+        "events": anthropic_events,
+    },
+    "amazon.titan-text": {
+        "check": check_titan,
+        "response": lambda text, model, input_tokens: {
+            "results": [{"outputText": text, "completionReason": "FINISH"}]
+        },
+        "events": lambda words: [
+            {
+                "outputText": f"{word} ",
+                "index": 0,
+                "completionReason": "FINISH" if index == len(words) - 1 else None,
+            }
+            for index, word in enumerate(words)
+        ],
+    },
+    "meta.llama3": {
+        "check": prompt_check(LLAMA3_PROMPT_PATTERN, "max_gen_len"),
+        "response": lambda text, model, input_tokens: {
+            "generation": text,
+            "stop_reason": "stop",
+        },
+        "events": lambda words: [
+            {
+                "generation": f"{word} ",
+                "stop_reason": "stop" if index == len(words) - 1 else None,
+            }
+            for index, word in enumerate(words)
+        ],
+    },
+    "meta.llama2": {
+        "check": prompt_check(LLAMA2_PROMPT_PATTERN, "max_gen_len"),
+        "response": lambda text, model, input_tokens: {
+            "generation": text,
+            "stop_reason": "stop",
+        },
+        "events": lambda words: [
+            {
+                "generation": f"{word} ",
+                "stop_reason": "stop" if index == len(words) - 1 else None,
+            }
+            for index, word in enumerate(words)
+        ],
+    },
+    "mistral.": {
+        "check": prompt_check(MISTRAL_PROMPT_PATTERN, "max_tokens"),
+        "response": lambda text, model, input_tokens: {
+            "outputs": [{"text": text, "stop_reason": "stop"}]
+        },
+        "events": lambda words: [
+            {
+                "outputs": [
+                    {
+                        "text": f"{word} ",
+                        "stop_reason": "stop" if index == len(words) - 1 else None,
+                    }
+                ]
+            }
+            for index, word in enumerate(words)
+        ],
+    },
+    "cohere.command-r": {
+        "check": check_cohere,
+        "response": lambda text, model, input_tokens: {
+            "response_id": "mock",
+            "text": text,
+            "finish_reason": "COMPLETE",
+        },
+        "events": cohere_events,
+    },
+}
+
+
+# Function to get the family of a Bedrock model id, without its region prefix
+def bedrock_family(model):
+    model = re.sub(r"^(us|eu|apac)\.", "", unquote(model))
+    for prefix, family in BEDROCK_FAMILIES.items():
+        if model.startswith(prefix):
+            return family
+    return None
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this, Nagle's algorithm
+    # and delayed ACKs add 40ms to every request on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.lock:
+                self.send_json(200, dict(self.server.stats))
+            return
+        with self.server.lock:
+            data = self.server.objects.get(unquote(urlsplit(self.path).path))
+        if data is None:
+            self.send_xml(404, "<Error><Code>NoSuchKey</Code></Error>")
+            return
+        status = 200
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(data) - 1)
+            status, data = 206, data[start : end + 1]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        with self.server.lock:
+            data = self.server.objects.get(unquote(urlsplit(self.path).path))
+        self.send_response(404 if data is None else 200)
+        self.send_header("Content-Length", str(len(data or b"")))
+        self.end_headers()
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            if "uploadId" in query:
+                parts = self.server.uploads[query["uploadId"][0]]
+                parts[int(query["partNumber"][0])] = data
+                self.server.stats["s3_parts"] += 1
+            else:
+                self.server.objects[unquote(url.path)] = data
+                self.server.stats["s3_objects"] += 1
+        self.send_response(200)
+        self.send_header("ETag", f'"{zlib.crc32(data):08x}"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        if "uploads" in query or "uploadId" in query:
+            self.s3_multipart(unquote(url.path), query)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        settings = self.server.settings
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+
+        delay = settings["latency"] + random.uniform(
+            -settings["jitter"], settings["jitter"]
+        )
+        time.sleep(max(0.0, delay))
+
+        if random.random() < settings["error_rate"]:
+            with self.server.lock:
+                self.server.stats["errors"] += 1
+            if random.random() < 0.5:
+                self.send_json(
+                    429,
+                    {"error": {"message": "rate limited", "type": "rate_limit"}},
+                    {"Retry-After": "0"},
+                )
+            else:
+                self.send_json(500, {"error": {"message": "server error"}})
+            return
+
+        match = BEDROCK_INVOKE_PATTERN.match(self.path)
+        if match and not self.check_bedrock_body(match.group(1), body):
+            return
+        if match and match.group(2) == "invoke":
+            self.bedrock_invoke(match.group(1), body)
+        elif match:
+            self.bedrock_stream(match.group(1), body)
+        elif self.path.endswith("/chat/completions"):
+            self.chat_completion(body)
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def chat_completion(self, body):
+        message = {"role": "assistant", "content": completion_text(self.server)}
+        last_role = (body.get("messages") or [{}])[-1].get("role")
+        if body.get("tools") and last_role != "tool":
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    mock_tool_call(body["tools"][0], index)
+                    for index in range(self.server.settings["tool_calls"])
+                ],
+            }
+        usage = {
+            "prompt_tokens": len(json.dumps(body.get("messages"))) // 4,
+            "completion_tokens": len((message["content"] or "").split()),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if body.get("stream"):
+            self.stream_completion(body["model"], message, usage)
+            return
+        self.send_json(
+            200,
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": usage,
+            },
+        )
+
+    def stream_completion(self, model, message, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_chunk(choices, **fields):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                **fields,
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+        for index, tool_call in enumerate(message.get("tool_calls") or []):
+            delta = {"tool_calls": [{"index": index, **tool_call}]}
+            send_chunk([{"index": 0, "delta": delta, "finish_reason": None}])
+        for word in (message["content"] or "").split():
+            delta = {"content": f"{word} "}
+            send_chunk([{"index": 0, "delta": delta, "finish_reason": None}])
+            time.sleep(self.server.settings["stream_interval"])
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        send_chunk([], usage=usage)
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def check_bedrock_body(self, model, body):
+        """Answer requests that Bedrock would reject with a 400, as it does."""
+        family = bedrock_family(model)
+        error = family["check"](body) if family else f"unknown model family: {model}"
+        if error is None:
+            return True
+        with self.server.lock:
+            self.server.stats["invalid_requests"] += 1
+        self.send_json(
+            400, {"message": error}, {"x-amzn-ErrorType": "ValidationException"}
+        )
+        return False
+
+    def bedrock_invoke(self, model, body):
+        text = completion_text(self.server)
+        input_tokens = len(json.dumps(body)) // 4
+        self.send_json(
+            200,
+            bedrock_family(model)["response"](text, unquote(model), input_tokens),
+            {
+                "x-amzn-bedrock-input-token-count": str(input_tokens),
+                "x-amzn-bedrock-output-token-count": str(len(text.split())),
+            },
+        )
+
+    def bedrock_stream(self, model, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = completion_text(self.server).split()
+        events = bedrock_family(model)["events"](words)
+        # Bedrock adds the token counts of the whole response to the last chunk
+        events[-1]["amazon-bedrock-invocationMetrics"] = {
+            "inputTokenCount": len(json.dumps(body)) // 4,
+            "outputTokenCount": len(words),
+        }
+        for event in events:
+            self.write_chunk(event_stream_message(event))
+            time.sleep(self.server.settings["stream_interval"])
+        self.wfile.write(b"0\r\n\r\n")
+
+    def s3_multipart(self, path, query):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        bucket, _, key = path.lstrip("/").partition("/")
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = {}
+            self.send_xml(
+                200,
+                "<InitiateMultipartUploadResult>"
+                + f"<Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                + f"<UploadId>{upload_id}</UploadId>"
+                + "</InitiateMultipartUploadResult>",
+            )
+            return
+        with self.server.lock:
+            parts = self.server.uploads.pop(query["uploadId"][0])
+            self.server.objects[path] = b"".join(
+                parts[number] for number in sorted(parts)
+            )
+            self.server.stats["s3_objects"] += 1
+        self.send_xml(
+            200,
+            "<CompleteMultipartUploadResult>"
+            + f'<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>"mock"</ETag>'
+            + "</CompleteMultipartUploadResult>",
+        )
+
+    def write_chunk(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_xml(self, status, body):
+        data = f'<?xml version="1.0" encoding="UTF-8"?>{body}'.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to encode a Bedrock response stream chunk as an AWS event stream message
+def event_stream_message(event):
+    headers = b""
+    for name, value in (
+        (":event-type", "chunk"),
+        (":content-type", "application/json"),
+        (":message-type", "event"),
+    ):
+        headers += struct.pack(">B", len(name)) + name.encode()
+        headers += struct.pack(">BH", 7, len(value)) + value.encode()
+    payload = json.dumps(
+        {"bytes": base64.b64encode(json.dumps(event).encode()).decode()}
+    ).encode()
+    prelude = struct.pack(">II", 12 + len(headers) + len(payload) + 4, len(headers))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + headers + payload
+    return message + struct.pack(">I", zlib.crc32(message))
+
+
+# Function to make up the text of a completion
+def completion_text(server):
+    return " ".join(["lorem"] * server.settings["completion_words"])
+
+
+# Function to make up a call to a tool, filling in its required arguments
+def mock_tool_call(tool, index):
+    function = tool["function"]
+    parameters = function.get("parameters", {})
+    arguments = {
+        name: (
+            f"tool-output/{function['name']}-{time.time_ns()}-{index}.txt"
+            if name == "path"
+            else f"{name} {index}"
+        )
+        for name in parameters.get("required", [])
+    }
+    return {
+        "id": f"call_{time.time_ns()}_{index}",
+        "type": "function",
+        "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+    }
+
+
+# Function to start the mock provider on a background thread
+def start_mock_provider(port=0, **settings):
+    """Start the server and return it; its URL is `server.url`."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockProviderHandler)
+    server.daemon_threads = True
+    server.settings = dict(default_mock_settings, **settings)
+    server.stats = {
+        "requests": 0,
+        "errors": 0,
+        "invalid_requests": 0,
+        "s3_objects": 0,
+        "s3_parts": 0,
+    }
+    # S3 objects by `/bucket/key`, and the parts of unfinished multipart uploads
+    server.objects = {}
+    server.uploads = {}
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Function to get the environment variables that point odin at the mock provider
+def mock_provider_env(server):
+    return {
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+        "AWS_ENDPOINT_URL_BEDROCK_RUNTIME": server.url,
+        "AWS_ENDPOINT_URL_S3": server.url,
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    for name, default in default_mock_settings.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=type(default), default=default
+        )
+    args = parser.parse_args()
+
+    settings = {name: getattr(args, name) for name in default_mock_settings}
+    server = start_mock_provider(args.port, **settings)
+    print(f"Mock provider listening on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Cold-start latency of the `odin` CLI.
+
+Times `odin --help` and a complete `odin ask openai` round trip against a
+local stub server, each in a fresh interpreter, and prints the results as
+JSON. Run from the repository root:
+
+    python benchmarks/startup.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from mock_provider import mock_provider_env, start_mock_provider
+from suite import ODIN, REPO_ROOT, time_command
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command")
+    args = parser.parse_args()
+
+    server = start_mock_provider(completion_words=1)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPO_ROOT,
+            HOME=cwd,
+            XDG_CACHE_HOME=os.path.join(cwd, "cache"),
+            **mock_provider_env(server),
+        )
+        results = {
+            "odin --help": time_command(ODIN + ["--help"], env, cwd, args.runs),
+            "odin ask openai": time_command(
+                ODIN + ["ask", "openai", "--no-cache", "ping"], env, cwd, args.runs
+            ),
+        }
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""End-to-end benchmarks of odin against a local mock provider.
+
+Measures cold start (in-process and handed to `odin serve`), spec parse
+throughput, `odin run` latency for specs of several sizes (sequential, fanned
+out and tool-call heavy) and `odin ask` round trips to OpenAI and Bedrock, and
+prints the results as JSON. Run from
+the repository root:
+
+    python benchmarks/suite.py --runs 5 --latency 0.05 --output results.json
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from mock_provider import default_mock_settings, mock_provider_env, start_mock_provider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+ODIN = [sys.executable, "-m", "odin_cli.daemon"]
+
+# `odin run` scenarios: (messages, layout, streamed)
+RUN_SCENARIOS = {
+    "run 5 messages": (5, "sequential", False),
+    "run 20 messages": (20, "sequential", False),
+    "run 50 messages": (50, "sequential", False),
+    "run 20 messages streamed": (20, "sequential", True),
+    "run 20 messages fanned out": (20, "fanout", False),
+    "run 10 messages with tool calls": (10, "tools", False),
+    "run 20 bedrock messages": (20, "bedrock", False),
+    "run 20 bedrock messages streamed": (20, "bedrock", True),
+}
+
+# A model of each Bedrock model family, run on a short thread to check its
+# request and response formats against the mock provider
+BEDROCK_FAMILY_MODELS = {
+    "titan": "amazon.titan-text-express-v1",
+    "llama 3": "meta.llama3-8b-instruct-v1:0",
+    "llama 2": "meta.llama2-13b-chat-v1",
+    "mistral": "mistral.mistral-7b-instruct-v0:2",
+    "cohere": "cohere.command-r-v1:0",
+}
+for family, model in BEDROCK_FAMILY_MODELS.items():
+    RUN_SCENARIOS[f"run 3 bedrock {family} messages"] = (3, f"bedrock:{model}", False)
+    RUN_SCENARIOS[f"run 3 bedrock {family} messages streamed"] = (
+        3,
+        f"bedrock:{model}",
+        True,
+    )
+
+
+# Function to summarize a list of durations in milliseconds
+def summarize(durations):
+    return {
+        "runs": len(durations),
+        "min_ms": round(min(durations) * 1000, 2),
+        "median_ms": round(statistics.median(durations) * 1000, 2),
+        "p95_ms": round(
+            sorted(durations)[math.ceil(len(durations) * 0.95) - 1] * 1000, 2
+        ),
+        "max_ms": round(max(durations) * 1000, 2),
+    }
+
+
+# Function to time a command over several runs in fresh interpreters
+def time_command(argv, env, cwd, runs):
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run(
+            argv,
+            env=env,
+            cwd=cwd,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        durations.append(time.perf_counter() - start_time)
+
+    return summarize(durations)
+
+
+# Function to time `odin ask` when it's handed to a running `odin serve`
+def benchmark_serve(env, cwd, runs):
+    socket_path = os.path.join(cwd, "serve.sock")
+    env = dict(env, ODIN_SOCKET=socket_path)
+    daemon = subprocess.Popen(
+        ODIN + ["serve"],
+        env=env,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.05)
+        return {
+            "odin ask openai": time_command(
+                ODIN + ["ask", "openai", "--no-cache", "ping"], env, cwd, runs
+            ),
+            "odin ask bedrock": time_command(
+                ODIN + ["ask", "bedrock", "--no-cache", "ping"], env, cwd, runs
+            ),
+        }
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+# Function to write a spec with a thread and `count` messages
+def make_spec(count, layout="sequential", content_words=50):
+    documents = ["---\nid: bench\ntype: thread\n---\nYou are a benchmark assistant.\n"]
+    for index in range(1, count + 1):
+        metadata = [
+            f"id: message-{index}",
+            "type: message",
+            "thread_id: bench",
+            f"order: {index}",
+        ]
+        if layout == "fanout":
+            metadata.append("depends_on: []")
+        if layout == "tools":
+            metadata.append("response_handler: save_file")
+        if layout.startswith("bedrock"):
+            metadata.append("provider: bedrock")
+        if layout.startswith("bedrock:"):
+            metadata.append(f"model: {layout.split(':', 1)[1]}")
+        content = " ".join([f"Write about {{topic}} part {index}."] * content_words)
+        documents.append("---\n" + "\n".join(metadata) + f"\n---\n{content}\n")
+    return "".join(documents)
+
+
+# Function to time parsing specs, cold and from the parse cache
+def benchmark_spec_parse(cache_dir, runs):
+    from odin_cli.spec import open_chat, parse_chat
+
+    results = {}
+    for count in (10, 100, 1000):
+        text = make_spec(count)
+        durations = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            parse_chat(io.StringIO(text))
+            durations.append(time.perf_counter() - start_time)
+
+        path = os.path.join(cache_dir, f"spec-{count}.md")
+        with open(path, "w") as file:
+            file.write(text)
+        open_chat(path)
+        cached_durations = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            open_chat(path)
+            cached_durations.append(time.perf_counter() - start_time)
+
+        results[f"{count} messages"] = {
+            "bytes": len(text.encode("utf-8")),
+            "cold": summarize(durations),
+            "cached": summarize(cached_durations),
+            "messages_per_second": round(count / statistics.median(durations)),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per benchmark")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stream-interval", type=float, default=0.0)
+    parser.add_argument("--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    server = start_mock_provider(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        stream_interval=args.stream_interval,
+    )
+
+    with tempfile.TemporaryDirectory() as cwd:
+        # Keep the user's config and caches out of the measurements
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPO_ROOT,
+            HOME=cwd,
+            XDG_CACHE_HOME=os.path.join(cwd, "cache"),
+            **mock_provider_env(server),
+        )
+        os.environ["XDG_CACHE_HOME"] = env["XDG_CACHE_HOME"]
+
+        results = {
+            "cold_start": {
+                "odin --help": time_command(ODIN + ["--help"], env, cwd, args.runs),
+                "odin ask openai": time_command(
+                    ODIN + ["ask", "openai", "--no-cache", "ping"], env, cwd, args.runs
+                ),
+                "odin ask bedrock": time_command(
+                    ODIN + ["ask", "bedrock", "--no-cache", "ping"], env, cwd, args.runs
+                ),
+            },
+            "serve": benchmark_serve(env, cwd, args.runs),
+            "spec_parse": benchmark_spec_parse(cwd, args.runs),
+            "run": {},
+        }
+
+        for name, (count, layout, stream) in RUN_SCENARIOS.items():
+            spec_path = os.path.join(cwd, f"{name.replace(' ', '-')}.md")
+            with open(spec_path, "w") as file:
+                file.write(make_spec(count, layout, content_words=5))
+            argv = ODIN + ["run", spec_path, "topic=turtles", "--no-cache"]
+            argv += ["--output", os.path.join(cwd, "out"), "--silent"]
+            if stream:
+                argv.append("--stream")
+            results["run"][name] = time_command(argv, env, cwd, args.runs)
+
+    server.shutdown()
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=REPO_ROOT,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+            or None,
+        },
+        "mock_provider": dict(
+            default_mock_settings,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            stream_interval=args.stream_interval,
+            requests=server.stats["requests"],
+            errors=server.stats["errors"],
+            invalid_requests=server.stats["invalid_requests"],
+        ),
+        "results": results,
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if server.stats["invalid_requests"]:
+        sys.exit(
+            f"{server.stats['invalid_requests']} requests didn't follow "
+            "their Bedrock model family's format"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Async API for running odin from other programs.
+
+    import odin_cli.api as odin
+
+    answer = await odin.ask("openai", "Summarize {topic}", variables={"topic": "tides"})
+    async for chunk in odin.stream("bedrock", "Tell me a story"):
+        print(chunk, end="")
+    responses = await odin.run_spec("spec.md", {"topic": "tides"}, output_dir="out")
+
+Requests share one connection pool per provider on each event loop, and go
+through the same rate limits, retries, response cache, metrics and logs as
+the CLI, so many specs can run concurrently on one loop.
+"""
+
+import asyncio
+from odin_cli.cache import configure_cache
+from odin_cli.content import configure_content
+from odin_cli.clients import close_async_clients
+from odin_cli.engine import (
+    check_template_variables,
+    create_completion,
+    process_template,
+    provider_model,
+    run_batch,
+    run_thread,
+    stream_completion,
+)
+from odin_cli.logs import configure_logging, log_event
+from odin_cli.metrics import configure_metrics
+from odin_cli.output import is_directory_output, open_output_async
+from odin_cli.printer import MessagePrinter
+from odin_cli.profiling import profiler
+from odin_cli.ratelimit import configure_rate_limits
+from odin_cli.router import configure_router
+from odin_cli.sources import configure_sources, resolve_source_variables
+from odin_cli.spec import get_chat_items, open_chat
+
+DEFAULT_SYSTEM = "You are a helpful assistant."
+
+# Event loop of `odin serve`, which keeps its clients (and their connection
+# pools) open between commands
+shared_loop = None
+
+
+class ResponseStream:
+    """An async iterator over the text of a response as it's generated.
+
+    Once it's exhausted, `response` holds the whole response in the shape of a
+    chat completion and `metrics` its latency metrics.
+    """
+
+    def __init__(self, open_stream):
+        self.open_stream = open_stream
+        self.response = None
+        self.metrics = None
+
+    async def __aiter__(self):
+        completion = await self.open_stream()
+        async for chunk in completion:
+            yield chunk
+        self.response = completion.response
+        self.metrics = completion.metrics
+
+
+# Function to fill in a prompt's template variables, fetching `@source` values
+async def render_prompt(prompt, variables):
+    if not variables:
+        return prompt
+    variables = await asyncio.to_thread(resolve_source_variables, variables)
+    return process_template(prompt, variables)
+
+
+# Function to send a single prompt and return the whole response
+async def complete(
+    provider,
+    prompt,
+    model=None,
+    variables=None,
+    system=DEFAULT_SYSTEM,
+    temperature=0,
+    max_tokens=None,
+):
+    """Return the response to `prompt` in the shape of a chat completion."""
+    model = provider_model(provider, model)
+    prompt = await render_prompt(prompt, variables)
+    return await create_completion(
+        provider,
+        model=model,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+
+
+# Function to send a single prompt and return the text of the response
+async def ask(provider, prompt, model=None, variables=None, **options):
+    """Return the text of the response to `prompt`.
+
+    `variables` fill in the prompt's template variables; `system`,
+    `temperature` and `max_tokens` are passed on to `complete`.
+    """
+    response = await complete(provider, prompt, model, variables, **options)
+    return response["choices"][0]["message"]["content"]
+
+
+# Function to stream the response to a single prompt
+def stream(
+    provider,
+    prompt,
+    model=None,
+    variables=None,
+    system=DEFAULT_SYSTEM,
+    temperature=0,
+    max_tokens=None,
+):
+    """Return a `ResponseStream` over the text of the response to `prompt`.
+
+    The request is sent once iteration starts.
+    """
+    model = provider_model(provider, model)
+
+    async def open_stream():
+        rendered = await render_prompt(prompt, variables)
+        return stream_completion(
+            provider,
+            model=model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": rendered},
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+    return ResponseStream(open_stream)
+
+
+# Function to parse a spec into its thread and its messages
+def open_spec(path):
+    with profiler.span("open_chat", "parse", path=path):
+        chat = open_chat(path)
+    thread = get_chat_items(chat, type="thread")[0]
+    messages = get_chat_items(chat, type="message", sort="order")
+    return thread, messages
+
+
+# Function to check that an incremental run has a directory to replay from
+def check_incremental_output(output_dir, incremental):
+    """Replayed messages are read back from their output files. S3 prefixes
+    aren't read back, and archives are rewritten whole by every run, so
+    replayed messages would be missing from the new one."""
+    if incremental and not is_directory_output(output_dir):
+        raise ValueError(
+            "Incremental runs need a directory output, "
+            f"not an archive or S3 prefix: '{output_dir}'."
+        )
+
+
+# Function to run a spec
+async def run_spec(
+    path,
+    variables=None,
+    output_dir=".",
+    concurrency=4,
+    stream=False,
+    strict=False,
+    printer=None,
+    incremental=False,
+):
+    """Run the spec at `path` and return its responses by message id.
+
+    Responses are saved under `output_dir` as they arrive, which may also be a
+    `.tar`, `.tar.gz` or `.zip` archive or an `s3://` prefix. With `strict`, a
+    missing template variable raises a TemplateError before anything is sent.
+    With `incremental`, messages whose requests haven't changed since the last
+    run into `output_dir` are replayed from it (their responses are marked
+    `replayed`) rather than sent.
+    `printer` (a `MessagePrinter`) shows the messages as they run; by default
+    nothing is printed.
+    """
+    check_incremental_output(output_dir, incremental)
+    printer = printer or MessagePrinter("silent")
+    thread, messages = await asyncio.to_thread(open_spec, path)
+    variables = await asyncio.to_thread(resolve_source_variables, variables or {})
+    check_template_variables(thread, messages, [variables], printer, strict=strict)
+
+    try:
+        async with open_output_async(output_dir):
+            return await run_thread(
+                messages,
+                thread,
+                variables,
+                output_dir,
+                printer,
+                concurrency,
+                stream,
+                incremental,
+            )
+    except Exception as e:
+        log_event(
+            event_type="ERROR",
+            message="chat errored",
+            context={
+                "thread_id": thread.get("metadata", {}).get("id"),
+                "error_message": f"Error: {str(e)}",
+            },
+        )
+        raise
+
+
+# Function to run a spec once for each of a list of variable sets
+async def run_spec_batch(
+    path,
+    variable_sets,
+    variables=None,
+    output_dir=".",
+    concurrency=4,
+    workers=4,
+    stream=False,
+    strict=False,
+    printer=None,
+    incremental=False,
+):
+    """Run the spec at `path` for every variable set and return a summary.
+
+    `variables` are added to every set. Each set writes to its own numbered
+    directory under `output_dir`; `workers` sets run at the same time.
+    """
+    check_incremental_output(output_dir, incremental)
+    printer = printer or MessagePrinter("silent")
+    thread, messages = await asyncio.to_thread(open_spec, path)
+    variables = await asyncio.to_thread(resolve_source_variables, variables or {})
+    variable_sets = [{**variable_set, **variables} for variable_set in variable_sets]
+    check_template_variables(thread, messages, variable_sets, printer, strict=strict)
+
+    async with open_output_async(output_dir):
+        return await run_batch(
+            messages,
+            thread,
+            variable_sets,
+            output_dir,
+            printer.verbosity_level,
+            concurrency,
+            workers,
+            stream,
+            incremental,
+        )
+
+
+# Function to apply an odin config to the shared services
+def configure(config=None, no_cache=False, log_file=None, log_level="INFO"):
+    """Apply `config` (by default `~/.config/odin/odin.yaml`) like the CLI does.
+
+    Events are only logged to a file when `log_file` is given.
+    """
+    from odin_cli.utils import load_config
+
+    config = load_config() if config is None else config
+    if log_file:
+        configure_logging(config, log_level=log_level, log_file=log_file)
+    configure_cache(config, no_cache=no_cache)
+    configure_content(config)
+    configure_sources(config)
+    configure_rate_limits(config)
+    configure_router(config)
+    configure_metrics(config)
+
+
+# Function to run a coroutine of this API to completion from synchronous code
+def run_sync(coroutine):
+    """Run `coroutine` on a new event loop and close its clients afterwards.
+
+    In `odin serve`, it runs on the daemon's loop instead, alongside the
+    commands of other clients.
+    """
+    if shared_loop is not None:
+        return asyncio.run_coroutine_threadsafe(coroutine, shared_loop).result()
+
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(main())
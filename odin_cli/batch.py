@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import re
+from odin_cli.bedrock_completions import completion_body, completion_response
+from odin_cli.cache import write_atomic
+from odin_cli.content import inline_tool_results
+from odin_cli.dag import get_ancestors, resolve_dependencies, topological_order
+from odin_cli.engine import (
+    add_tool_results,
+    check_template_variables,
+    inline_ids,
+    message_output_path,
+    message_request,
+    process_template,
+    save_response,
+)
+from odin_cli.logs import log_event
+from odin_cli.metrics import metric_labels, record_usage
+from odin_cli.output import open_output_async
+from odin_cli.profiling import profiler
+from odin_cli.router import ROUTER_PROVIDER
+from odin_cli.sources import resolve_source_variables
+from odin_cli.spec import get_chat_items, open_chat
+
+# Request files, results and progress of a batch live in this directory
+# under the output directory
+BATCH_DIR = "batch"
+
+
+# Function to get the round each message is sent in
+def dependency_rounds(dependencies):
+    """Number each message's round: one more than its latest dependency's."""
+    rounds = {}
+    for id in topological_order(dependencies):
+        rounds[id] = 1 + max((rounds[dep] for dep in dependencies[id]), default=0)
+    return rounds
+
+
+# Function to parse a spec and fingerprint its contents
+def read_spec(path):
+    with profiler.span("open_chat", "parse", path=path):
+        chat = open_chat(path)
+    thread = get_chat_items(chat, type="thread")[0]
+    messages = get_chat_items(chat, type="message", sort="order")
+    with open(path, "rb") as file:
+        spec_hash = hashlib.sha256(file.read()).hexdigest()
+    return thread, messages, spec_hash
+
+
+# Function to get the path of a batch's state file
+def state_path(output_dir):
+    return os.path.join(output_dir, BATCH_DIR, "state.json")
+
+
+# Function to load the state of a batch from its output directory
+def load_state(output_dir):
+    path = state_path(output_dir)
+    if not os.path.exists(path):
+        raise ValueError(f"No exported batch found in '{output_dir}'.")
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_state(state):
+    write_atomic(state_path(state["output_dir"]), json.dumps(state, indent=2))
+
+
+# Function to build a line of a provider's batch request file
+def batch_request_line(provider, custom_id, request):
+    if provider == ROUTER_PROVIDER:
+        raise ValueError("The router can't be used with provider batch APIs.")
+    if provider == "bedrock":
+        return {"recordId": custom_id, "modelInput": completion_body(request)}
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {key: value for key, value in request.items() if value is not None},
+    }
+
+
+# Function to write the request files of the batch's current round
+def export_round(state, thread, messages):
+    """Write one request file per provider and model, and return their paths.
+
+    Rounds without any request (every message disabled or every row failed)
+    are skipped.
+    """
+    messages_by_id = {message["metadata"].get("id"): message for message in messages}
+    dependencies = resolve_dependencies(messages)
+    rounds = dependency_rounds(dependencies)
+
+    lines = {}
+    while state["round"] <= state["rounds"]:
+        for row in state["rows"]:
+            if row["error"]:
+                continue
+            system_chat = [
+                {
+                    "role": "system",
+                    "content": process_template(
+                        thread.get("content", "").strip(), row["variables"]
+                    ),
+                }
+            ]
+            for id, message in messages_by_id.items():
+                if rounds[id] != state["round"]:
+                    continue
+                if message["metadata"].get("disabled", False):
+                    row["turns"][id] = []
+                    continue
+
+                content = process_template(
+                    message.get("content", "").strip(), row["variables"]
+                )
+                turn = [{"role": "user", "content": content}]
+                inline = inline_ids(message)
+                context = system_chat + [
+                    chat_item
+                    for ancestor in get_ancestors(dependencies, id)
+                    for chat_item in (
+                        inline_tool_results(row["turns"][ancestor])
+                        if inline is True or ancestor in inline
+                        else row["turns"][ancestor]
+                    )
+                ]
+                request = message_request(message, context + turn)
+                provider = message["metadata"].get("provider", "openai")
+                custom_id = f"{row['name']}/{id}" if row["name"] else id
+                state["pending"][custom_id] = {
+                    "row": row["name"],
+                    "message": id,
+                    "provider": provider,
+                    "model": request["model"],
+                    "turn": turn,
+                }
+                lines.setdefault((provider, request["model"]), []).append(
+                    batch_request_line(provider, custom_id, request)
+                )
+
+        if lines:
+            break
+        state["round"] += 1
+
+    paths = []
+    for (provider, model), requests in lines.items():
+        file_name = re.sub(
+            r"[^\w.-]", "_", f"round-{state['round']}-{provider}-{model}"
+        )
+        path = os.path.join(state["output_dir"], BATCH_DIR, f"{file_name}.jsonl")
+        write_atomic(path, "".join(json.dumps(line) + "\n" for line in requests))
+        paths.append(path)
+        log_event(
+            message="batch round exported",
+            context={
+                "round": state["round"],
+                "provider": provider,
+                "model": model,
+                "requests": len(requests),
+                "path": path,
+            },
+        )
+    save_state(state)
+    return paths
+
+
+# Function to export a spec's first round of requests for a provider batch API
+def export_batch(
+    path, variable_sets, variables=None, output_dir=".", printer=None, strict=False
+):
+    """Render the spec for every variable set and write the first round of
+    requests, without calling any provider.
+
+    Messages are sent in rounds: a message is in the round after its latest
+    dependency, so each round only needs the responses imported before it.
+    Returns the paths of the request files and the round they're for.
+    """
+    thread, messages, spec_hash = read_spec(path)
+    variables = resolve_source_variables(variables or {})
+    # Without variable sets the spec runs once, straight into `output_dir`
+    single = variable_sets is None
+    variable_sets = [
+        {**variable_set, **variables} for variable_set in variable_sets or [{}]
+    ]
+    if printer:
+        check_template_variables(
+            thread, messages, variable_sets, printer, strict=strict
+        )
+
+    # Rows get the numbered output directories of `odin run --vars-file`
+    width = len(str(len(variable_sets)))
+    state = {
+        "spec": os.path.abspath(path),
+        "spec_hash": spec_hash,
+        "output_dir": output_dir,
+        "round": 1,
+        "rounds": max(
+            dependency_rounds(resolve_dependencies(messages)).values(), default=0
+        ),
+        "rows": [
+            {
+                "name": "" if single else str(index + 1).zfill(width),
+                "variables": variable_set,
+                "turns": {},
+                "error": None,
+            }
+            for index, variable_set in enumerate(variable_sets)
+        ],
+        "pending": {},
+    }
+    paths = export_round(state, thread, messages)
+    return {"paths": paths, "round": state["round"], "rounds": state["rounds"]}
+
+
+# Function to read the response (or error) of a line of a batch results file
+def parse_result_line(record, pending):
+    """Return the custom id, the response as a chat completion and the error."""
+    if "recordId" in record:
+        custom_id = record["recordId"]
+        error = record.get("error")
+        if error or "modelOutput" not in record:
+            return custom_id, None, json.dumps(error or "no model output")
+        entry = pending.get(custom_id) or {}
+        output = record["modelOutput"]
+        response = completion_response(entry.get("model", ""), output, {})
+        # Batch output has no token count headers, but Claude reports its usage
+        usage = output.get("usage") or {}
+        if "input_tokens" in usage:
+            response["usage"] = {
+                "prompt_tokens": usage["input_tokens"],
+                "completion_tokens": usage.get("output_tokens", 0),
+                "total_tokens": usage["input_tokens"] + usage.get("output_tokens", 0),
+            }
+        return custom_id, response, None
+
+    custom_id = record.get("custom_id")
+    response = record.get("response") or {}
+    if record.get("error"):
+        return custom_id, None, json.dumps(record["error"])
+    if response.get("status_code") != 200:
+        body_error = (response.get("body") or {}).get("error") or {}
+        return (
+            custom_id,
+            None,
+            body_error.get("message") or f"status {response.get('status_code')}",
+        )
+    return custom_id, response["body"], None
+
+
+# Function to import batch results and export the next round
+async def import_batch(results_paths, output_dir="."):
+    """Save the responses in `results_paths` where `odin run` would, and write
+    the next round's request files once every response of this round is in.
+
+    Returns a summary of the import, including the new request files.
+    """
+    state = load_state(output_dir)
+    state["output_dir"] = output_dir
+    thread, messages, spec_hash = read_spec(state["spec"])
+    if spec_hash != state["spec_hash"]:
+        raise ValueError(
+            f"The spec '{state['spec']}' changed since the batch was exported."
+        )
+    messages_by_id = {message["metadata"].get("id"): message for message in messages}
+    rows = {row["name"]: row for row in state["rows"]}
+    summary = {"imported": 0, "failed": 0, "unknown": 0}
+    async with open_output_async(output_dir):
+        for results_path in results_paths:
+            with open(results_path, "r") as file:
+                records = [json.loads(line) for line in file if line.strip()]
+
+            for record in records:
+                custom_id, response, error = parse_result_line(record, state["pending"])
+                entry = state["pending"].pop(custom_id, None)
+                if entry is None:
+                    summary["unknown"] += 1
+                    continue
+
+                row = rows[entry["row"]]
+                message = messages_by_id[entry["message"]]
+                thread_id = message["metadata"].get("thread_id")
+                context = {"thread_id": thread_id, "message_id": entry["message"]}
+                if row["name"]:
+                    context["row"] = row["name"]
+                if error:
+                    summary["failed"] += 1
+                    row["error"] = f"Error: {error}"
+                    log_event(
+                        event_type="ERROR",
+                        message="batch response failed",
+                        context={**context, "error_message": row["error"]},
+                    )
+                    continue
+
+                labels = metric_labels.set(
+                    {"thread": thread_id or "", "message": entry["message"] or ""}
+                )
+                try:
+                    usage = response.get("usage") or {}
+                    record_usage(
+                        entry["provider"],
+                        entry["model"],
+                        usage.get("prompt_tokens"),
+                        usage.get("completion_tokens"),
+                    )
+                    turn = entry["turn"]
+                    if message["metadata"].get("response_handler"):
+                        await add_tool_results(message, turn, response)
+                    else:
+                        content = response["choices"][0]["message"]["content"]
+                        turn.append({"role": "assistant", "content": content})
+                        row_output_dir = (
+                            os.path.join(output_dir, row["name"])
+                            if row["name"]
+                            else output_dir
+                        )
+                        await save_response(
+                            message_output_path(message, row_output_dir), content
+                        )
+                finally:
+                    metric_labels.reset(labels)
+                row["turns"][entry["message"]] = turn
+                summary["imported"] += 1
+                log_event(
+                    message="batch response imported",
+                    context={**context, "response": response},
+                )
+
+    # Responses of failed rows won't be used
+    for custom_id, entry in list(state["pending"].items()):
+        if rows[entry["row"]]["error"]:
+            del state["pending"][custom_id]
+
+    summary["pending"] = len(state["pending"])
+    summary["paths"] = []
+    if state["pending"]:
+        save_state(state)
+    else:
+        state["round"] += 1
+        summary["paths"] = export_round(state, thread, messages)
+    summary.update(
+        round=state["round"],
+        rounds=state["rounds"],
+        failed_rows=[row["name"] or "-" for row in state["rows"] if row["error"]],
+    )
+    return summary
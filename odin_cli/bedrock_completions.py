@@ -0,0 +1,371 @@
+import json
+import time
+from odin_cli.cache import response_cache
+from odin_cli.clients import async_bedrock_client
+from odin_cli.completions import AsyncCompletionStream, CachedCompletionStream
+from odin_cli.metrics import record_usage
+from odin_cli.ratelimit import estimate_tokens, scheduler
+
+# Prefixes of cross-region inference profile ids, e.g. `us.anthropic.claude-...`
+REGION_PREFIXES = ("us.", "eu.", "apac.")
+
+
+# Function to split chat messages into the system prompt and the conversation
+def split_system(messages):
+    system = "\n\n".join(
+        message["content"] for message in messages if message["role"] == "system"
+    )
+    conversation = [message for message in messages if message["role"] != "system"]
+    return system, conversation
+
+
+# Function to build an Anthropic Messages API request body
+def anthropic_body(messages, max_tokens, temperature):
+    system, conversation = split_system(messages)
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": [
+            {"role": message["role"], "content": message["content"]}
+            for message in conversation
+        ],
+    }
+    if system:
+        body["system"] = system
+    return body
+
+
+def anthropic_response(payload):
+    text = "".join(
+        block.get("text", "")
+        for block in payload.get("content", [])
+        if block.get("type") == "text"
+    )
+    return text, payload.get("stop_reason")
+
+
+def anthropic_chunk(payload):
+    if payload.get("type") == "content_block_delta":
+        return payload["delta"].get("text"), None
+    if payload.get("type") == "message_delta":
+        return None, payload["delta"].get("stop_reason")
+    return None, None
+
+
+# Function to build an Amazon Titan Text request body
+def titan_body(messages, max_tokens, temperature):
+    system, conversation = split_system(messages)
+    lines = [system] if system else []
+    for message in conversation:
+        speaker = "User" if message["role"] == "user" else "Bot"
+        lines.append(f"{speaker}: {message['content']}")
+    lines.append("Bot:")
+    return {
+        "inputText": "\n".join(lines),
+        "textGenerationConfig": {
+            "maxTokenCount": max_tokens,
+            "temperature": temperature,
+        },
+    }
+
+
+def titan_response(payload):
+    result = (payload.get("results") or [{}])[0]
+    return result.get("outputText", ""), result.get("completionReason")
+
+
+def titan_chunk(payload):
+    return payload.get("outputText"), payload.get("completionReason")
+
+
+# Function to build a Meta Llama request body, with Llama 3's or Llama 2's chat format
+def llama_body(messages, max_tokens, temperature, llama3=True):
+    system, conversation = split_system(messages)
+    if llama3:
+        prompt = "<|begin_of_text|>"
+        if system:
+            conversation = [{"role": "system", "content": system}] + conversation
+        for message in conversation:
+            prompt += (
+                f"<|start_header_id|>{message['role']}<|end_header_id|>\n\n"
+                + f"{message['content']}<|eot_id|>"
+            )
+        prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
+    else:
+        prompt = ""
+        for message in conversation:
+            if message["role"] == "user":
+                content = message["content"]
+                if system and not prompt:
+                    content = f"<<SYS>>\n{system}\n<</SYS>>\n\n{content}"
+                prompt += f"<s>[INST] {content} [/INST]"
+            else:
+                prompt += f" {message['content']} </s>"
+    return {"prompt": prompt, "max_gen_len": max_tokens, "temperature": temperature}
+
+
+def llama_response(payload):
+    return payload.get("generation", ""), payload.get("stop_reason")
+
+
+# Function to build a Mistral request body
+def mistral_body(messages, max_tokens, temperature):
+    system, conversation = split_system(messages)
+    prompt = "<s>"
+    for message in conversation:
+        if message["role"] == "user":
+            content = message["content"]
+            if system and prompt == "<s>":
+                content = f"{system}\n\n{content}"
+            prompt += f"[INST] {content} [/INST]"
+        else:
+            prompt += f" {message['content']}</s>"
+    return {"prompt": prompt, "max_tokens": max_tokens, "temperature": temperature}
+
+
+def mistral_response(payload):
+    output = (payload.get("outputs") or [{}])[0]
+    return output.get("text", ""), output.get("stop_reason")
+
+
+# Function to build a Cohere Command R request body
+def cohere_body(messages, max_tokens, temperature):
+    system, conversation = split_system(messages)
+    roles = {"user": "USER", "assistant": "CHATBOT"}
+    body = {
+        "message": conversation[-1]["content"] if conversation else "",
+        "chat_history": [
+            {"role": roles[message["role"]], "message": message["content"]}
+            for message in conversation[:-1]
+        ],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    if system:
+        body["preamble"] = system
+    return body
+
+
+def cohere_response(payload):
+    return payload.get("text", ""), payload.get("finish_reason")
+
+
+def cohere_chunk(payload):
+    if payload.get("event_type") == "text-generation":
+        return payload.get("text"), None
+    return None, payload.get("finish_reason")
+
+
+# Request bodies and response parsers of the supported model families, by
+# model id prefix. `response` returns a response's text and stop reason, and
+# `chunk` the same for a chunk of a streamed response.
+MODEL_FAMILIES = {
+    "anthropic.": {
+        "body": anthropic_body,
+        "response": anthropic_response,
+        "chunk": anthropic_chunk,
+        "max_tokens": 4096,
+    },
+    "amazon.titan-text": {
+        "body": titan_body,
+        "response": titan_response,
+        "chunk": titan_chunk,
+        "max_tokens": 4096,
+    },
+    "meta.llama3": {
+        "body": llama_body,
+        "response": llama_response,
+        "chunk": llama_response,
+        "max_tokens": 2048,
+    },
+    "meta.llama2": {
+        "body": lambda *args: llama_body(*args, llama3=False),
+        "response": llama_response,
+        "chunk": llama_response,
+        "max_tokens": 2048,
+    },
+    "mistral.": {
+        "body": mistral_body,
+        "response": mistral_response,
+        "chunk": mistral_response,
+        "max_tokens": 4096,
+    },
+    "cohere.command-r": {
+        "body": cohere_body,
+        "response": cohere_response,
+        "chunk": cohere_chunk,
+        "max_tokens": 4000,
+    },
+}
+
+
+# Function to get the model family of a Bedrock model id
+def model_family(model):
+    base_model = model
+    for prefix in REGION_PREFIXES:
+        if base_model.startswith(prefix):
+            base_model = base_model[len(prefix) :]
+    for prefix, family in MODEL_FAMILIES.items():
+        if base_model.startswith(prefix):
+            return family
+    raise ValueError(
+        f"Unsupported Bedrock model '{model}'. Supported model families: "
+        + ", ".join(prefix.rstrip(".") for prefix in MODEL_FAMILIES)
+    )
+
+
+# Function to build the request body of a chat completion for a Bedrock model
+def completion_body(params):
+    if params.get("tools"):
+        raise ValueError("Tool calls aren't supported with Bedrock models.")
+    family = model_family(params["model"])
+    return family["body"](
+        params["messages"],
+        params.get("max_tokens") or family["max_tokens"],
+        params.get("temperature") or 0,
+    )
+
+
+# Function to get the usage of a Bedrock response from its token count headers
+def header_usage(headers):
+    if "x-amzn-bedrock-input-token-count" not in headers:
+        return None
+    prompt_tokens = int(headers["x-amzn-bedrock-input-token-count"])
+    completion_tokens = int(headers.get("x-amzn-bedrock-output-token-count", 0))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+# Function to turn an InvokeModel response into the shape of a chat completion
+def completion_response(model, payload, headers):
+    text, finish_reason = model_family(model)["response"](payload)
+    return {
+        "id": headers.get("x-amzn-requestid"),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": finish_reason,
+            }
+        ],
+        "usage": header_usage(headers)
+        or {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None},
+    }
+
+
+# Function to record the tokens used by a Bedrock completion
+def record_bedrock_usage(model, response):
+    usage = response.get("usage") or {}
+    record_usage(
+        "bedrock", model, usage.get("prompt_tokens"), usage.get("completion_tokens")
+    )
+
+
+class BedrockChunks:
+    """Assembles the chunks of a streamed InvokeModel response for a
+    `CompletionStream`.
+
+    The last chunk carries `amazon-bedrock-invocationMetrics`, which hold the
+    token counts of the whole response.
+    """
+
+    def __init__(self, model, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = model
+        self.family = model_family(model)
+        self.assembled["model"] = model
+
+    def add_chunk(self, chunk):
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+        payload = json.loads(chunk)
+        text, finish_reason = self.family["chunk"](payload)
+        if finish_reason:
+            self.assembled["finish_reason"] = finish_reason
+        invocation_metrics = payload.get("amazon-bedrock-invocationMetrics")
+        if invocation_metrics:
+            prompt_tokens = invocation_metrics.get("inputTokenCount") or 0
+            completion_tokens = invocation_metrics.get("outputTokenCount") or 0
+            self.assembled["usage"] = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+        if text:
+            self.content.append(text)
+        return text
+
+
+class AsyncBedrockCompletionStream(BedrockChunks, AsyncCompletionStream):
+    pass
+
+
+# Function to build the cache key of a Bedrock completion request
+def bedrock_cache_key(model, body):
+    return response_cache.key(provider="bedrock", model=model, body=body)
+
+
+# Function to send a chat completion request to a Bedrock model with the async client
+async def create_bedrock_completion_async(**params):
+    """Return the completion for OpenAI-style `params` as a chat completion
+    dict, from the cache if possible."""
+    model = params["model"]
+    body = completion_body(params)
+    key = bedrock_cache_key(model, body)
+    response = response_cache.get(key)
+    if response is None:
+
+        async def request():
+            result = await async_bedrock_client().invoke_model(
+                modelId=model, body=json.dumps(body)
+            )
+            return completion_response(
+                model, json.loads(result["body"]), result["headers"]
+            )
+
+        response = await scheduler.call_async(
+            "bedrock",
+            model,
+            request,
+            tokens=estimate_tokens(params["messages"], params.get("max_tokens")),
+            count_tokens=lambda response: response["usage"]["total_tokens"],
+        )
+        record_bedrock_usage(model, response)
+        response_cache.put(key, response)
+
+    return response
+
+
+# Function to stream a chat completion from a Bedrock model with the async client
+def stream_bedrock_completion_async(**params):
+    """Return an async iterator over the completion's text; the request is
+    sent once iteration starts."""
+    model = params["model"]
+    body = completion_body(params)
+    key = bedrock_cache_key(model, body)
+    response = response_cache.get(key)
+    if response is not None:
+        return CachedCompletionStream(response)
+
+    async def open_chunks():
+        # Retries only cover opening the stream, not failures partway through it
+        result = await scheduler.call_async(
+            "bedrock",
+            model,
+            lambda: async_bedrock_client().invoke_model_with_response_stream(
+                modelId=model, body=json.dumps(body)
+            ),
+            tokens=estimate_tokens(params["messages"], params.get("max_tokens")),
+        )
+        return result["body"]
+
+    def on_complete(response):
+        record_bedrock_usage(model, response)
+        response_cache.put(key, response)
+
+    return AsyncBedrockCompletionStream(model, open_chunks, on_complete=on_complete)
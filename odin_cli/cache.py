@@ -0,0 +1,179 @@
+import contextvars
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from odin_cli.logs import log_event
+
+# The --no-cache/--refresh flags of a command run by `odin serve`, which
+# apply on top of the daemon's own cache settings
+command_cache_flags = contextvars.ContextVar("command_cache_flags", default=None)
+
+
+# Function to get (and create) a directory under the odin cache directory
+def cache_dir(*parts):
+    base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base_dir, "odin", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Function to write a file atomically so readers never see a partial file
+def write_atomic(path, data, mode="w"):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, mode) as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+# Function to remove the files of a cache directory that are too old or too many
+def evict_files(directory, max_bytes, max_age):
+    """Remove files older than `max_age` seconds, then the least recently used
+    (by mtime) until the rest fit in `max_bytes`."""
+    now = time.time()
+    entries = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > max_age:
+                remove_file(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        remove_file(path)
+        total_bytes -= size
+
+
+# Function to remove a file that may already be gone
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of provider responses.
+
+    Entries are keyed on a hash of the full request and evicted least recently
+    used first once they exceed `max_bytes` or `max_age` seconds.
+    """
+
+    # Eviction scans the whole cache, so it only runs every so many writes
+    EVICTION_INTERVAL = 100
+
+    def __init__(
+        self,
+        directory=None,
+        max_bytes=500 * 1024 * 1024,
+        max_age=30 * 24 * 60 * 60,
+        enabled=True,
+        refresh=False,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def key(self, **request):
+        payload = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        directory = self.directory or cache_dir("responses")
+        return os.path.join(directory, key[:2], f"{key}.json")
+
+    def settings(self):
+        """Return whether the cache is enabled and refreshing for this command."""
+        flags = command_cache_flags.get()
+        if flags is None:
+            return self.enabled, self.refresh
+        return self.enabled and not flags["no_cache"], self.refresh or flags["refresh"]
+
+    def get(self, key):
+        """Return the cached response for `key`, or None on a miss."""
+        enabled, refresh = self.settings()
+        if not enabled:
+            return None
+
+        path = self.path(key)
+        response = None
+        if not refresh:
+            try:
+                if time.time() - os.path.getmtime(path) <= self.max_age:
+                    with open(path, "r") as file:
+                        response = json.load(file)
+                    # Touch the entry so eviction treats it as recently used
+                    os.utime(path)
+            except (OSError, ValueError):
+                response = None
+
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        log_event(
+            event_type="DEBUG",
+            message="response cache hit" if response else "response cache miss",
+            context={"key": key},
+        )
+        return response
+
+    def put(self, key, response):
+        if not self.settings()[0]:
+            return
+
+        write_atomic(self.path(key), json.dumps(response))
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.EVICTION_INTERVAL == 1
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove expired entries, then the least recently used over the size cap."""
+        evict_files(
+            self.directory or cache_dir("responses"), self.max_bytes, self.max_age
+        )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# Shared response cache, set up from the config by `configure_cache`
+response_cache = ResponseCache()
+
+
+# Function to configure the shared response cache
+def configure_cache(config, no_cache=False, refresh=False):
+    """Apply the `cache` config section and the --no-cache/--refresh flags."""
+    cache_config = (config or {}).get("cache") or {}
+    response_cache.directory = cache_config.get("directory")
+    response_cache.max_bytes = int(cache_config.get("max_size_mb", 500) * 1024 * 1024)
+    response_cache.max_age = cache_config.get("max_age_days", 30) * 24 * 60 * 60
+    response_cache.enabled = cache_config.get("enabled", True) and not no_cache
+    response_cache.refresh = refresh
+
+    return response_cache
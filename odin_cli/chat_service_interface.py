@@ -1,11 +1,15 @@
-def process_single_prompt(service_name, prompt, model):
+def process_single_prompt(service_name, prompt, model, **options):
     raise NotImplementedError
 
 
-def process_interactive_chat(service_name, user_input, chat_history, model):
+def process_interactive_chat(service_name, user_input, chat_history, model, **options):
     raise NotImplementedError
 
 
-def register_ask_args(subparsers, config):
-    """Function to register CLI commands for the plugin."""
+def plugin_command(args, config):
+    """Entry point for the plugin's `ask` subcommand.
+
+    CLI arguments are declared in the manifest in `odin_cli.plugins`, which
+    names this function, so the plugin module is only imported when it runs.
+    """
     raise NotImplementedError
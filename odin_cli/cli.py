@@ -1,14 +1,40 @@
 #!/usr/bin/env python
 
 import argparse
+from odin_cli.cache import configure_cache
+from odin_cli.content import configure_content
+from odin_cli.logs import configure_logging
+from odin_cli.metrics import configure_metrics
+from odin_cli.profiling import configure_profiling, finish_profiling
+from odin_cli.ratelimit import configure_rate_limits
+from odin_cli.router import configure_router
+from odin_cli.sources import configure_sources
 from odin_cli.utils import load_config, load_plugins
 from odin_cli.commands.ask import setup_ask_command
+from odin_cli.commands.batch import setup_batch_command
 from odin_cli.commands.config import setup_config_command
 from odin_cli.commands.run import setup_run_command
+from odin_cli.commands.serve import setup_serve_command
 
 
-def main():
-    config = load_config()
+# Function to apply the config and global flags to the shared services
+def configure_runtime(args, config):
+    configure_logging(config, log_level=args.log_level, log_file=args.log_file)
+    configure_cache(
+        config,
+        no_cache=getattr(args, "no_cache", False),
+        refresh=getattr(args, "refresh", False),
+    )
+    configure_content(config)
+    configure_sources(config)
+    configure_rate_limits(config)
+    configure_router(config)
+    configure_metrics(config)
+    configure_profiling(args)
+
+
+# Function to build the argument parser of every command
+def build_parser(config):
     parser = argparse.ArgumentParser(prog="odin")
     parser.add_argument(
         "--log-level",
@@ -26,11 +52,23 @@ def main():
     setup_config_command(subparsers, config, plugins)
     setup_ask_command(subparsers, config, plugins)
     setup_run_command(subparsers, config, plugins)
+    setup_batch_command(subparsers, config, plugins)
+    setup_serve_command(subparsers, config, plugins)
+    return parser
+
+
+def main():
+    config = load_config()
+    parser = build_parser(config)
 
     # Parse the arguments
     args = parser.parse_args()
     if hasattr(args, "func"):
-        args.func(args, config)
+        configure_runtime(args, config)
+        try:
+            args.func(args, config)
+        finally:
+            finish_profiling(args)
     else:
         parser.print_help()
 
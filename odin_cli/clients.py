@@ -0,0 +1,193 @@
+import asyncio
+import base64
+import functools
+import json
+import os
+import weakref
+from urllib.parse import quote
+
+# SDK clients are created on first use (and then reused) so that commands
+# which never talk to a provider don't pay for importing the SDKs.
+
+
+# Function to get the shared OpenAI client
+@functools.lru_cache(maxsize=None)
+def openai_client():
+    from openai import OpenAI
+
+    return OpenAI(max_retries=0)
+
+
+# Function to get a shared boto3 client for an AWS service
+@functools.lru_cache(maxsize=None)
+def boto3_client(service_name):
+    import boto3
+
+    return boto3.client(service_name)
+
+
+# Async clients hold connection pools bound to the event loop they were made on,
+# so they're shared per loop
+async_clients = weakref.WeakKeyDictionary()
+
+
+# Function to get a client shared on the running event loop, creating it if needed
+def loop_client(name, create):
+    clients = async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = create()
+    return clients[name]
+
+
+# Function to close the async clients of the running event loop
+async def close_async_clients():
+    clients = async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+# Function to get the shared AsyncOpenAI client of the running event loop
+def async_openai_client():
+    def create():
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(max_retries=0)
+
+    return loop_client("openai", create)
+
+
+# Function to get the shared async Bedrock Runtime client of the running event loop
+def async_bedrock_client():
+    return loop_client("bedrock-runtime", AsyncBedrockClient)
+
+
+class AsyncBedrockClient:
+    """Bedrock Runtime's InvokeModel and InvokeModelWithResponseStream over an
+    httpx connection pool.
+
+    Requests are signed with SigV4 using boto3's credential chain, and errors
+    are raised as botocore `ClientError`s, the same as boto3's client raises.
+    """
+
+    def __init__(self):
+        import boto3
+        import httpx
+
+        session = boto3.Session()
+        self.region = session.region_name or "us-east-1"
+        self.credentials = session.get_credentials()
+        self.endpoint = (
+            os.environ.get("AWS_ENDPOINT_URL_BEDROCK_RUNTIME")
+            or os.environ.get("AWS_ENDPOINT_URL")
+            or f"https://bedrock-runtime.{self.region}.amazonaws.com"
+        ).rstrip("/")
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(60, read=300),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+
+    def signed_headers(self, url, data, headers):
+        from botocore.auth import SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        request = AWSRequest(method="POST", url=url, data=data, headers=headers)
+        SigV4Auth(
+            self.credentials.get_frozen_credentials(), "bedrock", self.region
+        ).add_auth(request)
+        return dict(request.headers.items())
+
+    async def send(self, operation_name, path, body, accept, stream=False):
+        url = f"{self.endpoint}/model/{path}"
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        headers = self.signed_headers(
+            url, data, {"Content-Type": "application/json", "Accept": accept}
+        )
+        request = self.http.build_request("POST", url, content=data, headers=headers)
+        response = await self.http.send(request, stream=stream)
+        if response.status_code >= 400:
+            await response.aread()
+            await response.aclose()
+            raise client_error(response, operation_name)
+        return response
+
+    async def invoke_model(self, modelId, body):
+        """Return `{"body": bytes, "headers": dict}` for an InvokeModel request."""
+        response = await self.send(
+            "InvokeModel",
+            f"{quote(modelId, safe='')}/invoke",
+            body,
+            "application/json",
+        )
+        return {"body": response.content, "headers": dict(response.headers)}
+
+    async def invoke_model_with_response_stream(self, modelId, body):
+        """Return `{"body": chunks, "headers": dict}` for a streamed InvokeModel.
+
+        `chunks` is an async iterator over the bytes of each chunk, like the
+        `chunk` events of boto3's event stream.
+        """
+        response = await self.send(
+            "InvokeModelWithResponseStream",
+            f"{quote(modelId, safe='')}/invoke-with-response-stream",
+            body,
+            "application/vnd.amazon.eventstream",
+            stream=True,
+        )
+        return {"body": event_chunks(response), "headers": dict(response.headers)}
+
+    async def close(self):
+        await self.http.aclose()
+
+
+# Function to decode the chunks of an AWS event stream response as they arrive
+async def event_chunks(response):
+    from botocore.eventstream import EventStreamBuffer
+    from botocore.exceptions import ClientError
+
+    buffer = EventStreamBuffer()
+    try:
+        async for data in response.aiter_bytes():
+            buffer.add_data(data)
+            for message in buffer:
+                headers = message.headers
+                if headers.get(":message-type") in ("exception", "error"):
+                    payload = json.loads(message.payload or b"{}")
+                    raise ClientError(
+                        {
+                            "Error": {
+                                "Code": headers.get(":exception-type")
+                                or headers.get(":error-code"),
+                                "Message": payload.get("message")
+                                or headers.get(":error-message", ""),
+                            }
+                        },
+                        "InvokeModelWithResponseStream",
+                    )
+                if headers.get(":event-type") == "chunk":
+                    yield base64.b64decode(json.loads(message.payload)["bytes"])
+    finally:
+        await response.aclose()
+
+
+# Function to turn an error response from an AWS service into a botocore ClientError
+def client_error(response, operation_name):
+    from botocore.exceptions import ClientError
+
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    code = response.headers.get("x-amzn-errortype", "").split(":")[0]
+    return ClientError(
+        {
+            "Error": {
+                "Code": code or str(response.status_code),
+                "Message": payload.get("message") or payload.get("Message") or "",
+            },
+            "ResponseMetadata": {
+                "HTTPStatusCode": response.status_code,
+                "HTTPHeaders": dict(response.headers),
+            },
+        },
+        operation_name,
+    )
@@ -1,3 +1,36 @@
+import odin_cli.api as api
+from odin_cli.mapreduce import default_map_reduce_settings, map_reduce
+from odin_cli.plugins import register_ask_args
+from odin_cli.sources import read_content_from_source, resolve_source_variables
+from odin_cli.template import parse_variables
+
+
+# Function to answer a prompt over a large input with `--map-reduce`
+def map_reduce_command(provider, args, config):
+    settings = {
+        **default_map_reduce_settings,
+        **(config.get("map_reduce") or {}),
+    }
+    try:
+        prompt = read_content_from_source(args.prompt or "{chunk}")
+        variables = resolve_source_variables(parse_variables(args.template_args))
+        response = api.run_sync(
+            map_reduce(
+                provider,
+                args.map_reduce,
+                prompt,
+                model=args.model,
+                variables=variables,
+                chunk_tokens=args.chunk_tokens or settings["chunk_tokens"],
+                concurrency=settings["concurrency"],
+                reduce_prompt=args.reduce_prompt or settings["reduce_prompt"],
+            )
+        )
+    except Exception as e:
+        response = f"Error: {str(e)}"
+    print(response)
+
+
 def setup_ask_command(subparsers, config, plugins):
     # Subparser for the "ask" command
     parser_ask = subparsers.add_parser(
@@ -5,6 +38,5 @@ def setup_ask_command(subparsers, config, plugins):
     )
     ask_subparsers = parser_ask.add_subparsers(help="Services")
 
-    for plugin in plugins:
-        if hasattr(plugin, "register_ask_args"):
-            plugin.register_ask_args(ask_subparsers, config)
+    for plugin_name in plugins:
+        register_ask_args(ask_subparsers, config, plugin_name)
@@ -0,0 +1,94 @@
+from odin_cli.api import run_sync
+from odin_cli.batch import export_batch, import_batch
+from odin_cli.commands.run import read_variable_sets
+from odin_cli.printer import MessagePrinter
+from odin_cli.template import TemplateError, parse_variables
+
+
+# Function to print the request files of a round and what to do with them
+def print_round(paths, round, rounds):
+    if not paths:
+        print("Batch complete: every response has been imported.")
+        return
+    print(f"Round {round} of {rounds}. Submit these files to the provider's batch API:")
+    for path in paths:
+        print(f"  {path}")
+    print("Then run `odin batch import <results.jsonl> --output <dir>`.")
+
+
+# Function to export a spec's requests for a provider batch API
+def batch_export(args, config):
+    try:
+        summary = export_batch(
+            args.file_path,
+            read_variable_sets(args.vars_file) if args.vars_file else None,
+            parse_variables(args.template_variables),
+            args.output,
+            MessagePrinter("standard"),
+            args.strict,
+        )
+    except (TemplateError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        return
+
+    print_round(summary["paths"], summary["round"], summary["rounds"])
+
+
+# Function to import a provider's batch results
+def batch_import(args, config):
+    try:
+        summary = run_sync(import_batch(args.results_files, args.output))
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return
+
+    print(
+        f"Imported {summary['imported']} responses "
+        + f"({summary['failed']} failed, {summary['unknown']} not in this batch)."
+    )
+    if summary["failed_rows"]:
+        print(f"Failed rows: {', '.join(summary['failed_rows'])}")
+    if summary["pending"]:
+        print(f"Waiting for {summary['pending']} more responses of this round.")
+        return
+    print_round(summary["paths"], summary["round"], summary["rounds"])
+
+
+# Function to set up the 'batch' command in a CLI environment
+def setup_batch_command(subparsers, config, plugins):
+    parser_batch = subparsers.add_parser(
+        "batch", help="Run a specification through provider batch APIs"
+    )
+    batch_subparsers = parser_batch.add_subparsers(help="Actions")
+
+    export_parser = batch_subparsers.add_parser(
+        "export", help="Write batch request files for a specification"
+    )
+    export_parser.add_argument("file_path", help="File path of the specification")
+    export_parser.add_argument(
+        "template_variables", nargs="*", help="Template variable values"
+    )
+    export_parser.add_argument(
+        "--vars-file",
+        help="JSONL or CSV file of template variable sets, exporting the spec once per row",
+    )
+    export_parser.add_argument(
+        "--output", default=".", help="Directory path for the output"
+    )
+    export_parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Fail before writing anything when a template variable is missing",
+    )
+    export_parser.set_defaults(func=batch_export)
+
+    import_parser = batch_subparsers.add_parser(
+        "import", help="Save batch results and write the next round's requests"
+    )
+    import_parser.add_argument(
+        "results_files", nargs="+", help="Batch results JSONL files"
+    )
+    import_parser.add_argument(
+        "--output", default=".", help="Directory path the batch was exported to"
+    )
+    import_parser.set_defaults(func=batch_import)
@@ -0,0 +1,259 @@
+import asyncio
+import contextlib
+import contextvars
+import importlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import odin_cli.api as api
+from odin_cli.cache import command_cache_flags
+from odin_cli.clients import close_async_clients
+from odin_cli.daemon import environment_digest, send_message, socket_path
+from odin_cli.logs import log_event
+from odin_cli.plugins import PLUGINS, load_plugin
+
+# SDKs the plugins import on their first request
+SDK_MODULES = ("openai", "boto3", "botocore.eventstream", "httpx")
+
+# Connection to the client whose command runs in this context
+client_connection = contextvars.ContextVar("client_connection", default=None)
+
+
+class ClientConnection:
+    """The connection a client's command arrived on.
+
+    Output is sent back as it's written, and stdin is fetched from the client
+    the first time the command reads it.
+    """
+
+    def __init__(self, rfile, wfile, isatty=False):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.isatty = isatty
+        self.lock = threading.Lock()
+        self.stdin = None
+        self.closed = False
+
+    def send(self, **message):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                send_message(self.wfile, message)
+            except OSError:
+                # The client went away; the command still runs to completion
+                self.closed = True
+
+    def read_stdin(self):
+        with self.lock:
+            if self.stdin is not None:
+                return ""
+            send_message(self.wfile, {"read_stdin": True})
+            self.stdin = json.loads(self.rfile.readline())["stdin"]
+            return self.stdin
+
+
+class ClientStream(io.TextIOBase):
+    """Stands in for `sys.stdout`, `sys.stderr` or `sys.stdin` in `odin serve`.
+
+    Commands use the streams of the client they run for; everything else uses
+    the daemon's own.
+    """
+
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+
+    def write(self, text):
+        connection = client_connection.get()
+        if connection is None:
+            return self.stream.write(text)
+        connection.send(**{self.name: text})
+        return len(text)
+
+    def flush(self):
+        if client_connection.get() is None:
+            self.stream.flush()
+
+    def read(self, size=-1):
+        connection = client_connection.get()
+        if connection is None:
+            return self.stream.read(size)
+        return connection.read_stdin()
+
+    def isatty(self):
+        connection = client_connection.get()
+        if connection is None:
+            return self.stream.isatty()
+        return connection.isatty
+
+
+class WorkingDirectory:
+    """The daemon's working directory, shared by the commands it runs.
+
+    Commands from the same directory run together; a command from another
+    directory waits for them to finish, since a process has one working
+    directory and commands resolve their paths against it.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.path = os.getcwd()
+        self.commands = 0
+
+    @contextlib.contextmanager
+    def enter(self, path):
+        with self.condition:
+            self.condition.wait_for(lambda: self.commands == 0 or self.path == path)
+            if self.path != path:
+                os.chdir(path)
+                self.path = path
+            self.commands += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.commands -= 1
+                self.condition.notify_all()
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get("environment") != self.server.environment:
+            log_event(
+                message="serve command handed back",
+                context={"argv": request["argv"], "reason": "environment differs"},
+            )
+            send_message(self.wfile, {"run_in_process": True})
+            return
+        connection = ClientConnection(
+            self.rfile, self.wfile, isatty=request.get("isatty", False)
+        )
+        client_connection.set(connection)
+        exit_code = run_client_command(self.server, request)
+        connection.send(exit=exit_code)
+
+
+# Function to run a client's command and return its exit code
+def run_client_command(server, request):
+    log_event(
+        message="serve command started",
+        context={"argv": request["argv"], "cwd": request["cwd"]},
+    )
+    try:
+        args = server.parser.parse_args(request["argv"])
+        if not hasattr(args, "func"):
+            server.parser.print_help()
+            return 0
+        command_cache_flags.set(
+            {
+                "no_cache": getattr(args, "no_cache", False),
+                "refresh": getattr(args, "refresh", False),
+            }
+        )
+        with server.working_directory.enter(request["cwd"]):
+            args.func(args, server.config)
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        log_event(
+            event_type="ERROR",
+            message="serve command errored",
+            context={"argv": request["argv"], "error_message": f"Error: {str(e)}"},
+        )
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+
+
+# Function to import the plugins and their SDKs ahead of the first command
+def warm_up():
+    for plugin_name in PLUGINS:
+        load_plugin(plugin_name)
+    for module in SDK_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+# Function to check if another daemon already listens on a socket
+def is_listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+# Function to serve commands until interrupted
+def serve_command(args, config):
+    from odin_cli.cli import build_parser
+
+    path = args.socket or socket_path()
+    if os.path.exists(path):
+        if is_listening(path):
+            print(f"Error: odin serve is already running on {path}")
+            return
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Only the current user may connect, as commands run with their credentials
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, CommandHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.parser = build_parser(config)
+    server.config = config
+    server.environment = environment_digest()
+    server.working_directory = WorkingDirectory()
+    warm_up()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="odin-serve", daemon=True).start()
+    api.shared_loop = loop
+
+    print(f"odin serve listening on {path}", flush=True)
+    log_event(message="serve started", context={"socket": path})
+    sys.stdout = ClientStream("stdout", sys.stdout)
+    sys.stderr = ClientStream("stderr", sys.stderr)
+    sys.stdin = ClientStream("stdin", sys.stdin)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        asyncio.run_coroutine_threadsafe(close_async_clients(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        api.shared_loop = None
+        sys.stdout, sys.stderr, sys.stdin = (
+            sys.stdout.stream,
+            sys.stderr.stream,
+            sys.stdin.stream,
+        )
+        log_event(message="serve stopped", context={"socket": path})
+
+
+# Function to set up the 'serve' command in a CLI environment
+def setup_serve_command(subparsers, config, plugins):
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Keep a warm daemon running for `ask` and `run` to hand commands to",
+    )
+    serve_parser.add_argument(
+        "--socket",
+        help="Path of the Unix socket (default: ~/.cache/odin/serve.sock, or $ODIN_SOCKET)",
+    )
+    serve_parser.set_defaults(func=serve_command)
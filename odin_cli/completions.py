@@ -0,0 +1,247 @@
+import time
+from odin_cli.cache import response_cache
+from odin_cli.metrics import record_usage
+from odin_cli.ratelimit import estimate_tokens, scheduler
+
+
+class CompletionStream:
+    """Assembles a streamed chat completion from its chunks.
+
+    Once the stream is exhausted, `response` holds the assembled completion in
+    the same shape as `ChatCompletion.model_dump()`, including tool calls and
+    usage, and `metrics` holds its latency metrics.
+    """
+
+    def __init__(self, chunks, start_time=None, on_complete=None):
+        self.chunks = chunks
+        self.on_complete = on_complete
+        self.start_time = start_time or time.time()
+        self.first_token_time = None
+        self.end_time = None
+        self.response = None
+        self.metrics = None
+        self.assembled = {"choices": [], "usage": None}
+        self.content = []
+        self.tool_calls = {}
+
+    def add_chunk(self, chunk):
+        """Fold a chunk into the assembled response and return its text, if any."""
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+        response = self.assembled
+        response["id"] = chunk.id
+        response["model"] = chunk.model
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            response["usage"] = (
+                usage.model_dump() if hasattr(usage, "model_dump") else usage
+            )
+        if not chunk.choices:
+            return None
+
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            response["finish_reason"] = choice.finish_reason
+        for tool_call in choice.delta.tool_calls or []:
+            call = self.tool_calls.setdefault(
+                tool_call.index,
+                {
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                },
+            )
+            call["id"] = tool_call.id or call["id"]
+            if tool_call.function:
+                call["function"]["name"] += tool_call.function.name or ""
+                call["function"]["arguments"] += tool_call.function.arguments or ""
+        if choice.delta.content:
+            self.content.append(choice.delta.content)
+        return choice.delta.content
+
+    def finish(self):
+        self.end_time = time.time()
+        response = self.assembled
+        message = {"role": "assistant", "content": "".join(self.content) or None}
+        if self.tool_calls:
+            message["tool_calls"] = [
+                self.tool_calls[index] for index in sorted(self.tool_calls)
+            ]
+        response["choices"] = [
+            {
+                "index": 0,
+                "message": message,
+                "finish_reason": response.pop("finish_reason", None),
+            }
+        ]
+        if response["usage"] is None:
+            # The provider didn't report usage; unknown counts stay out of the
+            # metrics and costs rather than being guessed
+            response["usage"] = {
+                "prompt_tokens": None,
+                "completion_tokens": None,
+                "total_tokens": None,
+            }
+        self.response = response
+        self.metrics = completion_metrics(
+            response["usage"], self.start_time, self.first_token_time, self.end_time
+        )
+        if self.on_complete:
+            self.on_complete(response)
+
+
+class AsyncCompletionStream(CompletionStream):
+    """A `CompletionStream` over the chunks of an `AsyncOpenAI` stream.
+
+    `open_chunks()` is awaited on first iteration to send the request.
+    """
+
+    def __init__(self, open_chunks, start_time=None, on_complete=None):
+        super().__init__(None, start_time, on_complete)
+        self.open_chunks = open_chunks
+
+    async def __aiter__(self):
+        self.start_time = time.time()
+        self.chunks = await self.open_chunks()
+        async for chunk in self.chunks:
+            text = self.add_chunk(chunk)
+            if text:
+                yield text
+        self.finish()
+
+
+class CachedCompletionStream(CompletionStream):
+    """Replay a cached completion through the `CompletionStream` interface."""
+
+    def __init__(self, response):
+        super().__init__(chunks=None)
+        self.cached_response = response
+
+    def __iter__(self):
+        self.first_token_time = time.time()
+        content = self.cached_response["choices"][0]["message"].get("content")
+        if content:
+            yield content
+
+        self.end_time = time.time()
+        self.response = self.cached_response
+        self.metrics = completion_metrics(
+            self.response["usage"],
+            self.start_time,
+            self.first_token_time,
+            self.end_time,
+        )
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+
+# Function to build the cache key of a chat completion request
+def completion_cache_key(client, params):
+    return response_cache.key(
+        provider="openai",
+        base_url=str(client.base_url),
+        model=params.get("model"),
+        messages=params.get("messages"),
+        temperature=params.get("temperature"),
+        max_tokens=params.get("max_tokens"),
+        tools=params.get("tools"),
+        tool_choice=params.get("tool_choice"),
+    )
+
+
+# Function to record the tokens used by a completion
+def record_completion_usage(params, response):
+    usage = response.get("usage") or {}
+    record_usage(
+        "openai",
+        params.get("model"),
+        usage.get("prompt_tokens"),
+        usage.get("completion_tokens"),
+    )
+
+
+# Function to send a chat completions request with an `AsyncOpenAI` client
+async def post_chat_completion(client, params, stream=False):
+    """Return the completion of `params`, or with `stream` its chunk stream."""
+    if stream:
+        # The SDK version we pin predates its `stream_options` argument
+        params = dict(
+            params, stream=True, extra_body={"stream_options": {"include_usage": True}}
+        )
+    return await client.chat.completions.create(**params)
+
+
+# Function to send a chat completion request with an `AsyncOpenAI` client
+async def create_chat_completion_async(client, **params):
+    """Return the completion for `params` as a dict, from the cache if possible."""
+    key = completion_cache_key(client, params)
+    response = response_cache.get(key)
+    if response is None:
+
+        async def request():
+            completion = await post_chat_completion(client, params)
+            return completion.model_dump(exclude_unset=True)
+
+        response = await scheduler.call_async(
+            "openai",
+            params.get("model"),
+            request,
+            tokens=estimate_tokens(params.get("messages"), params.get("max_tokens")),
+            count_tokens=lambda response: (response.get("usage") or {}).get(
+                "total_tokens"
+            ),
+        )
+        record_completion_usage(params, response)
+        response_cache.put(key, response)
+
+    return response
+
+
+# Function to stream a chat completion with an `AsyncOpenAI` client
+def stream_chat_completion_async(client, **params):
+    """Return an async iterator over the completion's text, from the cache if
+    possible. The request is sent once iteration starts."""
+    key = completion_cache_key(client, params)
+    response = response_cache.get(key)
+    if response is not None:
+        return CachedCompletionStream(response)
+
+    def on_complete(response):
+        record_completion_usage(params, response)
+        response_cache.put(key, response)
+
+    # Retries only cover opening the stream, not failures partway through it
+    return AsyncCompletionStream(
+        lambda: scheduler.call_async(
+            "openai",
+            params.get("model"),
+            lambda: post_chat_completion(client, params, stream=True),
+            tokens=estimate_tokens(params.get("messages"), params.get("max_tokens")),
+        ),
+        on_complete=on_complete,
+    )
+
+
+# Function to calculate the latency metrics of a completion
+def completion_metrics(usage, start_time, first_token_time, end_time):
+    """Return time to first token and completion tokens per second.
+
+    Without streaming the first token arrives with the whole response, so the
+    rate covers the full request.
+    """
+    first_token_time = first_token_time or end_time
+    completion_tokens = (usage or {}).get("completion_tokens")
+    generation_time = end_time - first_token_time
+    if generation_time <= 0:
+        generation_time = end_time - start_time
+
+    return {
+        "time_to_first_token": round(first_token_time - start_time, 3),
+        "tokens_per_second": (
+            round(completion_tokens / generation_time, 1)
+            if generation_time and completion_tokens is not None
+            else None
+        ),
+    }
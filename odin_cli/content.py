@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+from odin_cli.cache import cache_dir, evict_files, write_atomic
+
+# Characters of stored content quoted in the reference to it
+PREVIEW_CHARS = 200
+
+# Eviction scans the whole store, so it only runs every so many new payloads
+EVICTION_INTERVAL = 100
+
+# Settings from the `content` config section, in bytes and seconds
+content_settings = {"max_bytes": 200 * 1024 * 1024, "max_age": 30 * 24 * 60 * 60}
+
+# Payloads stored by this process, to space out evictions
+content_writes = {"count": 0}
+content_lock = threading.Lock()
+
+
+# Function to get the path of a payload in the content store
+def content_path(digest):
+    return os.path.join(cache_dir("content", digest[:2]), digest)
+
+
+# Function to keep a payload in the content store and describe it
+def store_content(data):
+    """Store `data` (text) under its hash and return its size, hash and a
+    preview, which stand in for it in tool results."""
+    encoded = data.encode("utf-8")
+    digest = hashlib.sha256(encoded).hexdigest()
+    path = content_path(digest)
+    try:
+        # Touch the payload so eviction treats it as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        write_atomic(path, encoded, mode="wb")
+        with content_lock:
+            content_writes["count"] += 1
+            evict = content_writes["count"] % EVICTION_INTERVAL == 1
+        if evict:
+            evict_files(
+                cache_dir("content"),
+                content_settings["max_bytes"],
+                content_settings["max_age"],
+            )
+    preview = data[:PREVIEW_CHARS] + ("…" if len(data) > PREVIEW_CHARS else "")
+    return {"bytes": len(encoded), "sha256": digest, "preview": preview}
+
+
+# Function to read a payload back from the content store
+def load_content(digest):
+    """Return the stored text, or None when it's no longer in the store."""
+    path = content_path(digest)
+    try:
+        with open(path, "rb") as file:
+            content = file.read().decode("utf-8")
+        os.utime(path)
+    except OSError:
+        return None
+    return content
+
+
+# Function to put the stored payloads back into a turn's tool results
+def inline_tool_results(chat_items):
+    """Return `chat_items` with every tool result that references stored
+    content carrying the content itself. References whose content is gone
+    are left as they are."""
+    inlined = []
+    for chat_item in chat_items:
+        if chat_item.get("role") == "tool":
+            try:
+                result = json.loads(chat_item["content"])
+            except (TypeError, ValueError):
+                result = None
+            if isinstance(result, dict) and "sha256" in result:
+                content = load_content(result["sha256"])
+                if content is not None:
+                    result = {
+                        key: value
+                        for key, value in result.items()
+                        if key not in ("bytes", "sha256", "preview")
+                    }
+                    chat_item = dict(
+                        chat_item, content=json.dumps({**result, "content": content})
+                    )
+        inlined.append(chat_item)
+    return inlined
+
+
+# Function to configure the content store
+def configure_content(config):
+    """Apply the `content` config section. Payloads older than
+    `max_age_days`, then the least recently used over `max_size_mb`, are
+    evicted; their references are then sent as they are."""
+    content_config = (config or {}).get("content") or {}
+    content_settings["max_bytes"] = int(
+        content_config.get("max_size_mb", 200) * 1024 * 1024
+    )
+    content_settings["max_age"] = content_config.get("max_age_days", 30) * 24 * 60 * 60
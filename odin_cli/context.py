@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+from odin_cli.cache import write_atomic
+from odin_cli.logs import log_event
+from odin_cli.ratelimit import estimate_tokens
+
+# Tokens each chat message adds on top of its content
+MESSAGE_OVERHEAD = 4
+# Turns read from the history at a time while filling the window
+PAGE_SIZE = 20
+# Most turns folded into the summary at once, when many turns drop out together
+MAX_FOLD_TURNS = 50
+
+EMPTY_STATE = {"counted": 0, "history_tokens": 0, "summary": None, "summarized": 0}
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own future reference, keeping "
+    "names, facts, decisions and open questions. Reply with the summary only."
+)
+
+
+# Function to get the tiktoken encoding of a model, when tiktoken is installed
+@functools.lru_cache(maxsize=None)
+def model_encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# Function to count the tokens of a text, cached so each turn is counted once
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    encoding = model_encoding(model) if model else None
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# Function to turn a summary and the turns that followed it into the text to summarize
+def summary_request(summary, turns):
+    lines = [SUMMARY_PROMPT, ""]
+    if summary:
+        lines += [f"Summary so far: {summary}", ""]
+    for turn in turns:
+        lines += [f"User: {turn['prompt']}", f"Assistant: {turn['response']}"]
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """The most recent turns of a chat history that fit in a token budget.
+
+    Turns are added newest first until the budget (which also covers the
+    system prompt, the summary and the new prompt) is used up. With
+    `summarize`, turns that drop out of the window are folded into a rolling
+    summary that is sent in their place. Token counts of the whole history and
+    the summary are kept next to the history file, so resuming a long chat
+    doesn't recount it.
+    """
+
+    def __init__(self, history, model=None, max_tokens=6000, summarize=False):
+        self.history = history
+        self.model = model
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.state_path = f"{history.path}.context" if history.path else None
+        self.state = dict(EMPTY_STATE)
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r") as file:
+                    self.state.update(json.load(file))
+            except (OSError, ValueError):
+                pass
+        if self.state["counted"] > len(history):
+            # The history was replaced, so its counts no longer apply
+            self.state = dict(EMPTY_STATE)
+
+    @property
+    def summary(self):
+        return self.state["summary"]
+
+    def turn_tokens(self, turn):
+        return (
+            count_tokens(turn["prompt"], self.model)
+            + count_tokens(turn["response"], self.model)
+            + 2 * MESSAGE_OVERHEAD
+        )
+
+    def count_new_turns(self):
+        turns = self.history.read(self.state["counted"], len(self.history))
+        self.state["history_tokens"] += sum(self.turn_tokens(turn) for turn in turns)
+        self.state["counted"] = len(self.history)
+
+    def save(self):
+        if self.state_path:
+            write_atomic(self.state_path, json.dumps(self.state))
+
+    def fill(self, budget):
+        """Return the most recent turns that fit in `budget`, their tokens and
+        the index of the oldest one."""
+        turns = []
+        used = 0
+        start = len(self.history)
+        while start > 0:
+            page = self.history.read(max(0, start - PAGE_SIZE), start)
+            for turn in reversed(page):
+                cost = self.turn_tokens(turn)
+                if budget is not None and used + cost > budget:
+                    break
+                turns.append(turn)
+                used += cost
+                start -= 1
+            else:
+                continue
+            break
+        turns.reverse()
+        return turns, used, start
+
+    def build(self, system, user_input, summarize=None):
+        """Return the turns to send, the summary to send with them and stats.
+
+        `summarize(text)` is called with a request to fold dropped turns into
+        the summary, and returns the new summary.
+        """
+        self.count_new_turns()
+
+        def budget():
+            if not self.max_tokens:
+                return None
+            return self.max_tokens - (
+                count_tokens(system, self.model)
+                + count_tokens(user_input, self.model)
+                + count_tokens(self.summary, self.model)
+                + 3 * MESSAGE_OVERHEAD
+            )
+
+        turns, used, start = self.fill(budget())
+
+        while self.summarize and summarize and start > self.state["summarized"]:
+            while self.state["summarized"] < start:
+                end = min(start, self.state["summarized"] + MAX_FOLD_TURNS)
+                dropped = self.history.read(self.state["summarized"], end)
+                self.state["summary"] = summarize(
+                    summary_request(self.summary, dropped)
+                )
+                self.state["summarized"] = end
+            # The new summary takes up room, which may push out the oldest
+            # turns of the window, and those get folded in turn
+            remaining = budget()
+            while turns and remaining is not None and used > remaining:
+                used -= self.turn_tokens(turns.pop(0))
+                start += 1
+        self.save()
+
+        summary_tokens = count_tokens(self.summary, self.model) if start else 0
+        stats = {
+            "history_turns": len(self.history),
+            "turns_sent": len(turns),
+            "history_tokens": self.state["history_tokens"],
+            "tokens_sent": used + summary_tokens,
+            "tokens_saved": max(
+                0, self.state["history_tokens"] - used - summary_tokens
+            ),
+        }
+        log_event(message="context window built", context=stats)
+
+        return turns, (self.summary if start else None), stats
@@ -0,0 +1,132 @@
+"""Entry point of the `odin` command.
+
+When `odin serve` is running, `ask` and `run` commands are handed to it over
+its Unix socket, which skips the interpreter's imports, the config load and
+new connections to the providers. Otherwise (or with `ODIN_NO_SERVE=1`) they
+run in this process, as they do when the client's credentials or config
+variables differ from the daemon's. This module only imports the standard
+library, so the hand-off costs no more than starting Python.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sys
+
+# Commands `odin serve` runs on behalf of a client
+FORWARDED_COMMANDS = ("ask", "run")
+
+# Flags that need the client's terminal or change settings of the whole
+# process; commands given them always run in-process
+IN_PROCESS_FLAGS = (
+    "--chat",
+    "--profile",
+    "--profile-trace",
+    "--profile-cprofile",
+    "--log-level",
+    "--log-file",
+)
+
+# Environment variables that pick the credentials, endpoints, config and caches
+# a command runs with; a command only runs on `odin serve` when they match
+ENVIRONMENT_PREFIXES = ("OPENAI_", "AWS_", "ODIN_")
+ENVIRONMENT_VARIABLES = ("HOME", "XDG_CACHE_HOME", "XDG_CONFIG_HOME")
+
+# Variables that only choose whether and where to reach `odin serve`
+IGNORED_ENVIRONMENT_VARIABLES = ("ODIN_SOCKET", "ODIN_NO_SERVE")
+
+
+# Function to get the path of `odin serve`'s socket
+def socket_path():
+    if os.environ.get("ODIN_SOCKET"):
+        return os.environ["ODIN_SOCKET"]
+    base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base_dir, "odin", "serve.sock")
+
+
+# Function to check if a command can run on `odin serve`
+def is_forwarded(argv):
+    if any(arg.split("=")[0] in IN_PROCESS_FLAGS for arg in argv):
+        return False
+    command = next((arg for arg in argv if not arg.startswith("-")), None)
+    return command in FORWARDED_COMMANDS
+
+
+# Function to get a digest of the environment variables a command depends on
+def environment_digest():
+    """Hash the variables rather than send them, so no credential leaves the process."""
+    variables = sorted(
+        (name, value)
+        for name, value in os.environ.items()
+        if (name.startswith(ENVIRONMENT_PREFIXES) or name in ENVIRONMENT_VARIABLES)
+        and name not in IGNORED_ENVIRONMENT_VARIABLES
+    )
+    return hashlib.sha256(json.dumps(variables).encode("utf-8")).hexdigest()
+
+
+# Function to send a message to the other end of a connection
+def send_message(file, message):
+    file.write(json.dumps(message).encode("utf-8") + b"\n")
+    file.flush()
+
+
+# Function to run a command on a running `odin serve`
+def forward_command(argv):
+    """Return the exit code of the command, or None when it has to run in-process."""
+    if os.environ.get("ODIN_NO_SERVE") or not is_forwarded(argv):
+        return None
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        # Left behind by a daemon that didn't shut down cleanly
+        connection.close()
+        return None
+
+    with connection, connection.makefile("rwb") as file:
+        send_message(
+            file,
+            {
+                "argv": argv,
+                "cwd": os.getcwd(),
+                "isatty": sys.stdout.isatty(),
+                "environment": environment_digest(),
+            },
+        )
+        for line in file:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+                sys.stderr.flush()
+            elif "read_stdin" in message:
+                send_message(file, {"stdin": sys.stdin.read()})
+            elif "exit" in message:
+                return message["exit"]
+            elif "run_in_process" in message:
+                # The daemon runs with other credentials or config
+                return None
+
+    sys.stderr.write("Error: odin serve closed the connection\n")
+    return 1
+
+
+def main():
+    exit_code = forward_command(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    from odin_cli.cli import main as run_command
+
+    run_command()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+
+
+# Function to map each message id to the ids it depends on
+def resolve_dependencies(messages):
+    """Build the dependency graph of a spec's messages.
+
+    Messages without `depends_on` depend on the message before them, so specs
+    that don't use it keep running as a single linear conversation.
+    """
+    ids = [message.get("metadata", {}).get("id") for message in messages]
+    dependencies = {}
+    previous_id = None
+    for id, message in zip(ids, messages):
+        depends_on = message.get("metadata", {}).get("depends_on")
+        if depends_on is None:
+            depends_on = [previous_id] if previous_id is not None else []
+        elif isinstance(depends_on, str):
+            depends_on = [depends_on]
+
+        for dependency in depends_on:
+            if dependency not in ids:
+                raise ValueError(
+                    f"Message '{id}' depends on unknown message '{dependency}'."
+                )
+        dependencies[id] = list(depends_on)
+        previous_id = id
+
+    topological_order(dependencies)
+    return dependencies
+
+
+# Function to order the graph so every message comes after its dependencies
+def topological_order(dependencies):
+    """Return the ids in dependency order, keeping spec order between ties."""
+    ordered = []
+    visiting = set()
+    visited = set()
+
+    def visit(id, path):
+        if id in visited:
+            return
+        if id in visiting:
+            cycle = " -> ".join(path + [id])
+            raise ValueError(f"Circular message dependency: {cycle}")
+        visiting.add(id)
+        for dependency in dependencies[id]:
+            visit(dependency, path + [id])
+        visiting.discard(id)
+        visited.add(id)
+        ordered.append(id)
+
+    for id in dependencies:
+        visit(id, [])
+
+    return ordered
+
+
+# Function to collect every transitive dependency of a message
+def get_ancestors(dependencies, id):
+    """Return the ancestors of a message in dependency order."""
+    ancestors = set()
+    stack = list(dependencies[id])
+    while stack:
+        dependency = stack.pop()
+        if dependency not in ancestors:
+            ancestors.add(dependency)
+            stack.extend(dependencies[dependency])
+
+    return [
+        ancestor
+        for ancestor in topological_order(dependencies)
+        if ancestor in ancestors
+    ]
+
+
+# Function to run every node of the graph once its dependencies are done
+async def run_graph(dependencies, run_node, concurrency=1):
+    """Await `run_node(id)` for every node, independent branches concurrently.
+
+    Returns a dict of node results. The first failure cancels the other nodes
+    and is re-raised once they've stopped.
+    """
+    results = {}
+    pending = topological_order(dependencies)
+    running = {}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_limited(id):
+        async with semaphore:
+            return await run_node(id)
+
+    try:
+        while pending or running:
+            for id in list(pending):
+                if all(dependency in results for dependency in dependencies[id]):
+                    running[asyncio.ensure_future(run_limited(id))] = id
+                    pending.remove(id)
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                id = running.pop(task)
+                results[id] = task.result()
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    return results
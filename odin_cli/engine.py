@@ -0,0 +1,674 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import odin_cli.tools as tools
+from odin_cli.bedrock_completions import (
+    create_bedrock_completion_async,
+    stream_bedrock_completion_async,
+)
+from odin_cli.clients import async_openai_client
+from odin_cli.completions import (
+    completion_metrics,
+    create_chat_completion_async,
+    stream_chat_completion_async,
+)
+from odin_cli.content import inline_tool_results
+from odin_cli.dag import get_ancestors, resolve_dependencies, run_graph
+from odin_cli.logs import log_event
+from odin_cli.metrics import metric_labels
+from odin_cli.output import write_output
+from odin_cli.plugins import PLUGINS
+from odin_cli.printer import MessagePrinter
+from odin_cli.profiling import profiler
+from odin_cli.router import ROUTER_PROVIDER, router
+from odin_cli.template import TemplateError, check_variables, render_template
+
+IMAGE_MODELS = ["dall-e-2", "dall-e-3"]
+
+# Shared pool for tool calls, with a semaphore per tool for its concurrency limit
+tool_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="odin-tool")
+tool_semaphores = {}
+tool_semaphores_lock = threading.Lock()
+
+
+# Function to execute a tool from the tools module
+def execute_tool(tool_call):
+    try:
+        # Extract function name and arguments from the tool call
+        func_name = tool_call["function"]["name"]
+        arguments = json.loads(tool_call["function"]["arguments"])
+
+        # Get the function from the tools module
+        func = getattr(tools, func_name, None)
+        if not func:
+            # Raise an error if the function is not found
+            raise ValueError(f"Function '{func_name}' not found in tools module.")
+
+        # Execute the function with the provided arguments
+        with profiler.span(func_name, "tool", tool_call_id=tool_call.get("id")):
+            return func(**arguments)
+    except KeyError as e:
+        # Handle missing keys in the tool call object
+        raise ValueError(f"Key error in the object structure: {e}")
+    except json.JSONDecodeError as e:
+        # Handle JSON parsing errors
+        raise ValueError(f"Error in parsing arguments: {e}")
+
+
+# Function to execute a tool call within its tool's concurrency limit
+def execute_limited_tool(tool_call):
+    func_name = tool_call.get("function", {}).get("name")
+    with tool_semaphores_lock:
+        if func_name not in tool_semaphores:
+            limits = tools.get_tool_limits(func_name)
+            tool_semaphores[func_name] = threading.Semaphore(limits["max_concurrency"])
+        semaphore = tool_semaphores[func_name]
+
+    with semaphore:
+        return execute_tool(tool_call)
+
+
+# Function to execute the tool calls of a response concurrently
+async def execute_tool_calls(tool_calls):
+    """Run tool calls on the shared tool pool and return results in call order.
+
+    Each call must finish within its tool's `timeout`, counted from when the
+    calls were submitted; otherwise the remaining calls are cancelled and a
+    TimeoutError is raised.
+    """
+    start_time = time.time()
+    futures = [
+        # Tool threads inherit the message's labels, for metrics and profiling
+        asyncio.wrap_future(
+            tool_executor.submit(
+                contextvars.copy_context().run, execute_limited_tool, tool_call
+            )
+        )
+        for tool_call in tool_calls
+    ]
+
+    results = []
+    for tool_call, future in zip(tool_calls, futures):
+        func_name = tool_call.get("function", {}).get("name")
+        timeout = tools.get_tool_limits(func_name)["timeout"]
+        try:
+            results.append(
+                await asyncio.wait_for(
+                    future, timeout=max(0, start_time + timeout - time.time())
+                )
+            )
+        except asyncio.TimeoutError:
+            for other in futures:
+                other.cancel()
+            raise TimeoutError(f"Tool '{func_name}' timed out after {timeout}s")
+
+    return results
+
+
+# Function to process template variables in a string
+def process_template(template, template_variables):
+    with profiler.span("process_template", "template"):
+        return render_template(template, template_variables)
+
+
+# Function to report missing and unused template variables before a run
+def check_template_variables(thread, messages, variable_sets, printer, strict=False):
+    templates = [thread.get("content", "")] + [
+        message.get("content", "")
+        for message in messages
+        if not message.get("metadata", {}).get("disabled", False)
+    ]
+    all_missing = set()
+    all_unused = set()
+    for variables in variable_sets:
+        missing, unused = check_variables(templates, variables)
+        all_missing.update(missing)
+        all_unused.update(unused)
+
+    if all_missing and strict:
+        raise TemplateError(
+            f"Missing template variables: {', '.join(sorted(all_missing))}"
+        )
+    for description, names in [("Missing", all_missing), ("Unused", all_unused)]:
+        if names:
+            warning = f"{description} template variables: {', '.join(sorted(names))}"
+            printer.print_content(f"Warning: {warning}", role="warning")
+            log_event(event_type="WARNING", message=warning.lower())
+
+
+# Function to save a response (or an async iterable of chunks) to a file
+async def save_response(file_path, content):
+    """The write itself is timed by the output sink, where it happens."""
+    if not isinstance(content, str):
+        # Streamed content is saved once complete, so the file is never partial
+        content = "".join([chunk async for chunk in content])
+    write_output(file_path, content)
+
+
+# Function to check a provider name and get the model to use with it
+def provider_model(provider, model):
+    if provider not in PLUGINS:
+        raise ValueError(
+            f"Unknown provider '{provider}'. Choose from: {', '.join(PLUGINS)}."
+        )
+    return model or PLUGINS[provider]["default_model"]
+
+
+# Function to send a chat completion request to a provider
+async def create_completion(provider, **request):
+    """Return the completion for OpenAI-style `request` as a chat completion dict."""
+    if provider == ROUTER_PROVIDER:
+        return await router.complete(create_completion, **request)
+    if provider == "bedrock":
+        return await create_bedrock_completion_async(**request)
+    return await create_chat_completion_async(async_openai_client(), **request)
+
+
+# Function to stream a chat completion from a provider
+def stream_completion(provider, **request):
+    """Return an async `CompletionStream` over the completion's text."""
+    if provider == ROUTER_PROVIDER:
+        return router.stream(stream_completion, **request)
+    if provider == "bedrock":
+        return stream_bedrock_completion_async(**request)
+    return stream_chat_completion_async(async_openai_client(), **request)
+
+
+# Function to build the completion request of a message
+def message_request(message, messages):
+    """Return the request for `messages`, the message's context and its turn,
+    with the model and options set in the message's metadata."""
+    metadata = message.get("metadata", {})
+    provider = metadata.get("provider", "openai")
+    request = {
+        "model": provider_model(provider, metadata.get("model")),
+        "messages": messages,
+        "temperature": metadata.get("temperature", 0),
+        "max_tokens": metadata.get("max_tokens", None),
+    }
+    response_handler = metadata.get("response_handler")
+    if response_handler:
+        request["tools"] = [tools.tool_schemas.get(response_handler)]
+        request["tool_choice"] = "auto"
+    return request
+
+
+# Function to get the messages whose stored tool results a message inlines
+def inline_ids(message):
+    """Return True for all of them, or a list of message ids."""
+    inline = message.get("metadata", {}).get("inline", False)
+    if isinstance(inline, str):
+        return [inline]
+    return inline if inline is True else list(inline or [])
+
+
+# Function to get the path a message's response is saved to
+def message_output_path(message, output_dir):
+    metadata = message.get("metadata", {})
+    thread_id = metadata.get("thread_id")
+    id = metadata.get("id")
+    output_file = metadata.get("output_file", f"{thread_id}/{id}.md")
+    return f"{output_dir}/{output_file}"
+
+
+# Function to run the tool calls of a response and add their results to a turn
+async def add_tool_results(message, turn, response):
+    metadata = message.get("metadata", {})
+    tool_calls = response["choices"][0]["message"].get("tool_calls") or []
+    tool_responses = await execute_tool_calls(tool_calls)
+    for tool_call, tool_response in zip(tool_calls, tool_responses):
+        chat_item = {
+            "role": "tool",
+            "tool_call_id": tool_call["id"],
+            "name": tool_call["function"]["name"],
+            "content": tool_response,
+        }
+        turn.append(chat_item)
+        log_event(
+            message="message tool executed",
+            context={
+                "thread_id": metadata.get("thread_id"),
+                "message_id": metadata.get("id"),
+                "tool": chat_item,
+            },
+        )
+
+
+# Function to fingerprint everything that goes into a message's request
+def request_fingerprint(provider, request):
+    """Hash the provider, model, parameters and full context of a request.
+
+    The context holds every earlier turn, so a message's fingerprint changes
+    whenever anything before it does.
+    """
+    payload = json.dumps({"provider": provider, **request}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Function to get the path of the fingerprint saved next to a message's output
+def fingerprint_path(output_path):
+    return f"{output_path}.fingerprint.json"
+
+
+# Function to load the turn of a message whose inputs haven't changed since the last run
+def load_replay(message, fingerprint, output_path):
+    """Return the saved response and the chat items that followed the prompt,
+    or None when the message has to be sent."""
+    try:
+        with open(fingerprint_path(output_path), "r") as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if saved.get("fingerprint") != fingerprint:
+        return None
+
+    if message.get("metadata", {}).get("response_handler"):
+        return saved["response"], saved["tool_results"]
+    # The output file is the source of truth for the response's text
+    try:
+        with open(output_path, "r") as file:
+            content = file.read()
+    except OSError:
+        return None
+    return saved["response"], [{"role": "assistant", "content": content}]
+
+
+# Function to save a message's fingerprint next to its output
+def save_fingerprint(output_path, fingerprint, response, turn):
+    write_output(
+        fingerprint_path(output_path),
+        json.dumps(
+            {
+                "fingerprint": fingerprint,
+                "response": response,
+                "tool_results": [item for item in turn if item["role"] == "tool"],
+            }
+        ),
+    )
+
+
+# Function to forget a message's fingerprint before its output is rewritten
+def remove_fingerprint(output_path):
+    try:
+        os.unlink(fingerprint_path(output_path))
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+
+
+# Function to send a single message and handle its response
+async def send_message(
+    message,
+    context,
+    template_variables,
+    output_dir,
+    printer,
+    message_number,
+    total_messages,
+    stream=False,
+    incremental=False,
+):
+    """Send one message on top of `context` and return the chat items it adds.
+
+    With `incremental`, a message whose request is the same as on the last
+    run (and whose output is still there) is replayed from disk instead.
+    """
+    message_start_time = time.time()
+    metadata = message.get("metadata", {})
+    disabled = metadata.get("disabled", False)
+    id = metadata.get("id")
+    thread_id = metadata.get("thread_id")
+    provider = metadata.get("provider", "openai")
+    model = provider_model(provider, metadata.get("model"))
+    temperature = metadata.get("temperature", 0)
+    response_handler = metadata.get("response_handler")
+    stream = metadata.get("stream", stream)
+    content = message.get("content", "").strip()
+
+    if disabled:
+        log_event(
+            message="message skipped",
+            context={"thread_id": thread_id, "message_id": id},
+        )
+        return [], None
+    log_event(
+        message="message started",
+        context={
+            "thread_id": thread_id,
+            "message_id": id,
+            "provider": provider,
+            "model": model,
+            "temperature": temperature,
+            "content": content,
+        },
+    )
+    content = process_template(content, template_variables)
+    log_event(
+        message="message content processed",
+        context={
+            "thread_id": thread_id,
+            "message_id": id,
+            "content": content,
+        },
+    )
+    turn = [{"role": "user", "content": content}]
+    printer.print_header(
+        role="user",
+        message_number=message_number,
+        total_messages=total_messages,
+        model=model,
+    )
+    printer.print_content(content, role="user")
+
+    request = message_request(message, context + turn)
+    output_path = message_output_path(message, output_dir)
+    if incremental:
+        fingerprint = request_fingerprint(provider, request)
+        replay = await asyncio.to_thread(load_replay, message, fingerprint, output_path)
+        if replay:
+            response_model, chat_items = replay
+            response_model = dict(response_model, replayed=True)
+            turn.extend(chat_items)
+            log_event(
+                message="message replayed",
+                context={
+                    "thread_id": thread_id,
+                    "message_id": id,
+                    "output_path": output_path,
+                },
+            )
+            printer.print_content(
+                f"Unchanged since the last run, replayed from {output_path}",
+                role="info",
+            )
+            return turn, response_model
+        await asyncio.to_thread(remove_fingerprint, output_path)
+
+    if stream:
+        completion = stream_completion(provider, **request)
+        chunks = printer.stream_content(completion, role="assistant")
+        if response_handler:
+            async for _ in chunks:
+                pass
+        else:
+            await save_response(output_path, chunks)
+        response_model = completion.response
+        latency_metrics = completion.metrics
+    else:
+        response_model = await create_completion(provider, **request)
+        latency_metrics = completion_metrics(
+            response_model["usage"], message_start_time, None, time.time()
+        )
+
+    log_event(
+        message="message response received",
+        context={
+            "thread_id": thread_id,
+            "message_id": id,
+            "model": model,
+            "temperature": temperature,
+            "content": content,
+            "response": response_model,
+            **latency_metrics,
+        },
+    )
+
+    if response_handler:
+        await add_tool_results(message, turn, response_model)
+        message_end_time = time.time()
+        response_time = message_end_time - message_start_time
+        token_metrics = response_model["usage"]
+        printer.print_footer(response_time, model, token_metrics, latency_metrics)
+        if profiler.enabled:
+            printer.print_phases(profiler.phase_totals(message=id), response_time)
+    else:
+        response_content = response_model["choices"][0]["message"]["content"]
+        turn.append({"role": "assistant", "content": response_content})
+        if not stream:
+            await save_response(output_path, response_content)
+        log_event(
+            message="message output saved",
+            context={
+                "thread_id": thread_id,
+                "message_id": id,
+                "output_path": output_path,
+            },
+        )
+        message_end_time = time.time()
+        response_time = message_end_time - message_start_time
+        token_metrics = response_model["usage"]
+        if not stream:
+            printer.print_content(response_content, role="assistant")
+        printer.print_footer(response_time, model, token_metrics, latency_metrics)
+        if profiler.enabled:
+            printer.print_phases(profiler.phase_totals(message=id), response_time)
+
+    if incremental:
+        save_fingerprint(output_path, fingerprint, response_model, turn)
+    return turn, response_model
+
+
+# Function to run every message of a thread
+async def run_thread(
+    messages,
+    thread,
+    template_variables,
+    output_dir,
+    printer,
+    concurrency=1,
+    stream=False,
+    incremental=False,
+):
+    """Send the messages of a thread and return their responses by message id.
+
+    Errors are raised to the caller.
+    """
+    thread_metadata = thread.get("metadata", {})
+    thread_id = thread_metadata.get("id")
+    log_event(
+        message="chat started",
+        context={
+            "thread_id": thread_id,
+        },
+    )
+    log_event(
+        message="received template variables",
+        context={"thread_id": thread_id, "template_variables": template_variables},
+    )
+    system_context = thread.get("content", "").strip()
+    system_context = process_template(system_context, template_variables)
+
+    log_event(
+        message="system context processed",
+        context={"thread_id": thread_id, "system_context": system_context},
+    )
+    chat_start_time = time.time()
+    system_chat = [{"role": "system", "content": system_context}]
+    total_messages = len(messages)
+    messages_by_id = {
+        message.get("metadata", {}).get("id"): (index, message)
+        for index, message in enumerate(messages)
+    }
+    dependencies = resolve_dependencies(messages)
+    turns = {}
+
+    # Messages only wait for their own dependencies, so output from
+    # independent branches is buffered to keep each message together.
+    printer.buffered = concurrency > 1 and any(
+        "depends_on" in message.get("metadata", {}) for message in messages
+    )
+
+    async def run_message(id):
+        index, message = messages_by_id[id]
+        inline = inline_ids(message)
+        current_chat = list(system_chat)
+        for ancestor in get_ancestors(dependencies, id):
+            if inline is True or ancestor in inline:
+                current_chat += await asyncio.to_thread(
+                    inline_tool_results, turns[ancestor]
+                )
+            else:
+                current_chat += turns[ancestor]
+        labels = metric_labels.set({"thread": thread_id or "", "message": id or ""})
+        try:
+            turns[id], response = await send_message(
+                message,
+                current_chat,
+                template_variables,
+                output_dir,
+                printer,
+                message_number=index + 1,
+                total_messages=total_messages,
+                stream=stream,
+                incremental=incremental,
+            )
+        finally:
+            metric_labels.reset(labels)
+            printer.flush()
+        return response
+
+    responses = await run_graph(dependencies, run_message, concurrency)
+
+    chat_end_time = time.time()
+    log_event(
+        message="chat completed",
+        context={"thread_id": thread_id},
+    )
+    printer.write(f"\nTotal Duration: {int(chat_end_time - chat_start_time)}s\n")
+    printer.flush()
+    return {id: responses[id] for id in messages_by_id}
+
+
+# Function to print batch progress, in place when attached to a terminal
+def print_batch_progress(completed, failed, total, start_time):
+    elapsed = time.time() - start_time
+    rate = completed / elapsed if elapsed else 0
+    progress = (
+        f"Progress: {completed}/{total} rows | {failed} failed | {rate:.2f} rows/s"
+    )
+    if sys.stdout.isatty():
+        print(f"\r{progress}", end="" if completed < total else "\n", flush=True)
+    else:
+        print(progress)
+
+
+# Function to run a spec once for every variable set in a vars file
+async def run_batch(
+    messages,
+    thread,
+    variable_sets,
+    output_dir,
+    verbosity_level,
+    concurrency,
+    workers,
+    stream=False,
+    incremental=False,
+):
+    """Run the parsed spec for each variable set on a bounded worker pool.
+
+    Each row writes to its own numbered directory under `output_dir`, and a
+    summary of the batch is printed and saved as `batch_summary.json`.
+    """
+    total = len(variable_sets)
+    width = len(str(total))
+    results = [None] * total
+    progress_lock = threading.Lock()
+    counts = {"completed": 0, "failed": 0}
+    batch_start_time = time.time()
+
+    async def run_row(index):
+        row_name = str(index + 1).zfill(width)
+        row_output_dir = os.path.join(output_dir, row_name)
+        row_start_time = time.time()
+        try:
+            responses = await run_thread(
+                messages,
+                thread,
+                variable_sets[index],
+                row_output_dir,
+                MessagePrinter("silent"),
+                concurrency,
+                stream,
+                incremental,
+            )
+            # Replayed messages didn't use any tokens this time
+            usage = [
+                response["usage"]
+                for response in responses.values()
+                if response and not response.get("replayed")
+            ]
+            results[index] = {
+                "row": row_name,
+                "status": "completed",
+                "duration": time.time() - row_start_time,
+                "prompt_tokens": sum(item["prompt_tokens"] or 0 for item in usage),
+                "completion_tokens": sum(
+                    item["completion_tokens"] or 0 for item in usage
+                ),
+            }
+        except Exception as e:
+            error_message = f"Error: {str(e)}"
+            log_event(
+                event_type="ERROR",
+                message="chat errored",
+                context={
+                    "thread_id": thread.get("metadata", {}).get("id"),
+                    "row": row_name,
+                    "error_message": error_message,
+                },
+            )
+            results[index] = {
+                "row": row_name,
+                "status": "failed",
+                "duration": time.time() - row_start_time,
+                "error": error_message,
+            }
+
+        with progress_lock:
+            counts["completed"] += 1
+            counts["failed"] += results[index]["status"] == "failed"
+            if verbosity_level != "silent":
+                print_batch_progress(
+                    counts["completed"], counts["failed"], total, batch_start_time
+                )
+
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def run_limited_row(index):
+        async with semaphore:
+            await run_row(index)
+
+    await asyncio.gather(*(run_limited_row(index) for index in range(total)))
+
+    duration = time.time() - batch_start_time
+    completion_tokens = sum(result.get("completion_tokens", 0) for result in results)
+    summary = {
+        "rows": total,
+        "completed": total - counts["failed"],
+        "failed": counts["failed"],
+        "duration": duration,
+        "rows_per_second": total / duration if duration else 0,
+        "prompt_tokens": sum(result.get("prompt_tokens", 0) for result in results),
+        "completion_tokens": completion_tokens,
+        "completion_tokens_per_second": (
+            completion_tokens / duration if duration else 0
+        ),
+        "results": results,
+    }
+    write_output(
+        os.path.join(output_dir, "batch_summary.json"), json.dumps(summary, indent=2)
+    )
+
+    if verbosity_level != "silent":
+        print(
+            f"\nRows: {total} | Completed: {summary['completed']} | "
+            + f"Failed: {summary['failed']} | Duration: {int(duration)}s | "
+            + f"Throughput: {summary['rows_per_second']:.2f} rows/s, "
+            + f"{summary['completion_tokens_per_second']:.1f} completion tokens/s\n"
+        )
+    return summary
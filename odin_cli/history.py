@@ -0,0 +1,147 @@
+import json
+import os
+import struct
+from odin_cli.cache import write_atomic
+
+# Offsets in the index file are fixed-width, so entry `i` is at `i * OFFSET_SIZE`
+OFFSET_FORMAT = "<Q"
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+
+class ChatHistory:
+    """The turns of an interactive chat, appended to a JSONL file as they happen.
+
+    Each line is a `{"prompt", "response"}` turn, written and synced before the
+    next prompt, so a crash loses at most the turn in progress. A sidecar
+    `.idx` file holds the byte offset of every line, so the number of turns and
+    the last few of them are read without loading the rest of the file.
+    Without a `path`, turns are only kept in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.index_path = f"{path}.idx" if path else None
+        self.turns = [] if path is None else None
+        self.count = 0
+        if path:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return
+
+        with open(self.path, "rb") as file:
+            legacy = file.read(1) == b"["
+        if legacy:
+            self.migrate()
+        if not self.index_is_valid():
+            self.rebuild_index()
+        self.count = os.path.getsize(self.index_path) // OFFSET_SIZE
+
+    def migrate(self):
+        """Rewrite a history saved as one JSON list as JSONL."""
+        with open(self.path, "r") as file:
+            turns = json.load(file)
+        write_atomic(self.path, "".join(json.dumps(turn) + "\n" for turn in turns))
+
+    def index_is_valid(self):
+        """Check that the index ends at the last complete line of the history."""
+        try:
+            index_size = os.path.getsize(self.index_path)
+        except OSError:
+            return False
+        size = os.path.getsize(self.path)
+        if index_size % OFFSET_SIZE:
+            return False
+        if not index_size:
+            return size == 0
+
+        with open(self.index_path, "rb") as index:
+            index.seek(index_size - OFFSET_SIZE)
+            (offset,) = struct.unpack(OFFSET_FORMAT, index.read(OFFSET_SIZE))
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            line = file.readline()
+        return bool(line) and line.endswith(b"\n") and offset + len(line) == size
+
+    def rebuild_index(self):
+        """Index every complete line, dropping a partly written last line."""
+        offsets = []
+        offset = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    offsets.append(offset)
+                offset += len(line)
+
+        if offset < os.path.getsize(self.path):
+            # The last turn was cut off by a crash
+            with open(self.path, "r+b") as file:
+                file.truncate(offset)
+        write_atomic(
+            self.index_path,
+            b"".join(struct.pack(OFFSET_FORMAT, line) for line in offsets),
+            mode="wb",
+        )
+
+    def __len__(self):
+        return len(self.turns) if self.turns is not None else self.count
+
+    def __getitem__(self, position):
+        if self.turns is not None:
+            return self.turns[position]
+        if position < 0:
+            position += self.count
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return self.read(position, position + 1)[0]
+
+    def __iter__(self):
+        for start in range(0, len(self), 100):
+            yield from self.read(start, min(start + 100, len(self)))
+
+    def read(self, start, stop):
+        """Return the turns from `start` up to (not including) `stop`."""
+        if self.turns is not None:
+            return self.turns[start:stop]
+        if start >= stop:
+            return []
+
+        with open(self.index_path, "rb") as index:
+            index.seek(start * OFFSET_SIZE)
+            (offset,) = struct.unpack(OFFSET_FORMAT, index.read(OFFSET_SIZE))
+        turns = []
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            while len(turns) < stop - start:
+                line = file.readline()
+                if not line:
+                    break
+                if line.strip():
+                    turns.append(json.loads(line))
+        return turns
+
+    def tail(self, count):
+        """Return the last `count` turns."""
+        return self.read(max(0, len(self) - count), len(self))
+
+    def append(self, prompt, response):
+        turn = {"prompt": prompt, "response": response}
+        if self.turns is not None:
+            self.turns.append(turn)
+            return turn
+
+        with open(self.path, "ab") as file:
+            offset = file.tell()
+            file.write(json.dumps(turn).encode("utf-8") + b"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        # The index can be rebuilt from the history, so it isn't synced
+        with open(self.index_path, "ab") as index:
+            index.write(struct.pack(OFFSET_FORMAT, offset))
+        self.count += 1
+        return turn
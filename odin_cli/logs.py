@@ -0,0 +1,170 @@
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+
+logger = logging.getLogger("odin_cli")
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+# Defaults for the `logging` config section
+default_log_settings = {
+    "max_field_bytes": 4096,
+    # What to do with a field over the budget: truncate, hash or sidecar
+    "oversized": "truncate",
+    "max_bytes": 10 * 1024 * 1024,
+    "backup_count": 5,
+}
+
+# The background listener that writes queued records, once configured
+log_listener = None
+
+
+class EventQueueHandler(logging.handlers.QueueHandler):
+    """Queue records as they are, so events are serialized by the listener."""
+
+    def prepare(self, record):
+        return record
+
+
+class EventFormatter(logging.Formatter):
+    """Format event records as JSON, keeping each field within a size budget.
+
+    Oversized strings are truncated, replaced by their hash, or moved to the
+    `sidecar` handler's file and referenced from the event by their hash.
+    """
+
+    def __init__(
+        self, fmt=LOG_FORMAT, max_field_bytes=4096, oversized="truncate", sidecar=None
+    ):
+        super().__init__(fmt)
+        self.max_field_bytes = max_field_bytes
+        self.oversized = oversized
+        self.sidecar = sidecar
+        self.sidecar_ids = set()
+
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            record.msg = json.dumps(self.apply_budget(record.msg), default=str)
+            record.args = None
+        return super().format(record)
+
+    def apply_budget(self, value):
+        if isinstance(value, dict):
+            return {key: self.apply_budget(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.apply_budget(item) for item in value]
+        # A character is at most 4 bytes, so short strings skip encoding
+        if not isinstance(value, str) or len(value) * 4 <= self.max_field_bytes:
+            return value
+
+        data = value.encode("utf-8")
+        if len(data) <= self.max_field_bytes:
+            return value
+        if self.oversized == "truncate":
+            kept = data[: self.max_field_bytes].decode("utf-8", "ignore")
+            return (
+                f"{kept}... [truncated {len(data) - len(kept.encode('utf-8'))} bytes]"
+            )
+
+        digest = hashlib.sha256(data).hexdigest()
+        if self.oversized == "sidecar" and self.sidecar:
+            # Each payload is written once, however many events refer to it
+            if digest not in self.sidecar_ids:
+                self.sidecar_ids.add(digest)
+                self.sidecar.handle(
+                    logging.makeLogRecord(
+                        {"msg": json.dumps({"id": digest, "value": value})}
+                    )
+                )
+            return {"payload_id": digest, "bytes": len(data)}
+        return {"sha256": digest, "bytes": len(data)}
+
+
+# Function to log a structured event
+def log_event(event_type="INFO", message="", context=None):
+    """Log `{"event_type", "message", "context"}` as JSON.
+
+    Nothing is built for disabled levels, and the JSON is serialized by the
+    background listener, so `context` must not be changed after logging it.
+    """
+    event_type = event_type.upper()
+    log_level = LOG_LEVELS.get(event_type, logging.INFO)
+    if not logger.isEnabledFor(log_level):
+        return
+
+    logger.log(
+        log_level,
+        {"event_type": event_type, "message": message, "context": context},
+    )
+
+
+# Function to route odin's logs through a background writer
+def configure_logging(config, log_level="INFO", log_file="odin.log"):
+    """Apply the `logging` config section and the --log-level/--log-file flags.
+
+    Records are queued and written by a listener thread to a rotating log file,
+    which is only created once something is logged.
+    """
+    global log_listener
+    settings = dict(default_log_settings, **((config or {}).get("logging") or {}))
+
+    stop_logging()
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=settings["max_bytes"],
+        backupCount=settings["backup_count"],
+        delay=True,
+    )
+    sidecar = None
+    if settings["oversized"] == "sidecar":
+        sidecar = logging.handlers.RotatingFileHandler(
+            settings.get("sidecar_file") or f"{log_file}.payloads",
+            maxBytes=settings["max_bytes"],
+            backupCount=settings["backup_count"],
+            delay=True,
+        )
+        sidecar.setFormatter(logging.Formatter("%(message)s"))
+    file_handler.setFormatter(
+        EventFormatter(
+            max_field_bytes=settings["max_field_bytes"],
+            oversized=settings["oversized"],
+            sidecar=sidecar,
+        )
+    )
+
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    log_listener.sidecar = sidecar
+    log_listener.start()
+
+    logger.handlers = [EventQueueHandler(log_queue)]
+    logger.setLevel(log_level.upper() if log_level else "INFO")
+    logger.propagate = False
+
+    return log_listener
+
+
+# Function to flush queued records and stop the background writer
+@atexit.register
+def stop_logging():
+    global log_listener
+    if log_listener is None:
+        return
+
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+    if log_listener.sidecar:
+        log_listener.sidecar.close()
+    log_listener = None
@@ -0,0 +1,243 @@
+import asyncio
+import mmap
+import os
+from odin_cli.clients import boto3_client
+from odin_cli.engine import create_completion, process_template, provider_model
+from odin_cli.logs import log_event
+from odin_cli.sources import http_session, is_s3_path, is_url, source_settings
+
+# Defaults for the `map_reduce` config section
+default_map_reduce_settings = {
+    # Size of each chunk of the input, in (estimated) tokens
+    "chunk_tokens": 3000,
+    # Requests in flight at once, which also bounds the chunks held in memory
+    "concurrency": 4,
+    "reduce_prompt": (
+        'These are answers to "{prompt}" for consecutive parts of a larger '
+        + "input. Combine them into a single answer.\n\n{results}"
+    ),
+}
+
+# Characters per token, as estimated everywhere else in odin
+CHARS_PER_TOKEN = 4
+
+# Separator between the results combined by a reduce step
+RESULT_SEPARATOR = "\n\n---\n\n"
+
+
+# Function to find where to end a chunk of `data[start:end]`
+def chunk_boundary(data, start, end):
+    """Return the offset just after the last line break in the second half of
+    the range, else after its last space, else the last offset that doesn't
+    split a UTF-8 character."""
+    middle = start + (end - start) // 2
+    for separator in (b"\n", b" "):
+        position = data.rfind(separator, middle, end)
+        if position != -1:
+            return position + 1
+    # Continuation bytes of a UTF-8 character look like 0b10xxxxxx
+    while end > start + 1 and (data[end] & 0xC0) == 0x80:
+        end -= 1
+    return end
+
+
+# Function to split a local file into chunks through a memory map
+def file_chunks(path, chunk_bytes):
+    """Yield the text of each chunk. Only the pages of the chunk being read
+    are loaded, however big the file is."""
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        start = 0
+        while start < len(data):
+            end = min(start + chunk_bytes, len(data))
+            if end < len(data):
+                end = chunk_boundary(data, start, end)
+            yield data[start:end].decode("utf-8", "replace")
+            start = end
+
+
+# Function to split a stream of blocks into chunks
+def block_chunks(blocks, chunk_bytes):
+    """Yield the text of each chunk of the concatenated `blocks`, holding at
+    most a chunk and a block at a time."""
+    pending = b""
+    for block in blocks:
+        pending += block
+        while len(pending) > chunk_bytes:
+            end = chunk_boundary(pending, 0, chunk_bytes)
+            yield pending[:end].decode("utf-8", "replace")
+            pending = pending[end:]
+    if pending:
+        yield pending.decode("utf-8", "replace")
+
+
+# Function to read an S3 object in ranges
+def s3_blocks(source, block_bytes):
+    bucket, key = source[5:].split("/", 1)
+    client = boto3_client("s3")
+    size = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    for start in range(0, size, block_bytes):
+        end = min(start + block_bytes, size) - 1
+        response = client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end}"
+        )
+        yield response["Body"].read()
+
+
+# Function to read a URL as a stream
+def url_blocks(source, block_bytes):
+    with http_session().get(
+        source, stream=True, timeout=source_settings["timeout"]
+    ) as response:
+        response.raise_for_status()
+        yield from response.iter_content(block_bytes)
+
+
+# Function to split a file, URL or S3 object into chunks
+def source_chunks(source, chunk_bytes):
+    """Yield the text of each chunk of `source`, cut at line breaks where
+    possible. Sources aren't cached or size-capped here: they're never held in
+    memory whole."""
+    if is_s3_path(source):
+        return block_chunks(s3_blocks(source, chunk_bytes), chunk_bytes)
+    if is_url(source):
+        return block_chunks(url_blocks(source, chunk_bytes), chunk_bytes)
+    if os.path.isfile(source):
+        return file_chunks(source, chunk_bytes)
+    raise ValueError(f"'{source}' isn't a file, URL or S3 path.")
+
+
+# Function to send a prompt and return the text of the response
+async def complete_text(provider, model, prompt):
+    response = await create_completion(
+        provider,
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+    )
+    return response["choices"][0]["message"]["content"]
+
+
+# Function to group results into batches that fit in a chunk
+def result_groups(results, chunk_bytes):
+    """Every group has at least two results, so each reduce round shrinks
+    them even when single results are bigger than a chunk."""
+    groups = [[]]
+    size = 0
+    for result in results:
+        length = len(result) + len(RESULT_SEPARATOR)
+        if len(groups[-1]) > 1 and size + length > chunk_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(result)
+        size += length
+    if len(groups) > 1 and len(groups[-1]) == 1:
+        last = groups.pop()
+        groups[-1] += last
+    return groups
+
+
+# Function to answer a prompt over an input too big for a single request
+async def map_reduce(
+    provider,
+    source,
+    prompt,
+    model=None,
+    variables=None,
+    chunk_tokens=None,
+    concurrency=None,
+    reduce_prompt=None,
+):
+    """Run `prompt` on each chunk of `source` (a file, URL or S3 path) as
+    `{chunk}`, then combine the answers with `reduce_prompt` as `{results}`.
+
+    Chunks are sent `concurrency` at a time, and the next one is only read
+    once a request finishes, so memory stays bounded by the chunk size times
+    the concurrency. Answers that don't fit in one chunk together are
+    combined in groups, and the groups' answers combined in turn.
+    """
+    model = provider_model(provider, model)
+    variables = variables or {}
+    chunk_bytes = (
+        chunk_tokens or default_map_reduce_settings["chunk_tokens"]
+    ) * CHARS_PER_TOKEN
+    semaphore = asyncio.Semaphore(
+        concurrency or default_map_reduce_settings["concurrency"]
+    )
+    reduce_prompt = reduce_prompt or default_map_reduce_settings["reduce_prompt"]
+    # The reduce step quotes the rendered prompt, which has no chunk of its own
+    question = process_template(prompt, {**variables, "chunk": "the input"}).strip()
+    if "{chunk}" not in prompt:
+        prompt = f"{prompt}\n\n{{chunk}}"
+
+    async def run_limited(prompt_text):
+        try:
+            return await complete_text(provider, model, prompt_text)
+        finally:
+            semaphore.release()
+
+    chunks = source_chunks(source, chunk_bytes)
+    tasks = []
+    failed = []
+
+    def record_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            failed.append(task)
+
+    try:
+        while True:
+            # Stop reading chunks once a request has failed: the map step
+            # can't succeed anymore
+            if failed:
+                await failed[0]
+            # Wait for a free slot before reading the next chunk into memory
+            await semaphore.acquire()
+            if failed:
+                semaphore.release()
+                await failed[0]
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                semaphore.release()
+                break
+            map_prompt = process_template(prompt, {**variables, "chunk": chunk})
+            tasks.append(asyncio.ensure_future(run_limited(map_prompt)))
+            tasks[-1].add_done_callback(record_failure)
+        results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        chunks.close()
+    log_event(
+        message="map-reduce chunks mapped",
+        context={"source": source, "model": model, "chunks": len(results)},
+    )
+
+    rounds = 0
+    while len(results) > 1:
+        rounds += 1
+        reduce_tasks = []
+        for group in result_groups(results, chunk_bytes):
+            await semaphore.acquire()
+            reduce_tasks.append(
+                asyncio.ensure_future(
+                    run_limited(
+                        process_template(
+                            reduce_prompt,
+                            {
+                                **variables,
+                                "prompt": question,
+                                "results": RESULT_SEPARATOR.join(group),
+                            },
+                        )
+                    )
+                )
+            )
+        results = await asyncio.gather(*reduce_tasks)
+    log_event(
+        message="map-reduce completed",
+        context={"source": source, "model": model, "reduce_rounds": rounds},
+    )
+    return results[0] if results else ""
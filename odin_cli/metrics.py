@@ -0,0 +1,285 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from odin_cli.cache import write_atomic
+from odin_cli.output import write_output
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# The thread and message that requests on this thread are sent for
+metric_labels = contextvars.ContextVar("metric_labels", default={})
+
+# Metrics of the running `odin run` alone, for its summary
+run_metrics = contextvars.ContextVar("run_metrics", default=None)
+
+# Settings from the `metrics` config section
+metrics_settings = {"textfile": None, "port": None, "prices": {}}
+
+# The HTTP server exposing the metrics, once started
+metrics_server = None
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(key), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        key = tuple(sorted(labels.items()))
+        state = self.values.setdefault(
+            key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        )
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state["buckets"][index] += 1
+        state["sum"] += value
+        state["count"] += 1
+
+    def samples(self):
+        for key, state in self.values.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, state["buckets"]):
+                yield f"{self.name}_bucket", {**labels, "le": str(bound)}, count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, state["count"]
+            yield f"{self.name}_sum", labels, state["sum"]
+            yield f"{self.name}_count", labels, state["count"]
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                for name, labels, value in metric.samples():
+                    label_text = ",".join(
+                        f'{key}="{escape_label(value)}"'
+                        for key, value in labels.items()
+                    )
+                    lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Function to escape a Prometheus label value
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class RequestMetrics:
+    """The request, latency, token and cost metrics of a registry."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.requests_total = registry.counter(
+            "odin_requests_total", "Provider requests, by outcome."
+        )
+        self.request_duration = registry.histogram(
+            "odin_request_duration_seconds",
+            "Provider request latency (until the response, or the start of a stream).",
+        )
+        self.prompt_tokens_total = registry.counter(
+            "odin_prompt_tokens_total", "Prompt tokens."
+        )
+        self.completion_tokens_total = registry.counter(
+            "odin_completion_tokens_total", "Completion tokens."
+        )
+        self.cost_total = registry.counter(
+            "odin_cost_dollars_total", "Estimated cost from the configured prices."
+        )
+
+
+# Metrics of every request in the process, as exported to Prometheus
+registry = MetricsRegistry()
+request_metrics = RequestMetrics(registry)
+
+
+# Function to get the metrics a request is recorded in
+def active_metrics():
+    metrics = run_metrics.get()
+    return [request_metrics] if metrics is None else [request_metrics, metrics]
+
+
+# Function to get the labels of a request to a model
+def request_labels(provider, model):
+    labels = {"provider": provider, "model": model or "", "thread": "", "message": ""}
+    labels.update(metric_labels.get())
+    return labels
+
+
+# Function to record the outcome and latency of a provider request
+def record_request(provider, model, duration, error=None):
+    labels = request_labels(provider, model)
+    status = "ok" if error is None else type(error).__name__
+    for metrics in active_metrics():
+        with metrics.registry.lock:
+            metrics.requests_total.inc({**labels, "status": status})
+            metrics.request_duration.observe(labels, duration)
+
+
+# Function to record the tokens used by a provider request
+def record_usage(provider, model, prompt_tokens, completion_tokens):
+    labels = request_labels(provider, model)
+    prompt_tokens = prompt_tokens or 0
+    completion_tokens = completion_tokens or 0
+    # Prices are per 1000 tokens
+    prices = (metrics_settings.get("prices") or {}).get(model) or {}
+    cost = (
+        prompt_tokens * prices.get("prompt", 0)
+        + completion_tokens * prices.get("completion", 0)
+    ) / 1000
+    for metrics in active_metrics():
+        with metrics.registry.lock:
+            metrics.prompt_tokens_total.inc(labels, prompt_tokens)
+            metrics.completion_tokens_total.inc(labels, completion_tokens)
+            if cost:
+                metrics.cost_total.inc(labels, cost)
+
+
+# Function to summarize the metrics by model and by message
+def metrics_summary(metrics=None):
+    """Return request, error, token, cost and latency totals as a dict, for
+    the running `odin run` or else the whole process."""
+    metrics = metrics or run_metrics.get() or request_metrics
+    summary = {"models": {}, "messages": {}}
+
+    def entry(group, name):
+        return summary[group].setdefault(
+            name,
+            {
+                "requests": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost": 0.0,
+                "latency_seconds": 0.0,
+            },
+        )
+
+    def add(labels, field, value):
+        model = f"{labels['provider']}/{labels['model']}"
+        entries = [entry("models", model)]
+        if labels.get("thread") or labels.get("message"):
+            entries.append(entry("messages", f"{labels['thread']}/{labels['message']}"))
+        for item in entries:
+            item[field] += value
+
+    with metrics.registry.lock:
+        for key, value in metrics.requests_total.values.items():
+            labels = dict(key)
+            add(labels, "requests", value)
+            if labels["status"] != "ok":
+                add(labels, "errors", value)
+        for metric, field in [
+            (metrics.prompt_tokens_total, "prompt_tokens"),
+            (metrics.completion_tokens_total, "completion_tokens"),
+            (metrics.cost_total, "cost"),
+        ]:
+            for key, value in metric.values.items():
+                add(dict(key), field, value)
+        for key, state in metrics.request_duration.values.items():
+            add(dict(key), "latency_seconds", state["sum"])
+
+    for group in summary.values():
+        for item in group.values():
+            item["mean_latency_seconds"] = (
+                round(item.pop("latency_seconds") / item["requests"], 3)
+                if item["requests"]
+                else None
+            )
+            item["cost"] = round(item["cost"], 6)
+    return summary
+
+
+# Function to write the metrics to a Prometheus text-format file
+@atexit.register
+def write_textfile(path=None):
+    path = path or metrics_settings.get("textfile")
+    if path:
+        write_atomic(path, registry.render())
+
+
+# Function to serve the metrics over HTTP for Prometheus to scrape
+def start_http_server(port, host="127.0.0.1"):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Function to configure metric exports
+def configure_metrics(config):
+    """Apply the `metrics` config section."""
+    global metrics_server
+    metrics_settings.update((config or {}).get("metrics") or {})
+    if metrics_settings.get("port") and metrics_server is None:
+        metrics_server = start_http_server(int(metrics_settings["port"]))
+
+
+# Context manager recording the requests made within it for a run's summary
+@contextlib.contextmanager
+def collect_metrics():
+    """Under `odin serve` the process outlives many runs, so each run keeps
+    its own metrics besides the process-wide ones."""
+    token = run_metrics.set(RequestMetrics(MetricsRegistry()))
+    try:
+        yield
+    finally:
+        run_metrics.reset(token)
+
+
+# Function to write the metrics summary of a run
+def save_metrics_summary(file_path):
+    write_output(file_path, json.dumps(metrics_summary(), indent=2))
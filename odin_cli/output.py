@@ -0,0 +1,253 @@
+import asyncio
+import contextlib
+import contextvars
+import io
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from odin_cli.cache import write_atomic
+from odin_cli.clients import boto3_client
+from odin_cli.logs import log_event
+from odin_cli.sources import is_s3_path
+
+# An `--output` ending in one of these is written as a single archive
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".zip")
+
+# Objects bigger than this are uploaded to S3 in parts of this size
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Sink the output files of the running spec go through
+output_sink = contextvars.ContextVar("output_sink", default=None)
+
+
+# Function to get the name of a file within an archive or S3 prefix
+def entry_name(root, path):
+    """Strip `root` from `path`; paths outside of it keep their own, minus
+    any leading `/` and `..`."""
+    prefix = root.rstrip("/") + "/"
+    if not path.startswith(prefix) and not is_s3_path(root):
+        path, prefix = os.path.normpath(path), os.path.normpath(root) + os.sep
+    if path.startswith(prefix):
+        path = path[len(prefix) :]
+    parts = path.replace(os.sep, "/").split("/")
+    return "/".join(part for part in parts if part not in ("", ".", ".."))
+
+
+class DirectoryTarget:
+    """Writes each file where its path points, through a temp file and a rename."""
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def write(self, path, data):
+        write_atomic(path, data, "wb" if isinstance(data, bytes) else "w")
+
+    def close(self, discard=False):
+        pass
+
+
+class ArchiveTarget:
+    """Adds files to a tar (optionally gzipped) or zip archive.
+
+    The archive is built next to its path and moved into place once it's
+    closed, so it's either the previous run's or complete. It replaces the
+    previous run's rather than adding to it, unless the run failed.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.archive = None
+
+    def open(self):
+        directory = os.path.dirname(self.root) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        os.close(fd)
+        if self.root.endswith(".zip"):
+            self.archive = zipfile.ZipFile(self.temp_path, "w", zipfile.ZIP_DEFLATED)
+        else:
+            compressed = self.root.endswith((".tar.gz", ".tgz"))
+            self.archive = tarfile.open(self.temp_path, "w:gz" if compressed else "w")
+
+    def write(self, path, data):
+        if self.archive is None:
+            self.open()
+        name = entry_name(self.root, path)
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.writestr(name, data)
+            return
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self, discard=False):
+        # A run that wrote nothing leaves the previous archive alone
+        if self.archive is None:
+            return
+        self.archive.close()
+        if discard:
+            os.unlink(self.temp_path)
+            return
+        os.replace(self.temp_path, self.root)
+
+
+class S3Target:
+    """Uploads files under an `s3://bucket/prefix`, in parts when they're big."""
+
+    def __init__(self, root):
+        self.root = root
+        self.bucket, _, self.prefix = root[len("s3://") :].partition("/")
+
+    def write(self, path, data):
+        from boto3.s3.transfer import TransferConfig
+
+        key = "/".join(
+            part
+            for part in (self.prefix.strip("/"), entry_name(self.root, path))
+            if part
+        )
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        boto3_client("s3").upload_fileobj(
+            io.BytesIO(data),
+            self.bucket,
+            key,
+            Config=TransferConfig(
+                multipart_threshold=MULTIPART_CHUNK_SIZE,
+                multipart_chunksize=MULTIPART_CHUNK_SIZE,
+            ),
+        )
+
+    def close(self, discard=False):
+        pass
+
+
+# Function to check if an `--output` value is a plain directory
+def is_directory_output(output_dir):
+    return not is_s3_path(output_dir) and not output_dir.endswith(ARCHIVE_SUFFIXES)
+
+
+# Function to get the target an `--output` value points to
+def output_target(output_dir):
+    if is_s3_path(output_dir):
+        return S3Target(output_dir)
+    if output_dir.endswith(ARCHIVE_SUFFIXES):
+        return ArchiveTarget(output_dir)
+    return DirectoryTarget(output_dir)
+
+
+# Function to write a file to a target, timed as a `write` span
+def write_file(target, path, data):
+    from odin_cli.profiling import profiler
+
+    with profiler.span("write_output", "write", path=path):
+        target.write(path, data)
+
+
+class OutputSink:
+    """Writes output files to a target on a background thread, so a slow disk
+    or upload doesn't hold up the next request.
+
+    Files are written in the order they're given. A failed write is logged
+    when it happens, and the first failure is raised by `close`, which then
+    discards what an archive target holds.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.queue = queue.Queue()
+        self.errors = []
+        self.thread = threading.Thread(target=self.run, name="odin-output", daemon=True)
+        self.thread.start()
+
+    def write(self, path, data):
+        # The write runs in the caller's context, so its span has its message
+        self.queue.put((path, data, contextvars.copy_context()))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            path = None
+            try:
+                if item is None:
+                    return
+                path, data, context = item
+                context.run(write_file, self.target, path, data)
+            except Exception as e:
+                self.errors.append(e)
+                log_event(
+                    event_type="ERROR",
+                    message="output write failed",
+                    context={"path": path, "error_message": f"Error: {str(e)}"},
+                )
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait for the files written so far."""
+        self.queue.join()
+
+    def close(self, discard=False):
+        """Wait for the queued files and close the target. With `discard`
+        (the run failed), an archive target is dropped rather than replacing
+        the previous one."""
+        self.queue.put(None)
+        self.thread.join()
+        self.target.close(discard=discard or bool(self.errors))
+        if self.errors:
+            raise self.errors[0]
+
+
+# Function to write an output file through the running spec's sink
+def write_output(path, data):
+    """Queue `data` (text or bytes) for `path`. Outside of a run it's written
+    straight away."""
+    sink = output_sink.get()
+    if sink is None:
+        write_file(DirectoryTarget(), path, data)
+        return
+    sink.write(path, data)
+
+
+# Function to start a sink for `output_dir`, unless one is already running
+def start_sink(output_dir):
+    """Return the sink and the token to reset when it's ours to close, or None
+    when an enclosing run already writes to `output_dir`."""
+    sink = output_sink.get()
+    if sink is not None and sink.target.root == output_dir:
+        return sink, None
+    sink = OutputSink(output_target(output_dir))
+    return sink, output_sink.set(sink)
+
+
+# Context manager sending the output files written within it to `output_dir`
+@contextlib.contextmanager
+def open_output(output_dir):
+    sink, token = start_sink(output_dir)
+    failed = True
+    try:
+        yield sink
+        failed = False
+    finally:
+        if token is not None:
+            output_sink.reset(token)
+            sink.close(discard=failed)
+
+
+# Async version of `open_output`, which closes the sink off the event loop
+@contextlib.asynccontextmanager
+async def open_output_async(output_dir):
+    sink, token = start_sink(output_dir)
+    failed = True
+    try:
+        yield sink
+        failed = False
+    finally:
+        if token is not None:
+            output_sink.reset(token)
+            await asyncio.to_thread(sink.close, discard=failed)
@@ -0,0 +1,131 @@
+import importlib
+from odin_cli.profiling import add_profile_arguments
+
+# Static manifest of the available plugins. It holds everything needed to
+# build the argparse tree, so plugin modules (and the SDKs they import) are
+# only loaded once one of their subcommands actually runs.
+PLUGINS = {
+    "bedrock": {
+        "help": "Interact with Amazon Bedrock",
+        "default_model": "anthropic.claude-v2",
+        "command": "bedrock_command",
+        "arguments": [
+            (
+                ["--stream"],
+                {
+                    "action": "store_true",
+                    "help": "Print the response as it is generated",
+                },
+            ),
+        ],
+    },
+    "openai": {
+        "help": "Interact with OpenAI",
+        "default_model": "gpt-4",
+        "command": "openai_command",
+        "arguments": [
+            (
+                ["--piped"],
+                {
+                    "action": "store_true",
+                    "help": "Specifies the prompt is receiving input from a piped command",
+                },
+            ),
+            (
+                ["--pipe-key"],
+                {
+                    "default": "",
+                    "help": "Specifies the prompt is receiving input from a piped command",
+                },
+            ),
+            (
+                ["--stream"],
+                {
+                    "action": "store_true",
+                    "help": "Print the response as it is generated",
+                },
+            ),
+        ],
+    },
+    "router": {
+        "help": "Send prompts to the fastest healthy provider of a route",
+        "default_model": "default",
+        "command": "router_command",
+        "arguments": [
+            (
+                ["--stream"],
+                {
+                    "action": "store_true",
+                    "help": "Print the response as it is generated",
+                },
+            ),
+        ],
+    },
+}
+
+
+def load_plugin(plugin_name):
+    try:
+        plugin = importlib.import_module(f".{plugin_name}", __name__)
+
+        return plugin
+    except (ImportError, AssertionError):
+        raise ImportError(
+            f"Plugin for {plugin_name} not found or does not conform to the interface."
+        )
+
+
+# Function to create a command that imports its plugin when invoked
+def lazy_command(plugin_name, command_name):
+    def command(args, config):
+        if getattr(args, "map_reduce", None):
+            from odin_cli.commands.ask import map_reduce_command
+
+            return map_reduce_command(plugin_name, args, config)
+        plugin = load_plugin(plugin_name)
+        return getattr(plugin, command_name)(args, config)
+
+    return command
+
+
+def register_ask_args(subparsers, config, plugin_name):
+    """Register the `ask` subcommand for a plugin from its manifest entry."""
+    manifest = PLUGINS[plugin_name]
+
+    # set default values for arguments
+    default_model = (config.get(plugin_name) or {}).get(
+        "model", manifest["default_model"]
+    )
+
+    # register arguments
+    parser_plugin = subparsers.add_parser(plugin_name, help=manifest["help"])
+    parser_plugin.add_argument("prompt", nargs="?", help="Prompt for the command")
+    parser_plugin.add_argument("template_args", nargs="*", help="Template arguments")
+    parser_plugin.add_argument(
+        "--model", default=default_model, help="Specify the model"
+    )
+    parser_plugin.add_argument("--chat", help="Filename of the chat session")
+    parser_plugin.add_argument(
+        "--no-cache", action="store_true", help="Don't use the response cache"
+    )
+    parser_plugin.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached responses and replace them with fresh ones",
+    )
+    parser_plugin.add_argument(
+        "--map-reduce",
+        metavar="SOURCE",
+        help="Run the prompt on each chunk of a large file, URL or S3 object as {chunk}, then combine the answers",
+    )
+    parser_plugin.add_argument(
+        "--reduce-prompt",
+        help="Prompt that combines the answers of --map-reduce as {results}",
+    )
+    parser_plugin.add_argument(
+        "--chunk-tokens", type=int, help="Size of each --map-reduce chunk, in tokens"
+    )
+    add_profile_arguments(parser_plugin)
+    for flags, options in manifest["arguments"]:
+        parser_plugin.add_argument(*flags, **options)
+    parser_plugin.set_defaults(func=lazy_command(plugin_name, manifest["command"]))
@@ -1,41 +1,84 @@
-import json
-import boto3
 from odin_cli.utils import (
     read_content_from_source,
     process_template_arguments,
     handle_interactive_chat,
     handle_single_prompt,
+    print_stream_async,
     read_stdin_if_empty,
 )
+import odin_cli.api as api
+from odin_cli.context import ContextWindow
+from odin_cli.engine import create_completion, stream_completion
 
-client = boto3.client("bedrock-runtime")
 
+def process_single_prompt(
+    service_name, prompt, model="anthropic.claude-v2", stream=False
+):
+    """Process a single prompt using Bedrock.
 
-def process_single_prompt(service_name, prompt, model="anthropic.claude-v2"):
-    """Process a single prompt using Bedrock."""
+    With `stream`, the response is printed as it is generated.
+    """
     try:
-        response = client.invoke_model(
-            modelId=model,  # Model name specified in the CLI command
-            contentType="application/json",
-            body=json.dumps({"prompt": prompt}),
-        )
-        return response["body"].read().decode()
+        # Model name specified in the CLI command
+        if stream:
+            completion = api.stream("bedrock", prompt, model=model)
+            return api.run_sync(print_stream_async(completion))
+        response = api.run_sync(api.complete("bedrock", prompt, model=model))
+        return response["choices"][0]["message"]["content"]
     except Exception as e:
         return f"Error: {str(e)}"
 
 
+# Function to summarize earlier turns of a chat
+def summarize(model, text):
+    response = api.run_sync(
+        create_completion(
+            "bedrock",
+            model=model,
+            messages=[{"role": "user", "content": text}],
+            temperature=0,
+        )
+    )
+    return response["choices"][0]["message"]["content"]
+
+
 def process_interactive_chat(
-    service_name, user_input, chat_history, model="anthropic.claude-v2"
+    service_name,
+    user_input,
+    chat_history,
+    model="anthropic.claude-v2",
+    stream=False,
+    context_window=None,
 ):
-    """Process interactive chat using Bedrock."""
+    """Process interactive chat using Bedrock.
+
+    Only the turns of `chat_history` that fit in the context window are sent.
+    """
     try:
-        chat_payload = {"user_input": user_input, "chat_history": chat_history}
-        response = client.invoke_model(
-            modelId=model,
-            contentType="application/json",
-            body=json.dumps(chat_payload),
+        system = "You are a helpful assistant."
+        context_window = context_window or ContextWindow(chat_history, model=model)
+        turns, summary, _ = context_window.build(
+            system, user_input, summarize=lambda text: summarize(model, text)
         )
-        return response["body"].read().decode()
+
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append(
+                {"role": "system", "content": f"Earlier in this chat: {summary}"}
+            )
+        for entry in turns:
+            messages.append({"role": "user", "content": entry["prompt"]})
+            messages.append({"role": "assistant", "content": entry["response"]})
+        messages.append({"role": "user", "content": user_input})
+        if stream:
+            completion = stream_completion("bedrock", model=model, messages=messages)
+            return api.run_sync(print_stream_async(completion))
+
+        response = api.run_sync(
+            create_completion("bedrock", model=model, messages=messages)
+        )
+
+        return response["choices"][0]["message"]["content"]
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -45,6 +88,7 @@ def bedrock_command(args, config):
     model = args.model
     chat = args.chat
     template_args = args.template_args
+    stream = args.stream
 
     if chat:
         initial_prompt = None
@@ -52,27 +96,21 @@ def bedrock_command(args, config):
             initial_prompt = read_content_from_source(prompt)
             initial_prompt = process_template_arguments(initial_prompt, template_args)
 
-        response = handle_interactive_chat("bedrock", chat, initial_prompt, model)
+        response = handle_interactive_chat(
+            "bedrock",
+            chat,
+            initial_prompt,
+            model,
+            resume_turns=(config.get("chat") or {}).get("resume_turns", 10),
+            context=(config.get("chat") or {}).get("context"),
+            stream=stream,
+        )
     else:
         prompt = read_content_from_source(read_stdin_if_empty(prompt))
         prompt = process_template_arguments(prompt, template_args)
-        response = handle_single_prompt("bedrock", prompt, model)
+        response = handle_single_prompt("bedrock", prompt, model, stream=stream)
+        if stream and not response.startswith("Error:"):
+            # The response was already printed as it was generated
+            return
 
     print(response)
-
-
-def register_ask_args(subparsers, config):
-    # set default values for arguments
-    default_model = config.get("bedrock", {}).get("model", "anthropic.claude-v2")
-
-    # register arguments
-    parser_bedrock = subparsers.add_parser(
-        "bedrock", help="Interact with Amazon Bedrock"
-    )
-    parser_bedrock.add_argument("prompt", nargs="?", help="Prompt for the command")
-    parser_bedrock.add_argument("template_args", nargs="*", help="Template arguments")
-    parser_bedrock.add_argument(
-        "--model", default=default_model, help="Specify the model"
-    )
-    parser_bedrock.add_argument("--chat", help="Filename of the chat session")
-    parser_bedrock.set_defaults(func=bedrock_command)
@@ -1,35 +1,38 @@
-from openai import OpenAI
 from odin_cli.utils import (
     read_content_from_source,
     process_template_arguments,
     handle_interactive_chat,
     handle_single_prompt,
+    print_stream_async,
     read_stdin_if_piped,
 )
 import json
+import time
+import odin_cli.api as api
+from odin_cli.context import ContextWindow
+from odin_cli.completions import completion_metrics
+from odin_cli.engine import create_completion, stream_completion
 
-client = OpenAI()
 
+def process_single_prompt(service_name, prompt, model="gpt-4", stream=False):
+    """Process a single prompt using OpenAI and log the request and response.
 
-def process_single_prompt(service_name, prompt, model="gpt-4"):
-    """Process a single prompt using OpenAI and log the request and response."""
+    With `stream`, the response is printed as it is generated.
+    """
     log_entry = {"service_name": service_name, "model": model, "prompt": prompt}
 
     try:
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt},
-        ]
-        max_tokens = None
-        temperature = 0
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-
-        log_entry["response"] = response.choices[0].message.content
+        if stream:
+            completion = api.stream("openai", prompt, model=model)
+            log_entry["response"] = api.run_sync(print_stream_async(completion))
+            log_entry.update(completion.metrics)
+        else:
+            start_time = time.time()
+            response = api.run_sync(api.complete("openai", prompt, model=model))
+            log_entry["response"] = response["choices"][0]["message"]["content"]
+            log_entry.update(
+                completion_metrics(response["usage"], start_time, None, time.time())
+            )
     except Exception as e:
         error_message = f"Error: {str(e)}"
         log_entry["response"] = error_message
@@ -42,25 +45,62 @@ def process_single_prompt(service_name, prompt, model="gpt-4"):
     return log_entry["response"]
 
 
-def process_interactive_chat(service_name, user_input, chat_history, model="gpt-4"):
-    """Process interactive chat using OpenAI ChatCompletion."""
+# Function to summarize earlier turns of a chat
+def summarize(model, text):
+    response = api.run_sync(
+        create_completion(
+            "openai",
+            model=model,
+            messages=[{"role": "user", "content": text}],
+            temperature=0,
+        )
+    )
+    return response["choices"][0]["message"]["content"]
+
+
+def process_interactive_chat(
+    service_name,
+    user_input,
+    chat_history,
+    model="gpt-4",
+    stream=False,
+    context_window=None,
+):
+    """Process interactive chat using OpenAI ChatCompletion.
+
+    Only the turns of `chat_history` that fit in the context window are sent.
+    """
     try:
+        system = "You are a helpful assistant."
+        context_window = context_window or ContextWindow(chat_history, model=model)
+        turns, summary, _ = context_window.build(
+            system, user_input, summarize=lambda text: summarize(model, text)
+        )
+
         # Create a list of messages for the chat history
-        messages = [{"role": "system", "content": "You are a helpful assistant."}]
-        messages += [
-            {
-                "role": "user" if entry["prompt"] else "assistant",
-                "content": entry["prompt"] or entry["response"],
-            }
-            for entry in chat_history
-        ]
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append(
+                {"role": "system", "content": f"Earlier in this chat: {summary}"}
+            )
+        for entry in turns:
+            messages.append({"role": "user", "content": entry["prompt"]})
+            messages.append({"role": "assistant", "content": entry["response"]})
         messages.append({"role": "user", "content": user_input})
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
+        if stream:
+            # The async client belongs to the event loop, so the stream is
+            # opened on it
+            async def print_response():
+                completion = stream_completion("openai", model=model, messages=messages)
+                return await print_stream_async(completion)
+
+            return api.run_sync(print_response())
+
+        response = api.run_sync(
+            create_completion("openai", model=model, messages=messages)
         )
 
-        return response.choices[0].message.content
+        return response["choices"][0]["message"]["content"]
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -72,6 +112,7 @@ def openai_command(args, config):
     piped = args.piped
     pipe_key = args.pipe_key
     template_args = args.template_args
+    stream = args.stream
 
     if chat:
         initial_prompt = None
@@ -79,35 +120,21 @@ def openai_command(args, config):
             initial_prompt = read_content_from_source(prompt)
             initial_prompt = process_template_arguments(initial_prompt, template_args)
 
-        response = handle_interactive_chat("openai", chat, initial_prompt, model)
+        response = handle_interactive_chat(
+            "openai",
+            chat,
+            initial_prompt,
+            model,
+            resume_turns=(config.get("chat") or {}).get("resume_turns", 10),
+            context=(config.get("chat") or {}).get("context"),
+            stream=stream,
+        )
     else:
         prompt = read_content_from_source(read_stdin_if_piped(prompt, piped, pipe_key))
         prompt = process_template_arguments(prompt, template_args)
-        response = handle_single_prompt("openai", prompt, model)
+        response = handle_single_prompt("openai", prompt, model, stream=stream)
+        if stream and not response.startswith("Error:"):
+            # The response was already printed as it was generated
+            return
 
     print(response)
-
-
-def register_ask_args(subparsers, config):
-    # set default values for arguments
-    default_model = config.get("openai", {}).get("model", "gpt-4")
-
-    # register arguments
-    parser_openai = subparsers.add_parser("openai", help="Interact with OpenAI")
-    parser_openai.add_argument("prompt", nargs="?", help="Prompt for the command")
-    parser_openai.add_argument("template_args", nargs="*", help="Template arguments")
-    parser_openai.add_argument(
-        "--model", default=default_model, help="Specify the model"
-    )
-    parser_openai.add_argument("--chat", help="Filename of the chat session")
-    parser_openai.add_argument(
-        "--piped",
-        action="store_true",
-        help="Specifies the prompt is receiving input from a piped command",
-    )
-    parser_openai.add_argument(
-        "--pipe-key",
-        default="",
-        help="Specifies the prompt is receiving input from a piped command",
-    )
-    parser_openai.set_defaults(func=openai_command)
@@ -0,0 +1,112 @@
+from odin_cli.utils import (
+    read_content_from_source,
+    process_template_arguments,
+    handle_interactive_chat,
+    handle_single_prompt,
+    print_stream_async,
+    read_stdin_if_empty,
+)
+import odin_cli.api as api
+from odin_cli.context import ContextWindow
+from odin_cli.engine import create_completion, stream_completion
+
+
+def process_single_prompt(service_name, prompt, model="default", stream=False):
+    """Process a single prompt through a route.
+
+    With `stream`, the response is printed as it is generated.
+    """
+    try:
+        if stream:
+            completion = api.stream("router", prompt, model=model)
+            return api.run_sync(print_stream_async(completion))
+        response = api.run_sync(api.complete("router", prompt, model=model))
+        return response["choices"][0]["message"]["content"]
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+# Function to summarize earlier turns of a chat
+def summarize(model, text):
+    response = api.run_sync(
+        create_completion(
+            "router",
+            model=model,
+            messages=[{"role": "user", "content": text}],
+            temperature=0,
+        )
+    )
+    return response["choices"][0]["message"]["content"]
+
+
+def process_interactive_chat(
+    service_name,
+    user_input,
+    chat_history,
+    model="default",
+    stream=False,
+    context_window=None,
+):
+    """Process interactive chat through a route.
+
+    Only the turns of `chat_history` that fit in the context window are sent.
+    """
+    try:
+        system = "You are a helpful assistant."
+        context_window = context_window or ContextWindow(chat_history, model=model)
+        turns, summary, _ = context_window.build(
+            system, user_input, summarize=lambda text: summarize(model, text)
+        )
+
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append(
+                {"role": "system", "content": f"Earlier in this chat: {summary}"}
+            )
+        for entry in turns:
+            messages.append({"role": "user", "content": entry["prompt"]})
+            messages.append({"role": "assistant", "content": entry["response"]})
+        messages.append({"role": "user", "content": user_input})
+        if stream:
+            completion = stream_completion("router", model=model, messages=messages)
+            return api.run_sync(print_stream_async(completion))
+
+        response = api.run_sync(
+            create_completion("router", model=model, messages=messages)
+        )
+        return response["choices"][0]["message"]["content"]
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def router_command(args, config):
+    prompt = args.prompt
+    model = args.model
+    chat = args.chat
+    template_args = args.template_args
+    stream = args.stream
+
+    if chat:
+        initial_prompt = None
+        if prompt:
+            initial_prompt = read_content_from_source(prompt)
+            initial_prompt = process_template_arguments(initial_prompt, template_args)
+
+        response = handle_interactive_chat(
+            "router",
+            chat,
+            initial_prompt,
+            model,
+            resume_turns=(config.get("chat") or {}).get("resume_turns", 10),
+            context=(config.get("chat") or {}).get("context"),
+            stream=stream,
+        )
+    else:
+        prompt = read_content_from_source(read_stdin_if_empty(prompt))
+        prompt = process_template_arguments(prompt, template_args)
+        response = handle_single_prompt("router", prompt, model, stream=stream)
+        if stream and not response.startswith("Error:"):
+            # The response was already printed as it was generated
+            return
+
+    print(response)
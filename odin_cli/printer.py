@@ -0,0 +1,107 @@
+import contextvars
+import sys
+import threading
+from datetime import datetime
+from odin_cli.profiling import format_phase_table
+
+# Output held back by a buffered printer until the message it belongs to is done.
+# Each message runs in its own task, so each gets its own buffer.
+buffered_lines = contextvars.ContextVar("buffered_lines", default=None)
+
+
+class MessagePrinter:
+    colors = {
+        "info": "\033[94m",
+        "assistant": "\033[94m",
+        "user": "\033[95m",
+        "warning": "\033[93m",
+        "error": "\033[91m",
+        "default": "\033[0m",
+    }
+
+    def __init__(self, verbosity_level, buffered=False):
+        self.verbosity_level = verbosity_level
+        self.buffered = buffered
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        if self.verbosity_level == "silent":
+            return
+        if not self.buffered:
+            print(text)
+            return
+        lines = buffered_lines.get()
+        if lines is None:
+            lines = []
+            buffered_lines.set(lines)
+        lines.append(text)
+
+    def flush(self):
+        lines = buffered_lines.get()
+        buffered_lines.set(None)
+        if lines:
+            with self.lock:
+                print("\n".join(lines))
+
+    def print_header(self, role, message_number, total_messages, model):
+        timestamp = datetime.now().strftime("%m-%d-%Y %H:%M:%S")
+        role = role.upper()
+        progress = f"Message {message_number} of {total_messages}"
+        content = f"{role} [{timestamp}] | {progress} [{model}]"
+        divider = "▓" * int(((120 - len(content)) / 2) - 2)
+
+        self.write(f"\n{divider} {content} {divider}\n")
+
+    def print_content(self, message, role=""):
+        colors = self.colors
+        if role in colors:
+            colored_msg = f"{colors[role]}{message}{colors['default']}"
+        else:
+            colored_msg = message
+
+        self.write(colored_msg)
+
+    async def stream_content(self, chunks, role=""):
+        """Print chunks (from an async iterable) as they pass through.
+
+        Buffered and silent printers print the collected content once the
+        chunks are exhausted instead.
+        """
+        if self.buffered or self.verbosity_level == "silent":
+            collected = []
+            async for chunk in chunks:
+                collected.append(chunk)
+                yield chunk
+            self.print_content("".join(collected), role=role)
+            return
+
+        colors = self.colors
+        sys.stdout.write(colors.get(role, ""))
+        async for chunk in chunks:
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            yield chunk
+        sys.stdout.write(f"{colors['default'] if role in colors else ''}\n")
+        sys.stdout.flush()
+
+    def print_footer(self, response_time, model, token_metrics, latency_metrics=None):
+        content = (
+            f"Model: {model} | "
+            + f"Duration: {int(response_time)}s | "
+            + f"Prompt: {token_metrics['prompt_tokens'] or '-'} tokens | "
+            + f"Completion: {token_metrics['completion_tokens'] or '-'} tokens"
+        )
+        if latency_metrics:
+            tokens_per_second = latency_metrics["tokens_per_second"]
+            content += (
+                f" | TTFT: {latency_metrics['time_to_first_token']:.2f}s | "
+                + (f"{tokens_per_second:.1f}" if tokens_per_second is not None else "-")
+                + " tokens/s"
+            )
+        divider = "░" * int(((120 - len(content)) / 2) - 2)
+
+        self.write(f"\n{divider} {content} {divider}\n")
+
+    def print_phases(self, totals, response_time):
+        """Print the time a message spent in each phase, under its footer."""
+        self.write(format_phase_table(totals, response_time) + "\n")
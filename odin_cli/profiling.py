@@ -0,0 +1,194 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from odin_cli.metrics import metric_labels
+
+# Phases in the order they're reported
+PHASES = ["parse", "template", "network", "tool", "write"]
+
+
+class Profiler:
+    """Timed spans of the work done by a command, grouped into phases.
+
+    Spans are only recorded once the profiler is enabled; until then `span`
+    does nothing beyond entering and leaving a context manager.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.spans = []
+        self.start_time = time.perf_counter()
+        self.cprofiles = []
+
+    @contextlib.contextmanager
+    def span(self, name, phase, **args):
+        if not self.enabled:
+            yield
+            return
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            labels = metric_labels.get()
+            span = {
+                "name": name,
+                "phase": phase,
+                "start": start_time - self.start_time,
+                "duration": duration,
+                "thread": threading.current_thread().name,
+                "message": labels.get("message") or None,
+                "args": args,
+            }
+            with self.lock:
+                self.spans.append(span)
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        self.start_time = time.perf_counter()
+        if cprofile:
+            self.start_cprofile()
+
+    def start_cprofile(self):
+        # cProfile only sees the thread that enables it, so each new thread
+        # enables its own profiler and they're merged when the dump is written
+        def enable_thread_profile(*args):
+            sys.setprofile(None)
+            profile = cProfile.Profile()
+            with self.lock:
+                self.cprofiles.append(profile)
+            profile.enable()
+
+        threading.setprofile(enable_thread_profile)
+        profile = cProfile.Profile()
+        self.cprofiles.append(profile)
+        profile.enable()
+
+    def phase_totals(self, message=None):
+        """Return the span count and total, mean and max seconds of each phase."""
+        totals = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            if message is not None and span["message"] != message:
+                continue
+            entry = totals.setdefault(
+                span["phase"], {"spans": 0, "total": 0.0, "max": 0.0}
+            )
+            entry["spans"] += 1
+            entry["total"] += span["duration"]
+            entry["max"] = max(entry["max"], span["duration"])
+        return {
+            phase: dict(
+                totals[phase], mean=totals[phase]["total"] / totals[phase]["spans"]
+            )
+            for phase in PHASES + sorted(set(totals) - set(PHASES))
+            if phase in totals
+        }
+
+    def write_chrome_trace(self, file_path):
+        """Write the spans as Chrome trace events (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            tid = thread_ids.setdefault(span["thread"], len(thread_ids) + 1)
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["phase"],
+                    "ph": "X",
+                    "ts": round(span["start"] * 1e6, 3),
+                    "dur": round(span["duration"] * 1e6, 3),
+                    "pid": pid,
+                    "tid": tid,
+                    "args": dict(span["args"], message=span["message"]),
+                }
+            )
+        for thread, tid in thread_ids.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread},
+                }
+            )
+        with open(file_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def write_cprofile(self, file_path):
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.cprofiles)
+        profiles[0].disable()
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(file_path)
+
+
+# Shared profiler, enabled by `--profile`
+profiler = Profiler()
+
+
+# Function to format phase totals as a table
+def format_phase_table(totals, wall_time=None):
+    lines = [f"{'Phase':<10} {'Spans':>6} {'Total':>10} {'Mean':>10} {'Max':>10}"]
+    for phase, entry in totals.items():
+        lines.append(
+            f"{phase:<10} {entry['spans']:>6} {entry['total']:>9.3f}s "
+            + f"{entry['mean']:>9.3f}s {entry['max']:>9.3f}s"
+        )
+    if wall_time is not None:
+        lines.append(f"{'wall time':<10} {'':>6} {wall_time:>9.3f}s")
+    return "\n".join(lines)
+
+
+# Function to start profiling when the command was given `--profile`
+def configure_profiling(args):
+    if getattr(args, "profile", False):
+        profiler.enable(cprofile=bool(getattr(args, "profile_cprofile", None)))
+
+
+# Function to print the phase breakdown and write the trace files of a command
+def finish_profiling(args):
+    if not profiler.enabled:
+        return
+
+    wall_time = time.perf_counter() - profiler.start_time
+    if profiler.cprofiles and args.profile_cprofile:
+        profiler.write_cprofile(args.profile_cprofile)
+    if args.profile_trace:
+        profiler.write_chrome_trace(args.profile_trace)
+    sys.stderr.write(
+        "\nProfile\n" + format_phase_table(profiler.phase_totals(), wall_time) + "\n"
+    )
+
+
+# Function to add the profiling flags to a command's parser
+def add_profile_arguments(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time parsing, templates, requests, tools and writes, and print a breakdown",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        default="odin-trace.json",
+        help="Chrome trace-event file written with --profile (default: odin-trace.json)",
+    )
+    parser.add_argument(
+        "--profile-cprofile",
+        help="Also write a cProfile dump of the command to this file",
+    )
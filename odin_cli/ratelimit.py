@@ -0,0 +1,378 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from odin_cli.logs import log_event
+from odin_cli.metrics import record_request
+from odin_cli.profiling import profiler
+
+# Error codes that providers use for throttling and transient failures
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+}
+TRANSIENT_CODES = {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+}
+TRANSIENT_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "EndpointConnectionError",
+    "ConnectTimeoutError",
+    "ReadTimeoutError",
+}
+
+# Defaults for the `rate_limits` config section
+default_rate_limit_settings = {
+    "max_retries": 5,
+    "base_delay": 1,
+    "max_delay": 60,
+    "max_concurrency": 16,
+    "models": {},
+}
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at `per_minute` tokens a minute.
+
+    Reservations may take the bucket below zero; the caller then waits for
+    the time it takes to refill the deficit, so waiters are served in order.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """Take `amount` tokens and return the seconds to wait before using them."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request larger than the bucket would otherwise wait forever
+        self.tokens -= min(amount, self.capacity)
+        return max(0, -self.tokens / self.rate)
+
+
+class ModelLimiter:
+    """Request and token limits plus an adaptive concurrency limit for a model.
+
+    The concurrency limit grows by one after that many successful requests and
+    halves when the provider throttles (additive increase, multiplicative
+    decrease), so it settles just below the account's quota.
+    """
+
+    def __init__(
+        self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=16
+    ):
+        self.condition = threading.Condition()
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0
+        self.decreased_at = 0
+        # Event loop futures of `acquire_async` calls waiting for a free slot
+        self.waiters = []
+
+    def reserve(self, tokens):
+        """Take a request and `tokens` from the buckets; return the seconds to wait."""
+        now = time.monotonic()
+        wait = self.paused_until - now
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1, now))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens, now))
+        return wait
+
+    def acquire(self, tokens=0):
+        with self.condition:
+            while self.in_flight >= int(self.concurrency):
+                self.condition.wait()
+            self.in_flight += 1
+            wait = self.reserve(tokens)
+
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """Like `acquire`, but waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.concurrency):
+                    self.in_flight += 1
+                    wait = self.reserve(tokens)
+                    break
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            await waiter
+
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.release(cancelled=True)
+                raise
+
+    def release(self, throttled=False, cancelled=False):
+        """Free a slot. A cancelled request leaves the concurrency limit as it
+        is, since it says nothing about the provider's quota."""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # Requests sent before the first 429 are likely to be throttled
+                # too, so only back off once per second
+                if now - self.decreased_at >= 1:
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self.decreased_at = now
+            elif not cancelled:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+            self.condition.notify_all()
+            for loop, waiter in self.waiters:
+                loop.call_soon_threadsafe(wake_waiter, waiter)
+            self.waiters = []
+
+    def pause(self, seconds):
+        """Hold back every request to this model for `seconds`."""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def record_tokens(self, difference):
+        """Correct the token bucket once a request's actual usage is known."""
+        if self.tokens and difference:
+            with self.condition:
+                self.tokens.tokens -= difference
+
+
+# Function to wake an `acquire_async` call, unless it was cancelled meanwhile
+def wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# Function to parse a Retry-After header (seconds or an HTTP date)
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Function to get the HTTP status and Retry-After delay of a provider error
+def describe_error(error):
+    """Return `(status, retry_after)` for OpenAI and botocore errors."""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        # botocore's ClientError
+        metadata = response.get("ResponseMetadata") or {}
+        status = metadata.get("HTTPStatusCode")
+        headers = metadata.get("HTTPHeaders") or {}
+        code = (response.get("Error") or {}).get("Code")
+        if code in THROTTLING_CODES:
+            status = 429
+        elif code in TRANSIENT_CODES:
+            status = status if status and status >= 500 else 503
+    else:
+        status = getattr(error, "status_code", None)
+        headers = getattr(response, "headers", None) or {}
+
+    retry_after = None
+    if headers.get("retry-after-ms"):
+        retry_after = parse_retry_after(headers["retry-after-ms"])
+        retry_after = retry_after / 1000 if retry_after is not None else None
+    if retry_after is None:
+        retry_after = parse_retry_after(headers.get("retry-after"))
+
+    return status, retry_after
+
+
+# Function to check if a failed request is worth retrying
+def is_retryable(error, status):
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError)) or any(
+        cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__
+    )
+
+
+# Function to estimate the tokens a request will use, about 4 characters each
+def estimate_tokens(payload, max_tokens=None):
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    return len(text) // 4 + (max_tokens or 0)
+
+
+class RequestScheduler:
+    """Send provider requests under per-model limits, retrying transient errors.
+
+    Throttled requests wait for the provider's Retry-After (and hold back the
+    model's other requests for as long), other transient errors back off
+    exponentially with full jitter.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(default_rate_limit_settings, **(settings or {}))
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def limiter(self, provider, model):
+        with self.lock:
+            key = (provider, model)
+            if key not in self.limiters:
+                limits = (self.settings.get("models") or {}).get(model) or {}
+                self.limiters[key] = ModelLimiter(
+                    requests_per_minute=limits.get("requests_per_minute"),
+                    tokens_per_minute=limits.get("tokens_per_minute"),
+                    max_concurrency=limits.get(
+                        "max_concurrency", self.settings["max_concurrency"]
+                    ),
+                )
+            return self.limiters[key]
+
+    def backoff_delay(self, attempt, retry_after=None):
+        delay = random.uniform(
+            0, min(self.settings["max_delay"], self.settings["base_delay"] * 2**attempt)
+        )
+        return max(delay, retry_after or 0)
+
+    def call(self, provider, model, request, tokens=0, count_tokens=None):
+        """Run `request()` for `model`, returning its result.
+
+        `tokens` is the estimated token usage, reserved from the model's token
+        bucket; `count_tokens(result)` may return the actual usage to correct
+        the estimate.
+        """
+        limiter = self.limiter(provider, model)
+        attempt = 0
+        while True:
+            limiter.acquire(tokens)
+            start_time = time.time()
+            try:
+                with profiler.span(
+                    f"{provider} {model}", "network", attempt=attempt + 1
+                ):
+                    result = request()
+            except Exception as e:
+                time.sleep(
+                    self.failed(provider, model, limiter, e, start_time, attempt)
+                )
+                attempt += 1
+                continue
+
+            self.succeeded(
+                provider, model, limiter, result, start_time, tokens, count_tokens
+            )
+            return result
+
+    async def call_async(self, provider, model, request, tokens=0, count_tokens=None):
+        """Like `call`, for a `request` that returns an awaitable."""
+        limiter = self.limiter(provider, model)
+        attempt = 0
+        while True:
+            await limiter.acquire_async(tokens)
+            start_time = time.time()
+            try:
+                with profiler.span(
+                    f"{provider} {model}", "network", attempt=attempt + 1
+                ):
+                    result = await request()
+            except asyncio.CancelledError:
+                limiter.release(cancelled=True)
+                raise
+            except Exception as e:
+                await asyncio.sleep(
+                    self.failed(provider, model, limiter, e, start_time, attempt)
+                )
+                attempt += 1
+                continue
+
+            self.succeeded(
+                provider, model, limiter, result, start_time, tokens, count_tokens
+            )
+            return result
+
+    def failed(self, provider, model, limiter, error, start_time, attempt):
+        """Record a failed attempt and return the delay before retrying it.
+
+        The error is re-raised when it isn't worth retrying or the retries
+        have run out.
+        """
+        record_request(provider, model, time.time() - start_time, error=error)
+        status, retry_after = describe_error(error)
+        limiter.release(throttled=status == 429)
+        if not is_retryable(error, status) or attempt >= self.settings["max_retries"]:
+            raise error
+
+        delay = self.backoff_delay(attempt, retry_after)
+        if status == 429:
+            limiter.pause(delay)
+        with self.lock:
+            self.retries += 1
+            self.throttled += status == 429
+        log_event(
+            event_type="WARNING",
+            message="request retried",
+            context={
+                "provider": provider,
+                "model": model,
+                "status": status,
+                "error": str(error),
+                "attempt": attempt + 1,
+                "delay": round(delay, 3),
+            },
+        )
+        return delay
+
+    def succeeded(
+        self, provider, model, limiter, result, start_time, tokens, count_tokens
+    ):
+        limiter.release()
+        record_request(provider, model, time.time() - start_time)
+        with self.lock:
+            self.requests += 1
+        if count_tokens:
+            actual = count_tokens(result)
+            if actual is not None:
+                limiter.record_tokens(actual - tokens)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+        }
+
+
+# Shared request scheduler, set up from the config by `configure_rate_limits`
+scheduler = RequestScheduler()
+
+
+# Function to configure the shared request scheduler
+def configure_rate_limits(config):
+    """Apply the `rate_limits` config section."""
+    scheduler.settings = dict(
+        default_rate_limit_settings, **((config or {}).get("rate_limits") or {})
+    )
+    scheduler.limiters = {}
+
+    return scheduler
@@ -0,0 +1,311 @@
+import asyncio
+import json
+import math
+import os
+import time
+from odin_cli.cache import cache_dir, write_atomic
+from odin_cli.logs import log_event
+
+# Provider name of the router, usable wherever `openai` or `bedrock` is
+ROUTER_PROVIDER = "router"
+
+# Defaults for the `router` config section
+default_router_settings = {
+    # Candidates of each route as `provider/model`; the router's model names the route
+    "routes": {},
+    # Send a duplicate request to the next candidate when the first is slow
+    "hedge": True,
+    # The duplicate is sent once the first request has taken longer than this
+    # percentile of its candidate's latencies...
+    "hedge_percentile": 95,
+    # ...or this many seconds, until the candidate has `min_samples` latencies
+    "hedge_delay": 10,
+    "min_samples": 5,
+    # Latencies kept per candidate
+    "window": 50,
+    # A candidate erroring on more than this share of its last `error_window`
+    # requests is skipped, until `cooldown` seconds after its last error
+    "max_error_rate": 0.5,
+    "error_window": 10,
+    "cooldown": 30,
+}
+
+
+# Function to get the provider and model of a `provider/model` candidate
+def split_candidate(candidate):
+    provider, _, model = candidate.partition("/")
+    return provider, model
+
+
+# Function to get a percentile of a list of values
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class Router:
+    """Sends each request to the fastest healthy candidate of its route.
+
+    Latencies and errors are tracked per candidate and kept in the cache
+    directory, so they carry over between runs. A request that's slower than
+    its candidate usually is gets a hedged duplicate on the next candidate,
+    and the first response wins; a failed request moves on to the next one.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(default_router_settings, **(settings or {}))
+        self.stats = None
+
+    def stats_path(self):
+        return os.path.join(cache_dir(), "router_stats.json")
+
+    def candidate_stats(self, candidate):
+        if self.stats is None:
+            try:
+                with open(self.stats_path(), "r") as file:
+                    self.stats = json.load(file)
+            except (OSError, ValueError):
+                self.stats = {}
+        stats = self.stats.setdefault(
+            candidate, {"latencies": [], "errors": [], "last_error": 0}
+        )
+        stats.setdefault("censored", [])
+        return stats
+
+    async def save_stats(self):
+        data = json.dumps(self.stats)
+        await asyncio.to_thread(write_atomic, self.stats_path(), data)
+
+    def record(self, candidate, latency=None, error=False, censored=False):
+        """Record a request's latency, or its failure. A `censored` latency is
+        how long a request ran before it lost to a hedge: a lower bound, kept
+        apart from the measured latencies."""
+        stats = self.candidate_stats(candidate)
+        if censored:
+            stats["censored"] = stats["censored"][-self.settings["window"] + 1 :]
+            stats["censored"].append(latency)
+            return
+        if latency is not None:
+            stats["latencies"] = stats["latencies"][-self.settings["window"] + 1 :]
+            stats["latencies"].append(latency)
+        if latency is not None or error:
+            stats["errors"] = stats["errors"][-self.settings["error_window"] + 1 :]
+            stats["errors"].append(1 if error else 0)
+        if error:
+            stats["last_error"] = time.time()
+
+    def is_healthy(self, candidate):
+        stats = self.candidate_stats(candidate)
+        errors = stats["errors"]
+        if not errors or sum(errors) / len(errors) <= self.settings["max_error_rate"]:
+            return True
+        return time.time() - stats["last_error"] > self.settings["cooldown"]
+
+    def typical_latency(self, candidate):
+        stats = self.candidate_stats(candidate)
+        # Lost races count toward the median, so a candidate that keeps losing
+        # them drops down the order even though it's never measured
+        latencies = stats["latencies"] + stats["censored"]
+        # Candidates without latencies yet go first, so every one gets measured
+        return percentile(latencies, 50) if latencies else 0
+
+    def hedge_deadline(self, candidate):
+        latencies = self.candidate_stats(candidate)["latencies"]
+        if len(latencies) < self.settings["min_samples"]:
+            return self.settings["hedge_delay"]
+        return percentile(latencies, self.settings["hedge_percentile"])
+
+    def candidates(self, route):
+        """Return the candidates of `route`, healthy ones first and fastest first."""
+        from odin_cli.plugins import PLUGINS
+
+        routes = self.settings["routes"] or {
+            "default": [
+                f"{name}/{plugin['default_model']}"
+                for name, plugin in PLUGINS.items()
+                if name != ROUTER_PROVIDER
+            ]
+        }
+        if route not in routes:
+            raise ValueError(
+                f"Unknown route '{route}'. Choose from: {', '.join(routes)}."
+            )
+        if not isinstance(routes[route], list):
+            raise ValueError(
+                f"Route '{route}' must be a list of provider/model candidates."
+            )
+        if not routes[route]:
+            raise ValueError(f"Route '{route}' has no candidates.")
+        for candidate in routes[route]:
+            provider, model = split_candidate(str(candidate))
+            if not provider or not model:
+                raise ValueError(
+                    f"Route '{route}' has a malformed candidate '{candidate}'. "
+                    "Candidates are written as provider/model."
+                )
+        return sorted(
+            routes[route],
+            key=lambda candidate: (
+                not self.is_healthy(candidate),
+                self.typical_latency(candidate),
+            ),
+        )
+
+    async def attempt(self, send, candidate, request):
+        provider, model = split_candidate(candidate)
+        start_time = time.monotonic()
+        try:
+            response = await send(provider, **dict(request, model=model))
+        except asyncio.CancelledError:
+            # Lost to a hedged request: it would have taken at least this long
+            self.record(candidate, time.monotonic() - start_time, censored=True)
+            raise
+        except ValueError:
+            # The candidate can't take this request (e.g. tools on Bedrock),
+            # which says nothing about its health
+            raise
+        except Exception:
+            self.record(candidate, error=True)
+            raise
+        self.record(candidate, time.monotonic() - start_time)
+        return response
+
+    async def complete(self, send, model, **request):
+        """Send `request` through `send(provider, **request)` to the candidates
+        of route `model` and return the first response."""
+        remaining = self.candidates(model)
+        tasks = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            candidate = remaining.pop(0)
+            tasks[asyncio.ensure_future(self.attempt(send, candidate, request))] = (
+                candidate
+            )
+            return candidate, time.monotonic()
+
+        primary, start_time = launch()
+        try:
+            while tasks:
+                timeout = None
+                if self.settings["hedge"] and not hedged and remaining:
+                    deadline = start_time + self.hedge_deadline(primary)
+                    timeout = max(0, deadline - time.monotonic())
+                done, _ = await asyncio.wait(
+                    tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    candidate, _ = launch()
+                    log_event(
+                        message="router request hedged",
+                        context={"route": model, "slow": primary, "hedge": candidate},
+                    )
+                    continue
+
+                for task in done:
+                    candidate = tasks.pop(task)
+                    if task.exception() is None:
+                        log_event(
+                            message="router request routed",
+                            context={
+                                "route": model,
+                                "candidate": candidate,
+                                "hedged": hedged,
+                                "failed": [str(error) for error in errors],
+                            },
+                        )
+                        return task.result()
+                    errors.append(task.exception())
+                    log_event(
+                        event_type="WARNING",
+                        message="router candidate failed",
+                        context={
+                            "route": model,
+                            "candidate": candidate,
+                            "error_message": f"Error: {str(task.exception())}",
+                        },
+                    )
+                if not tasks and remaining:
+                    primary, start_time = launch()
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Let cancelled requests record how long they took before saving
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.save_stats()
+
+    def stream(self, open_stream, model, **request):
+        return RoutedStream(self, open_stream, model, request)
+
+
+class RoutedStream:
+    """Streams a response from the fastest healthy candidate of a route.
+
+    A candidate that fails before its first chunk is replaced by the next
+    one; streams aren't hedged, since their chunks are printed as they come.
+    """
+
+    def __init__(self, router, open_stream, route, request):
+        self.router = router
+        self.open_stream = open_stream
+        self.route = route
+        self.request = request
+        self.response = None
+        self.metrics = None
+
+    async def __aiter__(self):
+        errors = []
+        try:
+            for candidate in self.router.candidates(self.route):
+                provider, model = split_candidate(candidate)
+                start_time = time.monotonic()
+                started = False
+                try:
+                    completion = self.open_stream(
+                        provider, **dict(self.request, model=model)
+                    )
+                    async for chunk in completion:
+                        started = True
+                        yield chunk
+                except Exception as e:
+                    if not isinstance(e, ValueError):
+                        self.router.record(candidate, error=True)
+                    if started:
+                        raise
+                    errors.append(e)
+                    log_event(
+                        event_type="WARNING",
+                        message="router candidate failed",
+                        context={
+                            "route": self.route,
+                            "candidate": candidate,
+                            "error_message": f"Error: {str(e)}",
+                        },
+                    )
+                    continue
+                self.router.record(candidate, time.monotonic() - start_time)
+                log_event(
+                    message="router request routed",
+                    context={"route": self.route, "candidate": candidate},
+                )
+                self.response = completion.response
+                self.metrics = completion.metrics
+                return
+            raise errors[-1]
+        finally:
+            await self.router.save_stats()
+
+
+# Shared router
+router = Router()
+
+
+# Function to configure the router
+def configure_router(config):
+    """Apply the `router` config section."""
+    router.settings = dict(
+        default_router_settings, **((config or {}).get("router") or {})
+    )
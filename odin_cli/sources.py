@@ -0,0 +1,208 @@
+import functools
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from odin_cli.cache import cache_dir, write_atomic
+from odin_cli.clients import boto3_client
+
+CHUNK_SIZE = 64 * 1024
+
+# Limits for fetched sources, set up from the config by `configure_sources`
+source_settings = {
+    "max_bytes": 32 * 1024 * 1024,
+    "timeout": 60,
+    "max_workers": 8,
+}
+
+
+class SourceTooLargeError(ValueError):
+    pass
+
+
+# Function to configure source fetching
+def configure_sources(config):
+    """Apply the `sources` config section."""
+    source_settings.update((config or {}).get("sources") or {})
+
+
+# Function to determine if a string is a valid URL
+def is_url(string):
+    try:
+        result = urlparse(string)
+        return all([result.scheme, result.netloc])
+    except ValueError:
+        return False
+
+
+# Function to check if a string is an S3 path
+def is_s3_path(string):
+    return string.startswith("s3://")
+
+
+# Function to get the shared HTTP session, so connections are kept alive
+@functools.lru_cache(maxsize=None)
+def http_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=source_settings["max_workers"])
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Function to make sure a source is within the size cap
+def check_size(size, source):
+    if size > source_settings["max_bytes"]:
+        raise SourceTooLargeError(
+            f"{source} is larger than {source_settings['max_bytes']} bytes"
+        )
+
+
+# Function to read a body in chunks, stopping once it exceeds the size cap
+def read_capped(chunks, source):
+    body = bytearray()
+    for chunk in chunks:
+        body.extend(chunk)
+        check_size(len(body), source)
+    return bytes(body)
+
+
+# Function to get the paths of a source's cached body and validators
+def cache_paths(source):
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    directory = cache_dir("sources", key[:2])
+    return os.path.join(directory, f"{key}.json"), os.path.join(directory, key)
+
+
+# Function to load a source's cached validators and body
+def load_cached(source):
+    meta_path, body_path = cache_paths(source)
+    try:
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        with open(body_path, "rb") as file:
+            return meta, file.read()
+    except (OSError, ValueError):
+        return None, None
+
+
+# Function to cache a source's body with the validators to revalidate it
+def store_cached(source, meta, body):
+    if not any(meta.values()):
+        return
+
+    meta_path, body_path = cache_paths(source)
+    write_atomic(body_path, body, mode="wb")
+    write_atomic(meta_path, json.dumps(meta))
+
+
+# Function to fetch a URL, revalidating any cached copy
+def fetch_url(source):
+    meta, cached_body = load_cached(source)
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with http_session().get(
+        source, headers=headers, stream=True, timeout=source_settings["timeout"]
+    ) as response:
+        if response.status_code == 304 and cached_body is not None:
+            check_size(len(cached_body), source)
+            return cached_body.decode(meta.get("encoding") or "utf-8", "replace")
+        response.raise_for_status()
+
+        check_size(int(response.headers.get("Content-Length") or 0), source)
+        body = read_capped(response.iter_content(CHUNK_SIZE), source)
+        encoding = response.encoding or "utf-8"
+        store_cached(
+            source,
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "encoding": encoding,
+            },
+            body,
+        )
+
+    return body.decode(encoding, "replace")
+
+
+# Function to fetch an S3 object, revalidating any cached copy
+def fetch_s3(source):
+    from botocore.exceptions import ClientError
+
+    bucket, key = source[5:].split("/", 1)
+    meta, cached_body = load_cached(source)
+    conditions = {"IfNoneMatch": meta["etag"]} if meta and meta.get("etag") else {}
+
+    try:
+        response = boto3_client("s3").get_object(Bucket=bucket, Key=key, **conditions)
+    except ClientError as e:
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status == 304 and cached_body is not None:
+            check_size(len(cached_body), source)
+            return cached_body.decode("utf-8")
+        raise
+
+    try:
+        check_size(response.get("ContentLength", 0), source)
+    except SourceTooLargeError:
+        response["Body"].close()
+        raise
+    body = read_capped(response["Body"].iter_chunks(CHUNK_SIZE), source)
+    store_cached(source, {"etag": response.get("ETag")}, body)
+
+    return body.decode("utf-8")
+
+
+# Function to read content from a file, URL, or S3 path
+def read_content_from_source(source):
+    # Check if source is an S3 path (before URLs, since `s3://` parses as one)
+    if is_s3_path(source):
+        return fetch_s3(source)
+
+    # Check if source is a URL
+    if is_url(source):
+        return fetch_url(source)
+
+    # Otherwise, treat it as a file path
+    if os.path.isfile(source):
+        with open(source, "r") as file:
+            return file.read()
+
+    return source
+
+
+# Function to read several sources in parallel
+def read_contents_from_sources(sources):
+    """Return the content of each source, in the same order."""
+    if len(sources) <= 1:
+        return [read_content_from_source(source) for source in sources]
+
+    workers = min(len(sources), source_settings["max_workers"])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read_content_from_source, sources))
+
+
+# Function to check if a template value refers to a source, like `@notes.txt`
+def is_source_reference(value):
+    if not isinstance(value, str) or not value.startswith("@"):
+        return False
+    source = value[1:]
+    return is_url(source) or is_s3_path(source) or os.path.isfile(source)
+
+
+# Function to replace `@source` template values with the sources' content
+def resolve_source_variables(variables):
+    """Fetch every `key=@source` value (in parallel) and return the variables."""
+    keys = [key for key, value in variables.items() if is_source_reference(value)]
+    contents = read_contents_from_sources([variables[key][1:] for key in keys])
+
+    return {**variables, **dict(zip(keys, contents))}
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import os
+import re
+import yaml
+from odin_cli.cache import cache_dir, write_atomic
+
+# Use libyaml's loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Lines that can appear inside a frontmatter block: `key: value`, indented
+# continuations, list items, comments and blank lines
+FRONTMATTER_LINE_PATTERN = re.compile(r"^(?:[A-Za-z_][\w-]*\s*:(?:\s|$)|\s|-\s|#|$)")
+
+# Metadata keys that `get_chat_items` can look up without scanning every document
+INDEXED_KEYS = ("type", "thread_id")
+INDEXABLE_TYPES = (str, int, float, bool)
+
+
+class ChatSpec(dict):
+    """The documents of a chat spec by id, indexed by `type` and `thread_id`."""
+
+    def __init__(self, documents=()):
+        super().__init__()
+        self.indexes = {key: {} for key in INDEXED_KEYS}
+        for document in documents:
+            self.add(document)
+
+    def add(self, document):
+        doc_id = document["metadata"].get("id")
+        if doc_id in self:
+            self.unindex(doc_id)
+        self[doc_id] = document
+        for key, index in self.indexes.items():
+            value = document["metadata"].get(key)
+            if isinstance(value, INDEXABLE_TYPES):
+                index.setdefault(value, {})[doc_id] = None
+
+    def unindex(self, doc_id):
+        metadata = self[doc_id]["metadata"]
+        for key, index in self.indexes.items():
+            value = metadata.get(key)
+            if isinstance(value, INDEXABLE_TYPES):
+                index.get(value, {}).pop(doc_id, None)
+
+    def lookup(self, key, value):
+        """Return the documents whose metadata `key` equals `value`."""
+        return [self[doc_id] for doc_id in self.indexes[key].get(value, {})]
+
+
+# Function to parse a frontmatter block, or return None if it isn't one
+def parse_frontmatter(lines):
+    try:
+        metadata = yaml.load("".join(lines), Loader=YAML_LOADER)
+    except yaml.YAMLError:
+        return None
+    if isinstance(metadata, dict) and ("id" in metadata or "type" in metadata):
+        return metadata
+    return None
+
+
+# Function to iterate over the documents of a chat spec in a single pass
+def iter_documents(lines):
+    """Yield `{"metadata", "content"}` for each document as soon as it ends.
+
+    A `---` line only starts a new document when the lines up to the next
+    `---` form a YAML mapping with an `id` or `type`, so `---` (and other
+    text) inside message content is kept as content.
+    """
+    metadata = None
+    content = []
+    candidate = None
+
+    for line in lines:
+        is_delimiter = line.rstrip("\r\n") == "---"
+        if candidate is not None:
+            if is_delimiter:
+                frontmatter = parse_frontmatter(candidate[1:])
+                if frontmatter is not None:
+                    if metadata is not None:
+                        yield {"metadata": metadata, "content": "".join(content)}
+                    metadata = frontmatter
+                    content = []
+                    candidate = None
+                    continue
+                # Not frontmatter after all; this `---` may open the next block
+                content.extend(candidate)
+                candidate = [line]
+            elif FRONTMATTER_LINE_PATTERN.match(line):
+                candidate.append(line)
+            else:
+                content.extend(candidate)
+                content.append(line)
+                candidate = None
+        elif is_delimiter:
+            candidate = [line]
+        else:
+            content.append(line)
+
+    if candidate is not None:
+        content.extend(candidate)
+    if metadata is not None:
+        yield {"metadata": metadata, "content": "".join(content)}
+
+
+# Function to parse the documents of a chat spec that have an id
+def parse_chat(lines):
+    documents = []
+    for document in iter_documents(lines):
+        if document["metadata"].get("id", None):
+            document["content"] = document["content"].strip()
+            documents.append(document)
+    return documents
+
+
+# Function to open a chat spec, reusing the parsed documents when unchanged
+def open_chat(file_path):
+    """Parse a chat spec into a `ChatSpec`.
+
+    Parsed documents are cached under the odin cache directory, keyed on the
+    file's path. The cache is used as-is when the file's mtime and size are
+    unchanged, and after a content hash check otherwise.
+    """
+    stat = os.stat(file_path)
+    path_key = hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+
+    entry = None
+    try:
+        cache_path = os.path.join(cache_dir("specs"), f"{path_key}.json")
+        with open(cache_path, "r", encoding="utf-8") as file:
+            entry = json.load(file)
+    except Exception:
+        # A missing or unreadable cache entry just means parsing the file
+        entry = None
+
+    if (
+        entry
+        and entry["mtime_ns"] == stat.st_mtime_ns
+        and entry["size"] == stat.st_size
+    ):
+        return ChatSpec(entry["documents"])
+
+    with open(file_path, "rb") as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    if entry and entry["hash"] == digest:
+        documents = entry["documents"]
+    else:
+        text = io.StringIO(data.decode("utf-8"), newline=None)
+        documents = parse_chat(text)
+
+    entry = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": digest,
+        "documents": documents,
+    }
+    try:
+        data = json.dumps(entry)
+        # Metadata JSON can't hold as-is (dates, non-string keys) isn't cached
+        if json.loads(data) == entry:
+            write_atomic(os.path.join(cache_dir("specs"), f"{path_key}.json"), data)
+    except (OSError, TypeError, ValueError):
+        pass
+
+    return ChatSpec(documents)
+
+
+# Function to filter and sort chat items based on metadata
+def get_chat_items(chat, sort=None, **filters):
+    indexed = [key for key in filters if key in getattr(chat, "indexes", {})]
+    if isinstance(filters.get("id"), INDEXABLE_TYPES):
+        candidates = [chat[filters["id"]]] if filters["id"] in chat else []
+    elif indexed:
+        candidates = chat.lookup(indexed[0], filters[indexed[0]])
+    else:
+        candidates = chat.values()
+
+    items = [
+        doc
+        for doc in candidates
+        if all(doc["metadata"].get(key) == value for key, value in filters.items())
+    ]
+
+    # Sort the items if a sort key is provided
+    if sort:
+        items.sort(key=lambda x: x["metadata"].get(sort, float("inf")))
+
+    return items
@@ -0,0 +1,81 @@
+import functools
+import re
+from collections import namedtuple
+
+# Placeholders look like `{name}`; anything else in braces is left alone
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_][\w.-]*)\}")
+
+# A compiled template alternates literals and variable names:
+# literals[0] names[0] literals[1] ... names[-1] literals[-1]
+CompiledTemplate = namedtuple("CompiledTemplate", ["literals", "names"])
+
+
+class TemplateError(ValueError):
+    pass
+
+
+# Function to compile a template, cached by its content
+@functools.lru_cache(maxsize=1024)
+def compile_template(template):
+    literals = []
+    names = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(template):
+        literals.append(template[position : match.start()])
+        names.append(match.group(1))
+        position = match.end()
+    literals.append(template[position:])
+
+    return CompiledTemplate(tuple(literals), tuple(names))
+
+
+# Function to render a template in a single pass over its compiled form
+def render_template(template, variables, strict=False):
+    """Substitute `{name}` placeholders with values from `variables`.
+
+    Values are inserted as-is, so placeholders inside them aren't expanded.
+    Missing variables are left in place, or raise a `TemplateError` when
+    `strict` is set.
+    """
+    compiled = compile_template(template)
+    if not compiled.names:
+        return template
+
+    parts = [compiled.literals[0]]
+    for name, literal in zip(compiled.names, compiled.literals[1:]):
+        if name in variables:
+            parts.append(str(variables[name]))
+        elif strict:
+            raise TemplateError(f"Missing template variable '{name}'")
+        else:
+            parts.append(f"{{{name}}}")
+        parts.append(literal)
+
+    return "".join(parts)
+
+
+# Function to find missing and unused variables across a set of templates
+def check_variables(templates, variables):
+    """Return the sorted (missing, unused) variable names."""
+    names = set()
+    for template in templates:
+        names.update(compile_template(template).names)
+
+    return sorted(names - set(variables)), sorted(set(variables) - names)
+
+
+# Function to turn `key=value` arguments into a dict of template variables
+def parse_variables(template_args):
+    if isinstance(template_args, dict):
+        return template_args
+
+    variables = {}
+    for arg in template_args or []:
+        key, separator, value = arg.partition("=")
+        if not separator:
+            raise TemplateError(
+                f"Template argument '{arg}' should be in the form key=value"
+            )
+        variables[key] = value
+
+    return variables
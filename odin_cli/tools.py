@@ -1,47 +1,42 @@
-from openai import OpenAI
-from pathlib import Path
 import json
-import requests
-
-# Initialize the OpenAI client
-client = OpenAI()
+from odin_cli.clients import openai_client
+from odin_cli.content import store_content
+from odin_cli.output import write_output
+from odin_cli.ratelimit import scheduler
+from odin_cli.sources import http_session
 
 
 # Function to save content to a file
 def save_file(path: str, content: str):
-    file_path = Path(path)
-
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with file_path.open("w") as f:
-        f.write(content)
+    write_output(path, content)
 
-    return json.dumps({"path": path, "content": content})
+    # The result refers to the content rather than repeating it, so it isn't
+    # sent again with every later message; `inline` brings it back
+    return json.dumps({"path": path, **store_content(content)})
 
 
 def generate_image(path: str, prompt: str):
-    file_path = Path(path)
-
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-
     print(f"\npath: {path}\n")
     print(f"\nprompt: {prompt}\n")
-    response = client.images.generate(
-        model="dall-e-3",
-        prompt=prompt,
-        size="1024x1024",
-        quality="standard",
-        style="vivid",
-        n=1,
+    response = scheduler.call(
+        "openai",
+        "dall-e-3",
+        lambda: openai_client().images.generate(
+            model="dall-e-3",
+            prompt=prompt,
+            size="1024x1024",
+            quality="standard",
+            style="vivid",
+            n=1,
+        ),
     )
 
     image_url = response.data[0].url
-    image_response = requests.get(image_url)
+    image_response = http_session().get(image_url)
     image_response.raise_for_status()
 
     # Write the image content to the file
-    with file_path.open("wb") as f:
-        f.write(image_response.content)
+    write_output(path, image_response.content)
 
     return json.dumps({"path": path, "image_url": image_url, "prompt": prompt})
 
@@ -84,3 +79,16 @@ tool_schemas = {
         },
     },
 }
+
+# Execution limits for each tool: seconds before a call times out, and how many
+# calls to the tool may run at the same time
+tool_limits = {
+    "save_file": {"timeout": 30, "max_concurrency": 8},
+    "generate_image": {"timeout": 180, "max_concurrency": 3},
+}
+
+default_tool_limits = {"timeout": 60, "max_concurrency": 4}
+
+
+def get_tool_limits(name):
+    return {**default_tool_limits, **tool_limits.get(name, {})}
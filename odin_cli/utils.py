@@ -1,53 +1,19 @@
 import sys
 import os
-import requests
-import boto3
-import json
 import yaml
-import re
-from urllib.parse import urlparse
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
-import importlib
 import datetime
-import glob
-import frontmatter
-
-
-# Function to determine if a string is a valid URL
-def is_url(string):
-    try:
-        result = urlparse(string)
-        return all([result.scheme, result.netloc])
-    except ValueError:
-        return False
-
-
-# Function to check if a string is an S3 path
-def is_s3_path(string):
-    return string.startswith("s3://")
-
-
-# Function to read content from a file, URL, or S3 path
-def read_content_from_source(source):
-    # Check if source is a URL
-    if is_url(source):
-        response = requests.get(source)
-        return response.text
-
-    # Check if source is an S3 path
-    if is_s3_path(source):
-        s3 = boto3.client("s3")
-        bucket, key = source[5:].split("/", 1)
-        response = s3.get_object(Bucket=bucket, Key=key)
-        return response["Body"].read().decode("utf-8")
-
-    # Otherwise, treat it as a file path
-    if os.path.isfile(source):
-        with open(source, "r") as file:
-            return file.read()
-
-    return source
+from odin_cli.context import ContextWindow
+from odin_cli.history import ChatHistory
+from odin_cli.plugins import PLUGINS, load_plugin
+from odin_cli.profiling import profiler
+from odin_cli.sources import (
+    is_s3_path,
+    is_url,
+    read_content_from_source,
+    resolve_source_variables,
+)
+from odin_cli.spec import get_chat_items, open_chat
+from odin_cli.template import check_variables, parse_variables, render_template
 
 
 # Function to read from stdin if prompt is empty
@@ -72,52 +38,20 @@ def read_stdin_if_piped(prompt, piped, pipe_key):
 
 # Function to process template arguments
 def process_template_arguments(prompt, template_args):
-    for arg in template_args:
-        key, value = arg.split("=")
-        prompt = prompt.replace(f"{{{key}}}", value)
-    return prompt
-
-
-def open_chat(file_path):
-    with open(file_path, "r") as file:
-        content = file.read()
-
-    # Regex Pattern Explanation:
-    # - (---\n(?:.*?:.*?\n)+---): Matches frontmatter enclosed in '---'.
-    # - ([\s\S]*?): Non-greedy capture of content after frontmatter.
-    # - (?=\n---|$): Stops at next frontmatter or end of file.
-    pattern = r"(---\n(?:.*?:.*?\n)+---)([\s\S]*?)(?=\n---|$)"
-
-    # Find all matches of the pattern in the content
-    matches = re.findall(pattern, content)
-    parsed_documents = {}
-
-    # Iterate over the matches and parse them
-    for frontmatter_str, content_str in matches:
-        parsed_doc = frontmatter.loads(frontmatter_str + "\n" + content_str)
-        doc_id = parsed_doc.metadata.get("id", None)
-        if doc_id:
-            parsed_documents[doc_id] = {
-                "metadata": parsed_doc.metadata,
-                "content": parsed_doc.content.strip(),
-            }
-
-    return parsed_documents
-
-
-def get_chat_items(chat, sort=None, **filters):
-    # Filter items based on provided keyword arguments
-    items = [
-        doc
-        for doc in chat.values()
-        if all(doc["metadata"].get(key) == value for key, value in filters.items())
-    ]
-
-    # Sort items by the specified field if provided
-    if sort:
-        items.sort(key=lambda x: x["metadata"].get(sort, float("inf")))
-
-    return items
+    variables = parse_variables(template_args)
+    if not variables:
+        return prompt
+    variables = resolve_source_variables(variables)
+
+    missing, unused = check_variables([prompt], variables)
+    for description, names in [("Missing", missing), ("Unused", unused)]:
+        if names:
+            print(
+                f"Warning: {description} template variables: {', '.join(names)}",
+                file=sys.stderr,
+            )
+    with profiler.span("process_template", "template"):
+        return render_template(prompt, variables)
 
 
 def create_chat_banner(service_name, chat_file):
@@ -140,59 +74,88 @@ def create_chat_banner(service_name, chat_file):
 
 
 # Function to handle interactive chat
-def handle_interactive_chat(service_name, chat_file, initial_prompt, model):
+def handle_interactive_chat(
+    service_name,
+    chat_file,
+    initial_prompt,
+    model,
+    resume_turns=10,
+    context=None,
+    **options,
+):
+    """Chat with a service, appending each turn to `chat_file` as it happens.
+
+    On resume only the last `resume_turns` turns are printed. `context` holds
+    the `ContextWindow` settings that limit how much history is sent.
+    """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.history import FileHistory
+
     # Print the chat session banner
     print(create_chat_banner(service_name, chat_file))
 
-    session = PromptSession(history=FileHistory(chat_file) if chat_file else None)
+    # Prompt input history is kept next to the chat file, not in it
+    session = PromptSession(
+        history=FileHistory(f"{chat_file}.input-history") if chat_file else None
+    )
 
-    chat_history = []
-    if chat_file:
-        if os.path.exists(chat_file):
-            with open(chat_file, "r") as file:
-                chat_history = json.load(file)
-
-            # Display existing chat history
-            for entry in chat_history:
-                print(f"You: {entry['prompt']}")
-                print(f"{service_name}: {entry['response']}")
-        else:
-            print(f"Chat file '{chat_file}' not found. A new file will be created.")
+    if chat_file and not os.path.exists(chat_file):
+        print(f"Chat file '{chat_file}' not found. A new file will be created.")
+    chat_history = ChatHistory(chat_file)
+    context_window = ContextWindow(chat_history, model=model, **(context or {}))
 
-    if initial_prompt:
-        # Process initial prompt (if provided)
-        # Placeholder for AI interaction code
-        chat_history.append({"prompt": initial_prompt, "response": "AI response here"})
+    # Display the end of the existing chat history
+    earlier_turns = len(chat_history) - resume_turns
+    if earlier_turns > 0:
+        print(f"... {earlier_turns} earlier turns")
+    for entry in chat_history.tail(resume_turns):
+        print(f"You: {entry['prompt']}")
+        print(f"{service_name}: {entry['response']}")
 
     plugin = load_plugin(service_name)
+    user_input = initial_prompt
     while True:
         try:
-            user_input = session.prompt("> ")
+            if user_input is None:
+                user_input = session.prompt("> ")
             if user_input.lower() in ["exit", "quit", "q"]:
                 break
 
             ai_response = plugin.process_interactive_chat(
-                service_name, user_input, chat_history, model
+                service_name,
+                user_input,
+                chat_history,
+                model,
+                context_window=context_window,
+                **options,
             )
-            chat_history.append({"prompt": user_input, "response": ai_response})
-            print(ai_response)
+            chat_history.append(user_input, ai_response)
+            if not options.get("stream") or ai_response.startswith("Error:"):
+                print(ai_response)
         except KeyboardInterrupt:
-            continue
+            pass
         except EOFError:
             break
-
-    if chat_file:
-        with open(chat_file, "w") as file:
-            json.dump(chat_history, file)
+        user_input = None
 
     return "Chat session ended."
 
 
+# Function to print an async stream of a response as it arrives and return its text
+async def print_stream_async(completion):
+    async for chunk in completion:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+
+    return completion.response["choices"][0]["message"]["content"]
+
+
 # Function to handle single prompt interaction
-def handle_single_prompt(service_name, prompt, model):
+def handle_single_prompt(service_name, prompt, model, **options):
     plugin = load_plugin(service_name.lower())
 
-    return plugin.process_single_prompt(service_name, prompt, model)
+    return plugin.process_single_prompt(service_name, prompt, model, **options)
 
 
 def load_config():
@@ -209,25 +172,5 @@ def load_config():
     return {}  # Return an empty config if no file is found
 
 
-def load_plugin(plugin_name):
-    try:
-        plugin = importlib.import_module(f".{plugin_name}", "odin_cli.plugins")
-
-        return plugin
-    except (ImportError, AssertionError):
-        raise ImportError(
-            f"Plugin for {plugin_name} not found or does not conform to the interface."
-        )
-
-
 def load_plugins(subparsers, config):
-    package_directory = os.path.dirname(__file__)
-    plugins_glob = f"{package_directory}/plugins/*.py"
-
-    plugins = []
-    for plugin_path in glob.glob(plugins_glob):
-        plugin_name = os.path.basename(plugin_path)[:-3]
-        if plugin_name != "__init__":
-            plugin = load_plugin(plugin_name)
-            plugins.append(plugin)
-    return plugins
+    return list(PLUGINS)